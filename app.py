@@ -3,18 +3,21 @@ Fortune Teller Streamlit App.
 """
 import streamlit as st
 import streamlit.components.v1 as components
-import json
+import base64
 import io
 import zipfile
 from textwrap import dedent
-import urllib.parse
 import re
-import calendar
+from collections import defaultdict
 from datetime import date, datetime
 import time
 import os
+import logging
 from pathlib import Path
-from logic import calculate_bazi, get_fortune_analysis, build_user_context, BaziChartGenerator, BaziPatternCalculator, ZhouyiCalculator
+from types import MappingProxyType
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from logic import calculate_bazi, get_fortune_analysis, get_batch_fortune_analysis, build_user_context, BaziChartGenerator, BaziPatternCalculator, ZhouyiCalculator
 try:
     from logic import calculate_fortune_cycles
 except Exception:
@@ -23,33 +26,148 @@ try:
     from logic import BaziAuxiliaryCalculator
 except Exception:
     BaziAuxiliaryCalculator = None
-from bazi_utils import BaziCompatibilityCalculator, build_couple_prompt, draw_hexagram_svg, build_oracle_prompt, BaziEnergyCalculator, EnergyPieChartGenerator
-from china_cities import CHINA_CITIES, SHICHEN_HOURS, get_shichen_mid_hour
+from bazi_utils import analyze_compatibility, build_couple_prompt, draw_hexagram_svg, build_oracle_prompt, ORACLE_SYSTEM_PROMPT, BaziEnergyCalculator, EnergyPieChartGenerator
+from china_cities import CHINA_CITIES, SHICHEN_OPTIONS, SHICHEN_MID_HOURS, get_shichen_mid_hour
 from lunar_python import Lunar, LunarYear
 from dotenv import load_dotenv
-from pdf_generator import generate_report_pdf, generate_grouped_report_images
-from llm_client import get_llm_client
-from text_utils import clean_markdown_for_display
+from llm_client import get_llm_client, coalesce_stream, cached_stream, prefetch_stream, response_cache_key
+from text_utils import clean_markdown_for_display, IncrementalMarkdownCleaner
+from ui_helpers import (
+    format_lunar_day, format_year, format_month, format_day, format_two_digits,
+    days_in_month, day_options, year_options, year_index, safe_date, parse_hh_mm,
+    profile_card_html, loaded_profile_notice_html, chart_container_html, FormState,
+)
+from session_codec import dumps_json, loads_json, pack_snapshot, unpack_snapshot
+from ui_dialogs import save_profile_dialog
 from db_utils import init_db, save_profile, profile_exists, get_all_profiles, get_profile_by_id, delete_profile, update_session_data, check_daily_quota, consume_daily_quota
 
 PROJECT_ROOT = Path(__file__).resolve().parent
 load_dotenv(dotenv_path=PROJECT_ROOT / ".env")
 PERF_LOG = os.getenv("PERF_LOG") == "1"
-
-
-def get_app_version() -> str:
-    """Read the app version from VERSION file; fallback if missing."""
+logger = logging.getLogger("fortune_teller")
+
+# Dev-only: FT_PROFILE=1 profiles each full script run and prints the top 25 functions by tottime.
+# Runs cut short by st.rerun()/st.stop() and fragment-only reruns are not reported; their
+# profiler is kept in session state and disabled at the start of the session's next run,
+# so an abandoned profiler is never left enabled.
+FT_PROFILE = os.getenv("FT_PROFILE") == "1"
+if FT_PROFILE:
+    import cProfile
+    import pstats
+    _abandoned_profiler = st.session_state.get("_script_profiler")
+    if _abandoned_profiler is not None:
+        _abandoned_profiler.disable()
+    _script_profiler = cProfile.Profile()
+    st.session_state._script_profiler = _script_profiler
+    _script_profiler.enable()
+
+
+@st.cache_resource
+def load_app_css() -> str:
+    """Read the app stylesheet once and return it wrapped in a <style> tag."""
+    css = (PROJECT_ROOT / "assets" / "styles.css").read_text(encoding="utf-8")
+    return f"<style>\n{css}</style>"
+
+
+@st.cache_resource(show_spinner=False)
+def _read_app_version() -> str:
+    """Read the app version from VERSION file once per process; fallback if missing."""
     try:
         return (PROJECT_ROOT / "VERSION").read_text(encoding="utf-8").strip()
     except Exception:
         return "v0.0.0"
 
+
+# app.py re-executes on every rerun; cache_resource keeps the file read to once per process
+APP_VERSION = _read_app_version()
+
+
+def get_app_version() -> str:
+    """Return the cached app version."""
+    return APP_VERSION
+
 # Daily limit for default API key (to prevent abuse)
 DEFAULT_API_DAILY_LIMIT = 20
 
-# Pre-sorted city list for searchable dropdown
-SORTED_CITY_LIST = sorted(CHINA_CITIES.keys())
-SORTED_CITY_LIST_LOWER = [city.lower() for city in SORTED_CITY_LIST]
+# Provider quota/rate-limit errors arrive as the opening text of a reply, so only its head is scanned
+QUOTA_ERROR_MARKERS = ("quota", "limit", "429")
+QUOTA_SCAN_CHARS = 1024
+
+
+def has_quota_error(text: str) -> bool:
+    """True if text looks like a provider quota / rate-limit error."""
+    text = text.lower()
+    return any(marker in text for marker in QUOTA_ERROR_MARKERS)
+
+# Bounds for the in-session analysis history (memory + localStorage size)
+MAX_RESPONSES = 50
+MAX_RESPONSE_CHARS = 200_000
+
+NO_CITY_OPTION = "不选择 (使用北京时间)"
+
+
+@st.cache_resource(show_spinner=False)
+def _city_table() -> tuple:
+    """
+    City → longitude table plus its sorted names and unfiltered selectbox options.
+    app.py re-executes on every rerun, so the sort happens here once per process.
+    """
+    sorted_names = tuple(sorted(CHINA_CITIES))
+    return CHINA_CITIES, sorted_names, (NO_CITY_OPTION, *sorted_names)
+
+
+# Pre-sorted city list for searchable dropdown; unfiltered options for empty search / no matches
+CITY_LONGITUDES, SORTED_CITY_LIST, ALL_CITY_OPTIONS = _city_table()
+
+# Static (byte-identical) script emitted once after a reset that asked to clear storage
+CLEAR_STORAGE_HTML = "<script>localStorage.removeItem('fortune_teller_data');</script>"
+
+# Parse birth_datetime strings ("1990年1月1日 12:00") when saving profiles
+BIRTH_DATE_RE = re.compile(r'(\d+)年(\d+)月(\d+)日')
+BIRTH_TIME_RE = re.compile(r'(\d{1,2})[:：](\d{2})')
+
+
+@st.cache_resource
+def get_city_search_index() -> tuple:
+    """
+    Build (char_index, bigram_index, folded_names) over SORTED_CITY_LIST.
+    The indexes map a 1- or 2-char key (case-folded) to the set of city indices containing it.
+    folded_names holds lowercase forms only for names that have case (CJK names are their own fold).
+    """
+    char_index = defaultdict(set)
+    bigram_index = defaultdict(set)
+    folded_names = {}
+    for idx, city in enumerate(SORTED_CITY_LIST):
+        city_folded = city.lower()
+        if city_folded != city:
+            folded_names[idx] = city_folded
+        for ch in city_folded:
+            char_index[ch].add(idx)
+        for i in range(len(city_folded) - 1):
+            bigram_index[city_folded[i:i + 2]].add(idx)
+    return dict(char_index), dict(bigram_index), folded_names
+
+
+def filter_cities(query_lower: str) -> list:
+    """Return cities (in sorted order) whose lowercase name contains query_lower."""
+    char_index, bigram_index, folded_names = get_city_search_index()
+    if len(query_lower) == 1:
+        candidates = char_index.get(query_lower, set())
+        return [SORTED_CITY_LIST[idx] for idx in sorted(candidates)]
+
+    postings = []
+    for i in range(len(query_lower) - 1):
+        posting = bigram_index.get(query_lower[i:i + 2])
+        if not posting:
+            return []
+        postings.append(posting)
+    candidates = set.intersection(*postings)
+    # Bigram hits are necessary but not sufficient; confirm with a substring check
+    return [
+        SORTED_CITY_LIST[idx]
+        for idx in sorted(candidates)
+        if query_lower in folded_names.get(idx, SORTED_CITY_LIST[idx])
+    ]
 
 
 def searchable_city_select(label: str, key_prefix: str, default_index: int = 0):
@@ -80,24 +198,15 @@ def searchable_city_select(label: str, key_prefix: str, default_index: int = 0):
         label_visibility="collapsed"
     )
     
-    # Filter city list based on search query
+    # Options with "不选择" first; only build a new sequence when a filter is active
+    options = ALL_CITY_OPTIONS
     if search_query:
-        query_lower = search_query.lower()
-        filtered_cities = [
-            city
-            for city, city_lower in zip(SORTED_CITY_LIST, SORTED_CITY_LIST_LOWER)
-            if query_lower in city_lower
-        ]
-    else:
-        filtered_cities = SORTED_CITY_LIST
-    
-    # Build options list with "不选择" option first
-    options = ["不选择 (使用北京时间)"] + filtered_cities
-    
-    # If no matches, show all cities
-    if len(options) == 1 and search_query:
-        st.caption(f"未找到匹配 '{search_query}' 的城市，显示全部")
-        options = ["不选择 (使用北京时间)"] + SORTED_CITY_LIST
+        filtered_cities = filter_cities(search_query.lower())
+        if filtered_cities:
+            options = (NO_CITY_OPTION, *filtered_cities)
+        else:
+            # If no matches, show all cities
+            st.caption(f"未找到匹配 '{search_query}' 的城市，显示全部")
     
     # City selectbox
     selected = st.selectbox(
@@ -109,41 +218,218 @@ def searchable_city_select(label: str, key_prefix: str, default_index: int = 0):
     )
     
     # Return selected city and longitude
-    if selected != "不选择 (使用北京时间)":
-        longitude = CHINA_CITIES.get(selected)
+    if selected != NO_CITY_OPTION:
+        longitude = CITY_LONGITUDES.get(selected)
         st.caption(f"📐 经度: {longitude}°E")
         return selected, longitude
     else:
         return selected, None
 
 
+# Installed into the parent page on each bridge load: scrolls to the topic named by the latest
+# data-scroll-target marker instead of loading a fresh iframe per scroll
+SCROLL_BRIDGE_HTML = '''
+<script>
+(function() {
+    const win = window.parent;
+    const doc = win.document;
+    // Callbacks from a detached iframe stop running, so each bridge load replaces
+    // the previous observer instead of trusting one installed by an earlier iframe
+    if (win.__ftScrollBridge) win.__ftScrollBridge.disconnect();
+    function handleScrollMarker() {
+        const marker = doc.querySelector("[data-scroll-target]");
+        if (!marker || marker.dataset.scrollNonce === win.__ftScrollNonce) return;
+        win.__ftScrollNonce = marker.dataset.scrollNonce;
+        const target = doc.getElementById(marker.dataset.scrollTarget);
+        if (target) {
+            // Small delay to ensure layout has settled
+            win.setTimeout(function() {
+                target.scrollIntoView({behavior: "smooth", block: "start"});
+            }, 100);
+        }
+    }
+    const observer = new win.MutationObserver(handleScrollMarker);
+    observer.observe(doc.body, {
+        childList: true, subtree: true, attributes: true, attributeFilter: ["data-scroll-nonce"]
+    });
+    win.__ftScrollBridge = observer;
+    handleScrollMarker();
+})();
+</script>
+'''
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def render_response_html(topic_key: str, topic_display: str, response: str, highlighted: bool = False) -> tuple:
+    """
+    Return (anchor_id, block_html) for a stored response.
+    Cached so finished responses are not re-cleaned or re-formatted on every rerun.
+    """
+    anchor_id = f"response_{topic_key}".replace(" ", "_")
+    cleaned_response = clean_markdown_for_display(response)
+    if highlighted:
+        header = (
+            f'<div id="{anchor_id}" class="topic-header" style="background: rgba(255, 215, 0, 0.2); '
+            f'padding: 10px; border-radius: 8px; scroll-margin-top: 100px;">{topic_display} 👈</div>'
+        )
+    else:
+        header = f'<div id="{anchor_id}" class="topic-header">{topic_display}</div>'
+    return anchor_id, f'{header}<div class="fortune-text">{cleaned_response}</div>'
+
+
+@st.fragment
+def render_response_history() -> None:
+    """
+    Render the stored analysis history (append-only).
+    Runs as a fragment so fragment-scoped reruns leave the history untouched;
+    each entry's HTML comes from the render_response_html cache and the whole
+    history is sent as one markdown element instead of one per entry.
+    """
+    # Get scroll target before clearing it
+    scroll_target = st.session_state.scroll_to_topic
+    scroll_anchor_id = None
+
+    blocks = []
+    for topic_key, topic_display, response in st.session_state.responses:
+        is_scroll_target = bool(scroll_target) and topic_key == scroll_target
+        anchor_id, block_html = render_response_html(topic_key, topic_display, response, is_scroll_target)
+        if is_scroll_target:
+            scroll_anchor_id = anchor_id
+        blocks.append(block_html)
+
+    if scroll_anchor_id:
+        # Scroll request marker; the bridge below picks it up (the nonce makes repeat clicks distinct)
+        scroll_nonce = st.session_state.get("_scroll_seq", 0) + 1
+        st.session_state._scroll_seq = scroll_nonce
+        blocks.append(
+            f'<span hidden data-scroll-target="{scroll_anchor_id}" data-scroll-nonce="{scroll_nonce}"></span>'
+        )
+    if blocks:
+        st.markdown("".join(blocks), unsafe_allow_html=True)
+
+    # Constant content, so Streamlit keeps the same iframe mounted across reruns
+    components.html(SCROLL_BRIDGE_HTML, height=0)
+
+    if scroll_anchor_id:
+        # Clear scroll target after rendering
+        st.session_state.scroll_to_topic = None
+
+
+def _conversation_history_entry(topic_display: str, response_text: str) -> tuple:
+    """(topic name without the 📌/💬 prefix, full response) for LLM context continuity."""
+    return topic_display.removeprefix("📌 ").removeprefix("💬 "), response_text
+
+
+def _conversation_history_current(history, responses: list) -> bool:
+    """True if the cached history was built from this responses list and is in sync."""
+    return (
+        history is not None
+        and st.session_state.get("_conversation_history_src") is responses
+        and len(history) == len(responses)
+    )
+
+
+def get_conversation_history() -> list:
+    """
+    Previous analyses as (topic_name, response) tuples.
+    Maintained incrementally by append_response; rebuilt only when the responses
+    list was replaced (profile load, reset, localStorage restore).
+    """
+    responses = st.session_state.responses
+    history = st.session_state.get("_conversation_history")
+    if not _conversation_history_current(history, responses):
+        history = [_conversation_history_entry(display, response) for _, display, response in responses]
+        st.session_state._conversation_history = history
+        st.session_state._conversation_history_src = responses
+    return history
+
+
+def append_response(topic_key: str, topic_display: str, response_text: str) -> None:
+    """
+    Append an analysis result to the history, dropping the oldest entries
+    once MAX_RESPONSES or MAX_RESPONSE_CHARS is exceeded.
+    """
+    responses = st.session_state.responses
+    # Keep the conversation-history view in lockstep when it is current for this list
+    history = st.session_state.get("_conversation_history")
+    if not _conversation_history_current(history, responses):
+        history = None
+    responses.append((topic_key, topic_display, response_text))
+    if history is not None:
+        history.append(_conversation_history_entry(topic_display, response_text))
+
+    total_chars = sum(len(r[2]) for r in responses)
+    while len(responses) > 1 and (len(responses) > MAX_RESPONSES or total_chars > MAX_RESPONSE_CHARS):
+        dropped_key, _, dropped_text = responses.pop(0)
+        if history is not None:
+            history.pop(0)
+        total_chars -= len(dropped_text)
+        # Let the topic button trigger a fresh analysis instead of scrolling to nothing
+        st.session_state.clicked_topics.discard(dropped_key)
+        st.session_state.responses_trimmed = True
+
+
+# Snapshot fields that only change when the chart is (re)calculated, with their defaults.
+# Invariant: these session values are only ever replaced by assignment, never mutated
+# in place (no pattern_info[...] = ..., .update(), .append() ...). _stable_snapshot_json
+# caches by identity and would persist stale JSON otherwise; copy before editing one.
+STABLE_SNAPSHOT_FIELDS = (
+    ("bazi_result", ""),
+    ("time_info", ""),
+    ("user_context", ""),
+    ("pattern_info", None),
+    ("bazi_svg", None),
+    ("energy_data", None),
+    ("energy_svg", None),
+    ("dominant_element", None),
+    ("weakest_element", None),
+    ("fortune_cycles", None),
+    ("birthplace", None),
+    ("gender", None),
+    ("birth_datetime", None),
+)
+
+
+def _stable_snapshot_json() -> str:
+    """
+    JSON for the chart-level fields, reused until one of them is replaced.
+    The cache keeps references to the values, so an identity check is enough
+    (see the in-place mutation invariant on STABLE_SNAPSHOT_FIELDS).
+    """
+    values = tuple(st.session_state.get(key, default) for key, default in STABLE_SNAPSHOT_FIELDS)
+    cached = st.session_state.get("_stable_json_cache")
+    if cached and all(old is new for old, new in zip(cached[0], values)):
+        return cached[1]
+    stable_json = dumps_json({key: value for (key, _), value in zip(STABLE_SNAPSHOT_FIELDS, values)})
+    st.session_state._stable_json_cache = (values, stable_json)
+    return stable_json
 
 
 def serialize_session_state() -> str:
     """
     Capture critical session state as JSON string for persistence.
     Used for auto-saving session after LLM responses.
+    The chart-level half is cached by identity; the per-turn half is re-encoded
+    only when its content changes (responses is mutated in place, so identity won't do).
     """
-    snapshot = {
-        "bazi_result": st.session_state.get("bazi_result", ""),
-        "time_info": st.session_state.get("time_info", ""),
-        "user_context": st.session_state.get("user_context", ""),
-        "clicked_topics": list(st.session_state.get("clicked_topics", set())),
-        "responses": st.session_state.get("responses", []),
-        "pattern_info": st.session_state.get("pattern_info"),
-        "bazi_svg": st.session_state.get("bazi_svg"),
-        "energy_data": st.session_state.get("energy_data"),
-        "energy_svg": st.session_state.get("energy_svg"),
-        "dominant_element": st.session_state.get("dominant_element"),
-        "weakest_element": st.session_state.get("weakest_element"),
-        "fortune_cycles": st.session_state.get("fortune_cycles"),
-        "birthplace": st.session_state.get("birthplace"),
-        "gender": st.session_state.get("gender"),
-        "birth_datetime": st.session_state.get("birth_datetime"),
-        "is_first_response": st.session_state.get("is_first_response", True),
-        "custom_question_count": st.session_state.get("custom_question_count", 0),
-    }
-    return json.dumps(snapshot, ensure_ascii=False)
+    clicked_topics = st.session_state.get("clicked_topics", set())
+    responses = st.session_state.get("responses", [])
+    is_first_response = st.session_state.get("is_first_response", True)
+    custom_question_count = st.session_state.get("custom_question_count", 0)
+    # The key holds references only; == short-circuits on identical elements, so it stays cheap
+    delta_key = (frozenset(clicked_topics), tuple(responses), is_first_response, custom_question_count)
+    cached = st.session_state.get("_delta_json_cache")
+    if cached and cached[0] == delta_key:
+        delta_json = cached[1]
+    else:
+        delta_json = dumps_json({
+            "clicked_topics": list(clicked_topics),
+            "responses": responses,
+            "is_first_response": is_first_response,
+            "custom_question_count": custom_question_count,
+        })
+        st.session_state._delta_json_cache = (delta_key, delta_json)
+    return '{"_stable":' + _stable_snapshot_json() + ',"_delta":' + delta_json + "}"
 
 
 def restore_session_state(session_data_json: str) -> bool:
@@ -152,7 +438,9 @@ def restore_session_state(session_data_json: str) -> bool:
     Returns True if restoration was successful.
     """
     try:
-        snapshot = json.loads(session_data_json)
+        snapshot = loads_json(session_data_json)
+        if "_stable" in snapshot:
+            snapshot = {**snapshot["_stable"], **snapshot["_delta"]}
         
         st.session_state.bazi_result = snapshot.get("bazi_result", "")
         st.session_state.time_info = snapshot.get("time_info", "")
@@ -177,10 +465,30 @@ def restore_session_state(session_data_json: str) -> bool:
         st.session_state.has_result = True
         
         return True
-    except Exception as e:
-        print(f"Failed to restore session state: {e}")
+    except Exception:
+        logger.warning("Failed to restore session state", exc_info=True)
         return False
 
+
+@st.cache_resource(show_spinner=False)
+def _session_saver_pool() -> ThreadPoolExecutor:
+    """
+    Process-wide worker for fire-and-forget session saves.
+    A single worker keeps writes in submission order, so an older snapshot can
+    never land after a newer one for the same profile.
+    """
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-saver")
+
+
+def save_session_in_background(profile_id: str) -> None:
+    """
+    Persist the current session for profile_id without blocking the rerun.
+    The snapshot is taken here (session_state is only readable from the script thread);
+    only the database write runs on the pool. Writes run in order, so the last save wins, as before.
+    """
+    session_data = serialize_session_state()
+    _session_saver_pool().submit(update_session_data, profile_id, session_data)
+
 # Default API configuration (Gemini) - Load from environment for security
 # IMPORTANT: Set GEMINI_API_KEY in .env file, do NOT hardcode API keys!
 DEFAULT_API_KEY = os.getenv("GEMINI_API_KEY", "")
@@ -188,43 +496,204 @@ DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai"
 DEFAULT_MODEL = "gemini-3-flash-preview"
 
 # Predefined AI providers (updated 2026-01)
-AI_PROVIDERS = {
-    "默认 (Gemini)": {
-        "base_url": DEFAULT_BASE_URL,
-        "models": ["gemini-3-pro-preview", "gemini-3-flash-preview", "gemini-2.0-flash-exp", "gemini-1.5-pro"]
-    },
-    "DeepSeek": {
-        "base_url": "https://api.deepseek.com",
-        "models": ["deepseek-chat", "deepseek-reasoner"]
-    },
-    "OpenAI": {
-        "base_url": "https://api.openai.com/v1",
-        "models": ["gpt-4.5-preview", "gpt-4o", "gpt-4o-mini", "o1", "o1-mini"]
-    },
-    "Anthropic (Claude)": {
-        "base_url": "https://api.anthropic.com/v1",
-        "models": ["claude-3-5-sonnet-20241022", "claude-3-5-haiku-20241022", "claude-3-opus-20240229"]
-    },
-    "Google Gemini": {
-        "base_url": "https://generativelanguage.googleapis.com/v1beta/openai",
-        "models": ["gemini-3-pro-preview", "gemini-3-flash-preview", "gemini-2.0-flash-exp", "gemini-1.5-pro"]
-    },
-    "Moonshot (月之暗面)": {
-        "base_url": "https://api.moonshot.cn/v1",
-        "models": ["moonshot-v1-128k", "moonshot-v1-32k", "moonshot-v1-8k"]
-    },
-    "Zhipu (智谱)": {
-        "base_url": "https://open.bigmodel.cn/api/paas/v4",
-        "models": ["glm-4-plus", "glm-4-0520", "glm-4-flash"]
-    },
-    "自定义 (Custom)": {
-        "base_url": "",
-        "models": []
+@st.cache_resource(show_spinner=False)
+def _load_ai_providers() -> MappingProxyType:
+    """Build the read-only provider table once per process (not on every rerun)."""
+    providers = {
+        "默认 (Gemini)": {
+            "base_url": DEFAULT_BASE_URL,
+            "models": ("gemini-3-pro-preview", "gemini-3-flash-preview", "gemini-2.0-flash-exp", "gemini-1.5-pro")
+        },
+        "DeepSeek": {
+            "base_url": "https://api.deepseek.com",
+            "models": ("deepseek-chat", "deepseek-reasoner")
+        },
+        "OpenAI": {
+            "base_url": "https://api.openai.com/v1",
+            "models": ("gpt-4.5-preview", "gpt-4o", "gpt-4o-mini", "o1", "o1-mini")
+        },
+        "Anthropic (Claude)": {
+            "base_url": "https://api.anthropic.com/v1",
+            "models": ("claude-3-5-sonnet-20241022", "claude-3-5-haiku-20241022", "claude-3-opus-20240229")
+        },
+        "Google Gemini": {
+            "base_url": "https://generativelanguage.googleapis.com/v1beta/openai",
+            "models": ("gemini-3-pro-preview", "gemini-3-flash-preview", "gemini-2.0-flash-exp", "gemini-1.5-pro")
+        },
+        "Moonshot (月之暗面)": {
+            "base_url": "https://api.moonshot.cn/v1",
+            "models": ("moonshot-v1-128k", "moonshot-v1-32k", "moonshot-v1-8k")
+        },
+        "Zhipu (智谱)": {
+            "base_url": "https://open.bigmodel.cn/api/paas/v4",
+            "models": ("glm-4-plus", "glm-4-0520", "glm-4-flash")
+        },
+        "自定义 (Custom)": {
+            "base_url": "",
+            "models": ()
+        }
     }
-}
+    return MappingProxyType({name: MappingProxyType(cfg) for name, cfg in providers.items()})
+
+
+AI_PROVIDERS = _load_ai_providers()
+AI_PROVIDER_NAMES = tuple(AI_PROVIDERS)
 
 # Fortune analysis topics
-ANALYSIS_TOPICS = ["整体命格", "大运流年", "事业运势", "感情运势", "开运建议", "健康建议", "大师解惑"]
+ANALYSIS_TOPICS = ("整体命格", "大运流年", "事业运势", "感情运势", "开运建议", "健康建议", "大师解惑")
+
+
+# Compatibility-mode topics (display order), their icons and focus instructions
+COUPLE_TOPICS = ("缘分契合度", "婚姻前景", "避雷指南", "对方旺我吗")
+COUPLE_TOPIC_SET = frozenset(COUPLE_TOPICS)
+COUPLE_TOPIC_ICONS = {"缘分契合度": "💖", "婚姻前景": "💍", "避雷指南": "💣", "对方旺我吗": "💰"}
+COUPLE_PROMPTS = {
+    "缘分契合度": "请重点从【性格互补】和【灵魂羁绊】的角度分析。判断两人是正缘还是孽缘，用唯美的比喻描述这段关系。",
+    "婚姻前景": "请重点分析【未来5年的流年走势】。判断两人结婚的概率，最佳结婚年份，以及未来可能遇到的感情危机年份。",
+    "避雷指南": "请重点分析两人的【矛盾引爆点】。例如一方冷战一方暴躁。请给出具体的、心理学层面的沟通建议和哄人技巧。",
+    "对方旺我吗": "请重点分析【五行能量的相互影响】。判断乙方是否能补足甲方的喜用神。和对方在一起，甲方的财运、事业运是会提升还是被消耗？"
+}
+
+# Header of the couple context appended to user_context (details and score follow)
+COMPATIBILITY_CONTEXT_TEMPLATE = """
+【双人合盘信息】
+
+**甲方 (我)：**
+{bazi_result}
+性别：{gender}
+
+**乙方 (Ta)：**
+{partner_bazi_result}
+性别：{partner_gender}
+
+**后端计算的日柱关系：**
+"""
+
+# Static / templated HTML for the results page
+ELEMENT_COLOR_EMOJI = {"木": "🟢", "火": "🔴", "土": "🟠", "金": "🟡", "水": "🔵"}
+ENERGY_METRICS_TEMPLATE = '''
+<div style="display: flex; justify-content: center; gap: 60px; margin: 20px 0;">
+    <div style="text-align: center;">
+        <div style="color: #888; font-size: 0.9rem; margin-bottom: 5px;">⬆️ 最强五行</div>
+        <div style="font-size: 2rem; font-weight: bold; color: #FFFFFF;">{dominant_icon} {dominant}</div>
+        <div style="color: #2ecc71; font-size: 0.9rem;">↑ {dominant_pct}%</div>
+    </div>
+    <div style="text-align: center;">
+        <div style="color: #888; font-size: 0.9rem; margin-bottom: 5px;">⬇️ 最弱五行</div>
+        <div style="font-size: 2rem; font-weight: bold; color: #FFFFFF;">{weakest_icon} {weakest}</div>
+        <div style="color: #e74c3c; font-size: 0.9rem;">↓ {weakest_pct}%</div>
+    </div>
+</div>
+'''
+# Mobile shake detection for the coin toss. Runs inside the component iframe, so the
+# button lives in window.parent.document; its reference is cached until Streamlit replaces it.
+SHAKE_DETECTION_HTML = '''
+<script>
+(function() {
+    // Prevent duplicate initialization
+    if (window.shakeHandlerInitialized) return;
+    window.shakeHandlerInitialized = true;
+
+    // Squared-magnitude threshold (~20 m/s^2) and minimum gap between tosses
+    const SHAKE_THRESHOLD_SQ = 400;
+    const SHAKE_COOLDOWN_MS = 600;
+    var lastShakeTime = 0;
+    var cachedBtn = null;
+
+    function findShakeButton() {
+        // The button is re-created after every toss (new widget key), so re-scan once it is detached
+        if (cachedBtn && cachedBtn.isConnected) return cachedBtn;
+        cachedBtn = null;
+        var buttons = window.parent.document.querySelectorAll('button');
+        for (var i = 0; i < buttons.length; i++) {
+            if (buttons[i].textContent.includes('投掷铜钱')) {
+                cachedBtn = buttons[i];
+                break;
+            }
+        }
+        return cachedBtn;
+    }
+
+    function handleMotion(event) {
+        // Cheapest test first: most events arrive inside the cooldown window
+        var now = Date.now();
+        if (now - lastShakeTime < SHAKE_COOLDOWN_MS) return;
+
+        var acceleration = event.accelerationIncludingGravity;
+        if (!acceleration) return;
+
+        var ax = acceleration.x || 0, ay = acceleration.y || 0, az = acceleration.z || 0;
+        if (ax * ax + ay * ay + az * az <= SHAKE_THRESHOLD_SQ) return;
+
+        lastShakeTime = now;
+        var btn = findShakeButton();
+        if (btn) {
+            btn.click();
+        }
+    }
+
+    // Check if DeviceMotionEvent requires permission (iOS 13+)
+    if (typeof DeviceMotionEvent !== 'undefined' && typeof DeviceMotionEvent.requestPermission === 'function') {
+        // iOS 13+ - need to request permission on user gesture
+        if (!window.motionPermissionRequested) {
+            window.motionPermissionRequested = true;
+            // Automatically try to add listener after any user interaction
+            document.addEventListener('click', function requestMotionPermission() {
+                DeviceMotionEvent.requestPermission()
+                    .then(function(permissionState) {
+                        if (permissionState === 'granted') {
+                            window.addEventListener('devicemotion', handleMotion, { passive: true });
+                        }
+                    })
+                    .catch(console.error);
+                document.removeEventListener('click', requestMotionPermission);
+            }, { once: true });
+        }
+    } else if (window.DeviceMotionEvent) {
+        // Non-iOS or older iOS - can add listener directly
+        window.addEventListener('devicemotion', handleMotion, { passive: true });
+    }
+})();
+</script>
+'''
+DOWNLOAD_LINK_TEMPLATE = '''
+<a href="data:{mime};base64,{b64_data}"
+   download="{filename}"
+   style="
+       display: inline-flex;
+       align-items: center;
+       justify-content: center;
+       padding: 10px 20px;
+       background: linear-gradient(145deg, #4A90D9, #357ABD);
+       color: white;
+       text-decoration: none;
+       border-radius: 8px;
+       font-size: 16px;
+       font-weight: 500;
+       box-shadow: 0 4px 15px rgba(74, 144, 217, 0.3);
+       transition: all 0.3s ease;
+       width: 100%;
+       border: none;
+   ">
+    {label}
+</a>
+'''
+ORACLE_REMINDER_HTML = '''
+<div style="background: linear-gradient(145deg, rgba(255, 215, 0, 0.15), rgba(255, 140, 0, 0.1)); 
+            border: 1px solid rgba(255, 215, 0, 0.4); 
+            border-radius: 12px; 
+            padding: 15px 20px; 
+            margin: 15px 0;
+            text-align: center;">
+    <p style="color: #FFD700; font-family: 'Noto Serif SC', serif; font-size: 1.1rem; margin: 0;">
+        🙏 请在心中默念您的问题三遍后，再投掷铜钱
+    </p>
+    <p style="color: #CCCCCC; font-size: 0.9rem; margin-top: 8px; margin-bottom: 0;">
+        诚心诚意，心诚则灵
+    </p>
+</div>
+'''
+
 
 # Page Configuration
 st.set_page_config(
@@ -233,689 +702,260 @@ st.set_page_config(
     layout="centered"
 )
 
-# Initialize session state
+def _make_session_defaults() -> dict:
+    """Return fresh default values for all app-level session state keys."""
+    return {
+        "bazi_calculated": False,
+        "has_result": False,  # Controls which page to show
+        "bazi_result": "",
+        "time_info": "",
+        "user_context": "",
+        "clicked_topics": set(),
+        "responses": [],  # List of (topic_key, topic_display, response) tuples
+        "show_custom_input": False,
+        "custom_question_count": 0,
+        "time_mode": "exact",  # "exact" or "shichen"
+        "is_first_response": True,
+        "scroll_to_topic": None,
+        "is_generating": False,
+        "data_loaded_from_storage": False,
+        "clear_storage_requested": False,
+        "default_api_usage_count": 0,
+        "using_default_api": True,
+        "calendar_mode": "solar",  # "solar" or "lunar"
+        "compatibility_mode": False,
+        "partner_calendar_mode": "solar",
+        "partner_time_mode": "exact",
+        "partner_bazi": None,
+        "partner_info": None,
+        "compatibility_result": None,
+        "fortune_cycles": None,
+        # Oracle (每日一卦) session state
+        "oracle_mode": False,
+        "oracle_question": "",
+        "oracle_shake_count": 0,
+        "oracle_hex_result": None,
+        "oracle_used_today": False,
+        "oracle_usage_date": None,
+        "image_zip_link_html": None,
+        # Form inputs; profile loads write here and the widgets are seeded from it
+        "form": FormState(),
+        # Profile session state for Input-First pattern
+        "loaded_profile": None,
+        "loaded_profile_id": None,
+        "pending_profile_load": None,  # Profile to load on next rerun
+        # Form values captured for the save-profile dialog
+        "_save_gender": "男",
+        "_save_year": 1990,
+        "_save_month": 1,
+        "_save_day": 1,
+        "_save_hour": "午时 (11:00-13:00)",
+        "_save_city": None,
+        "_save_is_lunar": False,
+    }
+
+
+# Initialize session state once per session (only missing keys; fresh instances for mutable defaults).
+# Later reruns skip building the defaults entirely; resets overwrite via their own helpers.
 if "bazi_calculated" not in st.session_state:
-    st.session_state.bazi_calculated = False
-if "has_result" not in st.session_state:
-    st.session_state.has_result = False  # Controls which page to show
-if "bazi_result" not in st.session_state:
-    st.session_state.bazi_result = ""
-if "time_info" not in st.session_state:
-    st.session_state.time_info = ""
-if "user_context" not in st.session_state:
-    st.session_state.user_context = ""
-if "clicked_topics" not in st.session_state:
-    st.session_state.clicked_topics = set()
-if "responses" not in st.session_state:
-    st.session_state.responses = []  # List of (topic_key, topic_display, response) tuples
-if "show_custom_input" not in st.session_state:
-    st.session_state.show_custom_input = False
-if "custom_question_count" not in st.session_state:
-    st.session_state.custom_question_count = 0
-if "time_mode" not in st.session_state:
-    st.session_state.time_mode = "exact"  # "exact" or "shichen"
-if "is_first_response" not in st.session_state:
-    st.session_state.is_first_response = True
-if "scroll_to_topic" not in st.session_state:
-    st.session_state.scroll_to_topic = None
-if "is_generating" not in st.session_state:
-    st.session_state.is_generating = False
-if "data_loaded_from_storage" not in st.session_state:
-    st.session_state.data_loaded_from_storage = False
-if "clear_storage_requested" not in st.session_state:
-    st.session_state.clear_storage_requested = False
-if "default_api_usage_count" not in st.session_state:
-    st.session_state.default_api_usage_count = 0
-if "using_default_api" not in st.session_state:
-    st.session_state.using_default_api = True
-if "calendar_mode" not in st.session_state:
-    st.session_state.calendar_mode = "solar"  # "solar" or "lunar"
-if "compatibility_mode" not in st.session_state:
-    st.session_state.compatibility_mode = False
-if "partner_bazi" not in st.session_state:
-    st.session_state.partner_bazi = None
-if "partner_info" not in st.session_state:
-    st.session_state.partner_info = None
-if "compatibility_result" not in st.session_state:
-    st.session_state.compatibility_result = None
-if "fortune_cycles" not in st.session_state:
-    st.session_state.fortune_cycles = None
-# Oracle (每日一卦) session state
-if "oracle_mode" not in st.session_state:
-    st.session_state.oracle_mode = False
-if "oracle_question" not in st.session_state:
-    st.session_state.oracle_question = ""
-if "oracle_shake_count" not in st.session_state:
-    st.session_state.oracle_shake_count = 0
-if "oracle_hex_result" not in st.session_state:
-    st.session_state.oracle_hex_result = None
-if "oracle_used_today" not in st.session_state:
-    st.session_state.oracle_used_today = False
-if "oracle_usage_date" not in st.session_state:
-    st.session_state.oracle_usage_date = None
-if "image_zip" not in st.session_state:
-    st.session_state.image_zip = None
-
-# ========== Form Input Session State Keys ==========
-# These bind to form widgets with key= parameter for auto-update when loading profiles
-if "input_gender" not in st.session_state:
-    st.session_state.input_gender = "男"
-if "input_birth_date" not in st.session_state:
-    st.session_state.input_birth_date = date(1990, 1, 1)
-if "input_birth_hour" not in st.session_state:
-    st.session_state.input_birth_hour = 12
-if "input_birth_minute" not in st.session_state:
-    st.session_state.input_birth_minute = 0
-if "input_lunar_year" not in st.session_state:
-    st.session_state.input_lunar_year = 1990
-if "input_lunar_month" not in st.session_state:
-    st.session_state.input_lunar_month = "1月"
-if "input_lunar_day" not in st.session_state:
-    st.session_state.input_lunar_day = 1
-
-# Check query parameters for localStorage data
-query_params = st.query_params
-if "fortune_data" in query_params and not st.session_state.data_loaded_from_storage:
-    try:
-        encoded_data = query_params["fortune_data"]
-        decoded_data = urllib.parse.unquote(encoded_data)
-        saved_data = json.loads(decoded_data)
-        
-        # Restore session state from saved data
-        st.session_state.bazi_calculated = saved_data.get("bazi_calculated", False)
-        st.session_state.bazi_result = saved_data.get("bazi_result", "")
-        st.session_state.time_info = saved_data.get("time_info", "")
-        st.session_state.user_context = saved_data.get("user_context", "")
-        st.session_state.clicked_topics = set(saved_data.get("clicked_topics", []))
-        st.session_state.responses = [tuple(r) for r in saved_data.get("responses", [])]
-        st.session_state.birthplace = saved_data.get("birthplace", "未指定")
-        st.session_state.gender = saved_data.get("gender", "男")
-        st.session_state.is_first_response = saved_data.get("is_first_response", True)
-        st.session_state.custom_question_count = saved_data.get("custom_question_count", 0)
-        st.session_state.data_loaded_from_storage = True
-        
-        # Clear query params after loading
-        st.query_params.clear()
-        st.rerun()
-    except Exception as e:
-        # If parsing fails, just continue with fresh state
+    st.session_state.update({
+        key: value
+        for key, value in _make_session_defaults().items()
+        if key not in st.session_state
+    })
+
+def apply_local_storage_data(saved_data: dict) -> None:
+    """Restore session state from the browser-side (localStorage) snapshot."""
+    st.session_state.bazi_calculated = saved_data.get("bazi_calculated", False)
+    st.session_state.bazi_result = saved_data.get("bazi_result", "")
+    st.session_state.time_info = saved_data.get("time_info", "")
+    st.session_state.user_context = saved_data.get("user_context", "")
+    st.session_state.clicked_topics = set(saved_data.get("clicked_topics", []))
+    st.session_state.responses = [tuple(r) for r in saved_data.get("responses", [])]
+    st.session_state.birthplace = saved_data.get("birthplace", "未指定")
+    st.session_state.gender = saved_data.get("gender", "男")
+    st.session_state.is_first_response = saved_data.get("is_first_response", True)
+    st.session_state.custom_question_count = saved_data.get("custom_question_count", 0)
+
+
+# Reads localStorage in the browser and hands the payload back as the component value
+local_storage_loader = components.declare_component(
+    "local_storage_loader",
+    path=str(PROJECT_ROOT / "assets" / "local_storage_loader"),
+)
+
+# On initial page load, pull any saved data from localStorage (before the page renders)
+if not st.session_state.bazi_calculated and not st.session_state.data_loaded_from_storage:
+    stored_data = local_storage_loader(key="local_storage_loader", default=None)
+    # None = component has not reported yet; "" = nothing stored
+    if stored_data is not None:
         st.session_state.data_loaded_from_storage = True
-        st.query_params.clear()
+        if stored_data:
+            try:
+                # Payload is pack_snapshot output (legacy plain-JSON payloads still accepted)
+                apply_local_storage_data(unpack_snapshot(stored_data))
+            except Exception:
+                # If parsing fails, just continue with fresh state
+                logger.warning("Failed to load saved data from localStorage", exc_info=True)
 
-# Custom CSS for styling
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Noto+Serif+SC:wght@400;700&display=swap');
-    
-    /* ===== Base Styles ===== */
-    .main {
-        background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
-    }
-    
-    .stApp {
-        background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
-    }
-    
-    h1 {
-        font-family: 'Noto Serif SC', serif;
-        text-align: center;
-        color: #FFE57A;
-        text-shadow: 0 0 8px rgba(255, 229, 122, 0.6), 0 2px 3px rgba(0, 0, 0, 0.6);
-        margin-bottom: 30px;
-        font-size: 2.3rem;
-        font-weight: 800;
-        letter-spacing: 2.5px;
-    }
-    
-    h2, h3, h4, h5 {
-        font-family: 'Noto Serif SC', serif;
-        color: #FFD700 !important;
-        font-weight: 700 !important;
-        text-shadow: 0 1px 3px rgba(0,0,0,0.8);
-        margin-top: 1.5rem;
-        margin-bottom: 1rem;
-    }
-    
-    .bazi-display {
-        font-family: 'Noto Serif SC', serif;
-        font-size: 2rem;
-        text-align: center;
-        color: #fff;
-        background: linear-gradient(145deg, rgba(255, 215, 0, 0.1), rgba(255, 140, 0, 0.1));
-        border: 2px solid rgba(255, 215, 0, 0.3);
-        border-radius: 15px;
-        padding: 25px;
-        margin: 20px 0;
-        box-shadow: 0 8px 32px rgba(255, 215, 0, 0.2);
-        backdrop-filter: blur(10px);
-    }
+# Custom CSS for styling (read once per process, see assets/styles.css)
+st.markdown(load_app_css(), unsafe_allow_html=True)
 
-    .bazi-table-wrap {
-        margin: 0;
-        overflow-x: auto;
-        border-radius: 12px;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.05);
-        padding: 0;
-        background: transparent;
-    }
+# Initialize database on startup
+init_db()
 
-    .bazi-table-stack {
-        display: flex;
-        flex-direction: column;
-        gap: 0;
-        margin: 0;
-        padding: 0;
-        background: #ffffff;
-        border-radius: 12px;
-        overflow: hidden;
-    }
 
-    .bazi-table-stack .bazi-table-wrap + .bazi-table-wrap {
-        margin-top: 0;
-    }
+# chart_data keys in the order of pattern_info's per-pillar vectors
+CHART_PILLAR_NAMES = ("year", "month", "day", "hour")
 
-    .bazi-table-stack .bazi-table-wrap {
-        margin: 0 !important;
-        padding: 0 !important;
-    }
+# Five elements in display order for the energy context block
+ENERGY_ELEMENTS = ("木", "火", "土", "金", "水")
 
-    .basic-info-wrap {
-        border-radius: 12px;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.05);
-        background: #ffffff;
-    }
 
-    .bazi-table-stack .bazi-table-wrap:not(:last-child) .bazi-table tr:last-child td,
-    .bazi-table-stack .bazi-table-wrap:not(:last-child) .bazi-table tr:last-child th {
-        border-bottom: none;
-    }
+@st.cache_data(max_entries=512, show_spinner=False)
+def lunar_to_solar(year: int, month: int, day: int, is_leap: bool = False) -> date:
+    """Convert a lunar date to its solar date (leap months use lunar_python's negative month)."""
+    solar = Lunar.fromYmd(year, -month if is_leap else month, day).getSolar()
+    return date(solar.getYear(), solar.getMonth(), solar.getDay())
 
-    .bazi-table {
-        width: 100%;
-        min-width: 520px;
-        border-collapse: collapse; /* Keep collapse for clean alignment */
-        background: transparent;
-        border: none;
-        font-family: 'Noto Serif SC', serif;
-        margin: 0;
-        border-spacing: 0;
-    }
 
-    .bazi-table th,
-    .bazi-table td {
-        padding: 14px 10px;
-        text-align: center;
-        border-bottom: 1px solid #f8f8f8; /* Very subtle light line */
-        color: #4a4a4a;
-        font-size: 0.95rem;
-    }
+@st.cache_data(max_entries=256, show_spinner=False)
+def leap_month_of(year: int) -> int:
+    """Return the leap month of a lunar year (0 if none)."""
+    return LunarYear.fromYear(year).getLeapMonth()
 
-    .bazi-table-wrap + .bazi-table-wrap {
-        margin-top: -1px;
-    }
 
-    .bazi-table.compact th,
-    .bazi-table.compact td {
-        padding: 8px 6px;
-        font-size: 0.9rem;
-    }
+@st.cache_data(max_entries=256, ttl=3600, show_spinner=False)
+def cached_calculate_bazi(year: int, month: int, day: int, hour: int, minute: int, longitude: float):
+    """calculate_bazi memoized on its inputs (resubmits / profile reloads skip the pipeline)."""
+    return calculate_bazi(year, month, day, hour, minute, longitude)
 
-    .bazi-table th {
-        background: #fafafa;
-        font-weight: 600;
-        color: #888;
-        border-bottom: 1px solid #f0f0f0;
-        font-size: 0.85rem;
-        letter-spacing: 1px;
-    }
 
-    .bazi-table .row-label {
-        background: #fbfbfb; /* Very light subtle background for labels */
-        font-weight: 600;
-        color: #999;
-        white-space: nowrap;
-        border-right: 1px solid #f8f8f8; /* Subtle vertical divider */
-        text-align: center;
-        width: 80px;
-    }
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_bazi_chart_svg(chart_data: dict) -> str:
+    """Render the single-person chart SVG, memoized on chart_data."""
+    return BaziChartGenerator().generate_chart(chart_data)
 
-    .bazi-table tr:hover td {
-        background-color: #fcfcfc;
-    }
 
-    .bazi-table .pillars {
-        font-size: 1.1rem;
-        font-weight: 700;
-    }
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_couple_prompt(person_a: dict, person_b: dict, comp_data: dict, relation_type: str, focus_instruction: str) -> str:
+    """build_couple_prompt memoized on its (hashable-by-content) inputs."""
+    return build_couple_prompt(
+        person_a, person_b, comp_data, relation_type=relation_type, focus_instruction=focus_instruction
+    )
 
-    .bazi-table .muted {
-        color: #d0d0d0;
-        font-size: 0.8rem;
-    }
 
-    .bazi-table .energy-header {
-        background: #fafafa;
-        color: #999;
-        font-weight: 600;
-        font-size: 0.85rem;
-    }
+def download_link_html(mime: str, data: bytes, filename: str, label: str) -> str:
+    """Styled data-URI download link for an export file."""
+    b64_data = base64.b64encode(data).decode()
+    return DOWNLOAD_LINK_TEMPLATE.format(mime=mime, b64_data=b64_data, filename=filename, label=label)
 
-    /* ===== Tabs styling for chart modes ===== */
-    div[data-testid="stTabs"] > div:first-child {
-        background: transparent;
-        border-radius: 8px;
-        padding: 6px;
-    }
-    
-    /* Tabs content panel background */
-    div[data-testid="stTabs"] > div:last-child {
-        background: transparent !important;
-    }
 
-    div[data-testid="stTabs"] button {
-        color: #bfbfbf !important;
-        font-family: 'Noto Serif SC', serif;
-        font-weight: 600;
-        border-radius: 6px;
-    }
+@st.cache_data(max_entries=16, show_spinner=False)
+def cached_report_download_html(
+    bazi_result: str,
+    time_info: str,
+    gender: str,
+    birthplace: str,
+    responses: tuple,
+    birth_datetime: Optional[str],
+) -> str:
+    """
+    Build the PDF report and return its download link HTML.
+    Rebuilt only when the report inputs change; the file name carries the build time.
+    """
+    # Deferred import: reportlab is only loaded once there is a report to export
+    from pdf_generator import generate_report_pdf
+    pdf_bytes = generate_report_pdf(
+        bazi_result=bazi_result,
+        time_info=time_info,
+        gender=gender,
+        birthplace=birthplace,
+        responses=list(responses),
+        birth_datetime=birth_datetime,
+    )
+    pdf_filename = f"fortune_report_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
+    return download_link_html("application/pdf", pdf_bytes, pdf_filename, "📄 下载 PDF 报告")
 
-    div[data-testid="stTabs"] button[aria-selected="true"] {
-        color: #ffd700 !important;
-        background: rgba(255, 215, 0, 0.1) !important;
-        border-bottom: 2px solid #ffd700;
-    }
-    
-    .time-info {
-        font-family: 'Noto Serif SC', serif;
-        font-size: 0.95rem;
-        text-align: center;
-        color: #CCCCCC;
-        margin-top: -10px;
-        margin-bottom: 20px;
-        text-shadow: 0 1px 2px rgba(0,0,0,0.5);
-    }
-    
-    .fortune-text {
-        font-family: 'Noto Serif SC', serif;
-        font-size: 1.1rem;
-        line-height: 1.8;
-        color: #e0e0e0;
-        background: rgba(255, 255, 255, 0.05);
-        border-radius: 10px;
-        padding: 20px;
-        margin-top: 10px;
-        margin-bottom: 20px;
-        word-wrap: break-word;
-        overflow-wrap: break-word;
-    }
-    
-    .topic-header {
-        font-family: 'Noto Serif SC', serif;
-        font-size: 1.35rem;
-        font-weight: 700;
-        color: #ffd700;
-        border-left: 5px solid #ffd700;
-        padding-left: 15px;
-        margin-top: 30px;
-        margin-bottom: 15px;
-        text-shadow: 0 1px 3px rgba(0,0,0,0.5);
-    }
-    
-    .stButton > button {
-        background: linear-gradient(145deg, #ffd700, #ff8c00);
-        color: #1a1a2e;
-        font-family: 'Noto Serif SC', serif;
-        font-size: 1rem;
-        font-weight: bold;
-        border: none;
-        border-radius: 15px;
-        padding: 10px 20px;
-        cursor: pointer;
-        transition: all 0.3s ease;
-        box-shadow: 0 4px 15px rgba(255, 215, 0, 0.4);
-        min-height: 44px; /* Touch-friendly tap target */
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 6px 20px rgba(255, 215, 0, 0.6);
-    }
-    
-    .stDateInput label, .stSlider label, .stSelectbox label, .stTextInput label, .stCheckbox label {
-        color: #ffd700 !important;
-        font-family: 'Noto Serif SC', serif;
-    }
-    
-    .stSlider > div > div {
-        background-color: rgba(255, 215, 0, 0.3);
-    }
-    
-    div[data-testid="stSliderTickBarMin"], 
-    div[data-testid="stSliderTickBarMax"] {
-        color: #ffd700;
-    }
-    
-    .sidebar-title {
-        font-family: 'Noto Serif SC', serif;
-        color: #ffd700;
-        font-size: 1.2rem;
-        margin-bottom: 10px;
-    }
-    
-    .section-label {
-        font-family: 'Noto Serif SC', serif;
-        color: #FFF5CC;
-        font-size: 1rem;
-        margin-bottom: 5px;
-        font-weight: 500;
-    }
-    
-    .api-section {
-        background: rgba(255, 255, 255, 0.05);
-        border-radius: 10px;
-        padding: 15px;
-        margin: 15px 0;
-    }
-    
-    .quota-warning {
-        color: #ff6b6b;
-        font-family: 'Noto Serif SC', serif;
-        padding: 10px;
-        background: rgba(255, 107, 107, 0.1);
-        border-radius: 8px;
-        margin: 10px 0;
-    }
-    
-    /* ===== SVG Chart Responsive Container ===== */
-    .bazi-chart-container {
-        display: block;
-        width: 100%;
-        margin-bottom: 20px;
-        overflow-x: auto;
-        overflow-y: hidden;
-        -webkit-overflow-scrolling: touch;
-        text-align: center;
-        /* Match professional table style - white card */
-        background: #ffffff;
-        border-radius: 12px;
-        padding: 20px 10px;
-        box-shadow: 0 4px 20px rgba(0, 0, 0, 0.05);
-    }
-    
-    .bazi-chart-container svg {
-        display: block;
-        margin: 0 auto;
-        width: 100%;
-        max-width: 480px;
-        height: auto;
-    }
-    
-    /* Mobile SVG - ensure it fits screen */
-    @media screen and (max-width: 500px) {
-        .bazi-chart-container {
-            padding: 0 5px;
-        }
-        
-        .bazi-chart-container svg {
-            width: 100%;
-            max-width: 100%;
-        }
-    }
-    
-    /* ===== Mobile Responsive Styles ===== */
-    @media screen and (max-width: 768px) {
-        /* Title */
-        h1 {
-            font-size: 1.6rem;
-            margin-bottom: 20px;
-            padding: 0 10px;
-        }
-        
-        /* Main container padding */
-        .main .block-container {
-            padding: 1rem 0.5rem !important;
-        }
-        
-        /* Bazi display */
-        .bazi-display {
-            font-size: 1.4rem;
-            padding: 15px 10px;
-            margin: 10px 0;
-        }
-        
-        /* Time info */
-        .time-info {
-            font-size: 0.75rem;
-            padding: 0 5px;
-            line-height: 1.5;
-        }
-        
-        /* Fortune text */
-        .fortune-text {
-            font-size: 0.95rem;
-            line-height: 1.7;
-            padding: 15px 12px;
-        }
-        
-        /* Topic header */
-        .topic-header {
-            font-size: 1.1rem;
-            padding-left: 10px;
-            margin-top: 15px;
-        }
-        
-        /* Section labels */
-        .section-label {
-            font-size: 0.9rem;
-        }
-        
-        /* Buttons - make them full width on mobile */
-        .stButton > button {
-            font-size: 0.9rem;
-            padding: 12px 10px;
-            min-height: 48px; /* Larger tap target for mobile */
-            width: 100%;
-        }
-        
-        /* Select boxes */
-        .stSelectbox > div > div {
-            font-size: 0.9rem;
-        }
-        
-        /* Radio buttons - make horizontal options wrap nicely */
-        .stRadio > div {
-            flex-wrap: wrap;
-            gap: 8px;
-        }
-        
-        .stRadio > div > label {
-            font-size: 0.9rem;
-            padding: 8px 12px;
-        }
-        
-        /* Hide sidebar by default on mobile */
-        [data-testid="stSidebar"] {
-            min-width: 0px;
-        }
-        
-        /* Columns - stack vertically on mobile */
-        [data-testid="column"] {
-            width: 100% !important;
-            flex: 1 1 100% !important;
-            min-width: 100% !important;
-        }
-        
-        /* Expander */
-        .streamlit-expanderHeader {
-            font-size: 0.9rem;
-        }
-        
-        /* Date input */
-        .stDateInput > div {
-            max-width: 100%;
-        }
-        
-        /* API settings */
-        .api-section {
-            padding: 10px;
-        }
-    }
-    
-    /* ===== Small Mobile (iPhone SE, etc.) ===== */
-    @media screen and (max-width: 375px) {
-        h1 {
-            font-size: 1.4rem;
-        }
-        
-        .bazi-display {
-            font-size: 1.2rem;
-            padding: 12px 8px;
-        }
-        
-        .fortune-text {
-            font-size: 0.9rem;
-            padding: 12px 10px;
-        }
-        
-        .topic-header {
-            font-size: 1rem;
-        }
-        
-        .stButton > button {
-            font-size: 0.85rem;
-            padding: 10px 8px;
-        }
-    }
-    
-    /* ===== Tablet Landscape ===== */
-    @media screen and (min-width: 769px) and (max-width: 1024px) {
-        .main .block-container {
-            padding: 2rem 1.5rem !important;
-        }
-        
-        h1 {
-            font-size: 1.9rem;
-        }
-        
-        .fortune-text {
-            font-size: 1rem;
-        }
-    }
-    
-    /* ===== Improve touch scrolling ===== */
-    .main {
-        -webkit-overflow-scrolling: touch;
-    }
-    
-    /* ===== Fix button grid on mobile ===== */
-    @media screen and (max-width: 768px) {
-        /* Make button rows 2x2 grid instead of 4 columns */
-        [data-testid="stHorizontalBlock"] {
-            flex-wrap: wrap !important;
-            gap: 8px !important;
-        }
-        
-        [data-testid="stHorizontalBlock"] > [data-testid="column"] {
-            flex: 1 1 45% !important;
-            min-width: 45% !important;
-            max-width: 48% !important;
-        }
-    }
-    
-    /* ===== Improve radio button appearance on mobile ===== */
-    @media screen and (max-width: 768px) {
-        div[data-testid="stRadio"] > div {
-            gap: 4px;
-        }
-        
-        div[data-testid="stRadio"] label {
-            padding: 10px 16px !important;
-            border-radius: 20px;
-            background: rgba(255, 215, 0, 0.1);
-            border: 1px solid rgba(255, 215, 0, 0.3);
-            color: #FFFFFF !important;
-        }
-        
-        div[data-testid="stRadio"] label:has(input:checked) {
-            background: rgba(255, 215, 0, 0.3);
-            border-color: #ffd700;
-        }
-    }
-    
-    /* ===== Radio button text contrast (all screens) ===== */
-    div[data-testid="stRadio"] label span {
-        color: #FFFFFF !important;
-    }
-    
-    div[data-testid="stRadio"] label p {
-        color: #FFFFFF !important;
-    }
-    
-    /* ===== Expander header contrast ===== */
-    .streamlit-expanderHeader {
-        color: #FFFFFF !important;
-    }
-    
-    .streamlit-expanderHeader p {
-        color: #FFFFFF !important;
-    }
-    
-    details summary span {
-        color: #FFFFFF !important;
-    }
-    
-    /* ===== Mobile-friendly select dropdowns ===== */
-    @media screen and (max-width: 768px) {
-        .stSelectbox [data-baseweb="select"] {
-            min-height: 44px;
-        }
-        
-        .stSelectbox [data-baseweb="select"] > div {
-            font-size: 1rem;
-        }
-        
-        /* Searchable city input styling */
-        .stTextInput input {
-            min-height: 44px;
-            font-size: 1rem;
-        }
-        
-        .stTextInput input::placeholder {
-            color: rgba(255, 255, 255, 0.6);
-            font-size: 0.9rem;
-        }
-    }
-    
-    /* ===== City search input styling (all screens) ===== */
-    .stTextInput input[placeholder*="城市"] {
-        background: rgba(255, 215, 0, 0.05);
-        border: 1px solid rgba(255, 215, 0, 0.3);
-        border-radius: 8px;
-    }
-    
-    .stTextInput input[placeholder*="城市"]:focus {
-        border-color: #ffd700;
-        box-shadow: 0 0 0 2px rgba(255, 215, 0, 0.2);
-    }
-    
-    /* ===== Viewport meta optimization ===== */
-    @viewport {
-        width: device-width;
-        zoom: 1;
+
+@st.cache_data(max_entries=128, show_spinner=False)
+def cached_hexagram_html(binary_code: str) -> str:
+    """Centered hexagram SVG for a six-line binary code (at most 64 distinct values)."""
+    return f'<div style="text-align:center;">{draw_hexagram_svg(binary_code)}</div>'
+
+
+@st.cache_resource(show_spinner=False)
+def _zhouyi_calculator() -> ZhouyiCalculator:
+    """Shared (stateless) hexagram caster; its 64-hexagram tables are built once per process."""
+    return ZhouyiCalculator()
+
+
+COUPLE_PILLAR_KEYS = ("year_pillar", "month_pillar", "day_pillar", "hour_pillar")
+
+
+def couple_pillars(pattern_info: dict) -> tuple:
+    """(year, month, day, hour) pillars as two-character strings; hashable cache key."""
+    return tuple(pattern_info.get(key, "??") for key in COUPLE_PILLAR_KEYS)
+
+
+def _couple_chart_data(pillars: tuple) -> dict:
+    """Adapter to the {"year_pillar": (stem, branch), ...} shape the chart/compat classes take."""
+    return {key: (pillar[0], pillar[1]) for key, pillar in zip(COUPLE_PILLAR_KEYS, pillars)}
+
+
+def couple_person_data(gender: str, pattern_info: dict) -> dict:
+    """
+    One person's summary for the couple prompt.
+    Memoized per session on the pattern_info object itself, so the dict is only
+    rebuilt after a new chart is calculated.
+    """
+    memo = st.session_state.setdefault("_couple_person_memo", {})
+    entry = memo.get(id(pattern_info))
+    if entry is not None and entry[0] is pattern_info and entry[1] == gender:
+        return entry[2]
+
+    strength_result = pattern_info.get("strength_result", {})
+    person = {
+        "gender": gender,
+        "year_pillar": pattern_info.get("year_pillar", "??"),
+        "month_pillar": pattern_info.get("month_pillar", "??"),
+        "day_pillar": pattern_info.get("day_pillar", "??"),
+        "hour_pillar": pattern_info.get("hour_pillar", "??"),
+        "pattern_name": pattern_info.get("pattern_name", "普通格局"),
+        "strength": strength_result.get("strength", "未知"),
+        "joy_elements": ", ".join(strength_result.get("joy_elements", [])) or "未知",
+        "nayin": pattern_info.get("auxiliary", {}).get("nayin", {})
     }
-</style>
-""", unsafe_allow_html=True)
+    if len(memo) >= 4:
+        memo.clear()
+    memo[id(pattern_info)] = (pattern_info, gender, person)
+    return person
 
-# Initialize database on startup
-init_db()
 
-# Profile session state initialization for Input-First pattern
-if "loaded_profile" not in st.session_state:
-    st.session_state.loaded_profile = None
-if "loaded_profile_id" not in st.session_state:
-    st.session_state.loaded_profile_id = None
-if "pending_profile_load" not in st.session_state:
-    st.session_state.pending_profile_load = None  # Profile to load on next rerun
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_compatibility(my_pillars: tuple, partner_pillars: tuple) -> dict:
+    """analyze_compatibility memoized on both people's pillars."""
+    return analyze_compatibility(
+        _couple_chart_data(my_pillars), _couple_chart_data(partner_pillars)
+    )
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_couple_chart_svg(my_pillars: tuple, partner_pillars: tuple) -> str:
+    """Render the two-person chart SVG, memoized on both people's pillars."""
+    return BaziChartGenerator().generate_couple_chart(
+        _couple_chart_data(my_pillars), _couple_chart_data(partner_pillars)
+    )
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_energy_profile(pillars: tuple):
+    """Return (energy_data, dominant, weakest, energy_svg) for the four pillars."""
+    energy_calc = BaziEnergyCalculator()
+    energy_data = energy_calc.calculate_energy(pillars)
+    dominant = energy_calc.get_dominant_element(pillars)
+    weakest = energy_calc.get_weakest_element(pillars)
+    return energy_data, dominant, weakest, EnergyPieChartGenerator().generate_chart(energy_data)
 
 
 def calculate_and_store_single(
@@ -927,7 +967,7 @@ def calculate_and_store_single(
     birthplace: str,
 ):
     """Calculate Bazi and store all derived session state for single-person mode."""
-    bazi_result, time_info, pattern_info = calculate_bazi(
+    bazi_result, time_info, pattern_info = cached_calculate_bazi(
         birthday.year,
         birthday.month,
         birthday.day,
@@ -958,84 +998,60 @@ def calculate_and_store_single(
         birthday.year,
     )
 
-    chart_generator = BaziChartGenerator()
-    ten_gods = pattern_info.get("ten_gods", {})
-    hidden_stems_info = pattern_info.get("hidden_stems", {})
     day_master = pattern_info.get("day_master", "")
 
-    def get_hidden_with_gods(branch_name):
+    # One calculator for all four branches; hidden stems repeat often, so memoize per stem
+    pattern_calc = BaziPatternCalculator()
+    ten_god_by_stem = {}
+
+    def get_hidden_with_gods(branch_hidden):
         """Get hidden stems list with ten god for each."""
-        from logic import BaziPatternCalculator
-        calc = BaziPatternCalculator()
-        branch_hidden = hidden_stems_info.get(branch_name, [])
         result = []
         for stem in branch_hidden:
             if day_master:
-                god = calc.get_ten_god(day_master, stem)
+                god = ten_god_by_stem.get(stem)
+                if god is None:
+                    god = ten_god_by_stem[stem] = pattern_calc.get_ten_god(day_master, stem)
                 result.append((stem, god))
             else:
                 result.append((stem, ""))
         return result
 
-    chart_data = {
-        "gender": "乾造" if gender == "男" else "坤造",
-        "year": {
-            "stem": pattern_info.get("year_pillar", "")[0] if pattern_info.get("year_pillar") else "?",
-            "branch": pattern_info.get("year_pillar", "")[1] if len(pattern_info.get("year_pillar", "")) > 1 else "?",
-            "stem_ten_god": ten_gods.get("年干", ""),
-            "hidden_stems": get_hidden_with_gods("年支藏干"),
-        },
-        "month": {
-            "stem": pattern_info.get("month_pillar", "")[0] if pattern_info.get("month_pillar") else "?",
-            "branch": pattern_info.get("month_pillar", "")[1] if len(pattern_info.get("month_pillar", "")) > 1 else "?",
-            "stem_ten_god": ten_gods.get("月干", ""),
-            "hidden_stems": get_hidden_with_gods("月支藏干"),
-        },
-        "day": {
-            "stem": pattern_info.get("day_pillar", "")[0] if pattern_info.get("day_pillar") else "?",
-            "branch": pattern_info.get("day_pillar", "")[1] if len(pattern_info.get("day_pillar", "")) > 1 else "?",
-            "stem_ten_god": "日主",
-            "hidden_stems": get_hidden_with_gods("日支藏干"),
-        },
-        "hour": {
-            "stem": pattern_info.get("hour_pillar", "")[0] if pattern_info.get("hour_pillar") else "?",
-            "branch": pattern_info.get("hour_pillar", "")[1] if len(pattern_info.get("hour_pillar", "")) > 1 else "?",
-            "stem_ten_god": ten_gods.get("时干", ""),
-            "hidden_stems": get_hidden_with_gods("时支藏干"),
-        },
-    }
-    st.session_state.bazi_svg = chart_generator.generate_chart(chart_data)
+    chart_data = {"gender": "乾造" if gender == "男" else "坤造"}
+    for name, (stem, branch), stem_god, hidden in zip(
+        CHART_PILLAR_NAMES,
+        pattern_info["pillars"],
+        pattern_info["ten_gods_vec"],
+        pattern_info["hidden_vec"],
+    ):
+        chart_data[name] = {
+            "stem": stem or "?",
+            "branch": branch or "?",
+            "stem_ten_god": stem_god,
+            "hidden_stems": get_hidden_with_gods(hidden),
+        }
+    st.session_state.bazi_svg = cached_bazi_chart_svg(chart_data)
 
-    pillars = [
-        pattern_info.get("year_pillar", ""),
-        pattern_info.get("month_pillar", ""),
-        pattern_info.get("day_pillar", ""),
-        pattern_info.get("hour_pillar", ""),
-    ]
-    energy_calc = BaziEnergyCalculator()
-    energy_data = energy_calc.calculate_energy(pillars)
+    pillars = tuple(stem + branch for stem, branch in pattern_info["pillars"])
+    energy_data, (dominant_element, dominant_pct), (weakest_element, weakest_pct), energy_svg = (
+        cached_energy_profile(pillars)
+    )
     st.session_state.energy_data = energy_data
-
-    energy_chart_gen = EnergyPieChartGenerator()
-    st.session_state.energy_svg = energy_chart_gen.generate_chart(energy_data)
-
-    dominant_element, dominant_pct = energy_calc.get_dominant_element(pillars)
-    weakest_element, weakest_pct = energy_calc.get_weakest_element(pillars)
+    st.session_state.energy_svg = energy_svg
     st.session_state.dominant_element = (dominant_element, dominant_pct)
     st.session_state.weakest_element = (weakest_element, weakest_pct)
 
-    energy_context = f"""
-【五行能量分布】(System Calculated)
-- 木: {energy_data['木']['score']}分 ({int(energy_data['木']['pct'] * 100)}%)
-- 火: {energy_data['火']['score']}分 ({int(energy_data['火']['pct'] * 100)}%)
-- 土: {energy_data['土']['score']}分 ({int(energy_data['土']['pct'] * 100)}%)
-- 金: {energy_data['金']['score']}分 ({int(energy_data['金']['pct'] * 100)}%)
-- 水: {energy_data['水']['score']}分 ({int(energy_data['水']['pct'] * 100)}%)
-- **最强五行**: {dominant_element} ({int(dominant_pct * 100)}%)
-- **最弱五行**: {weakest_element} ({int(weakest_pct * 100)}%)
-⚠️ 请根据此五行能量分布分析用户的健康、性格倾向和开运建议。
-"""
-    st.session_state.user_context += energy_context
+    energy_lines = ["", "【五行能量分布】(System Calculated)"]
+    for element in ENERGY_ELEMENTS:
+        element_info = energy_data[element]
+        energy_lines.append(f"- {element}: {element_info['score']}分 ({int(element_info['pct'] * 100)}%)")
+    energy_lines += [
+        f"- **最强五行**: {dominant_element} ({int(dominant_pct * 100)}%)",
+        f"- **最弱五行**: {weakest_element} ({int(weakest_pct * 100)}%)",
+        "⚠️ 请根据此五行能量分布分析用户的健康、性格倾向和开运建议。",
+        "",
+    ]
+    st.session_state.user_context = "".join((st.session_state.user_context, "\n".join(energy_lines)))
 
     if calculate_fortune_cycles:
         st.session_state.fortune_cycles = calculate_fortune_cycles(
@@ -1051,126 +1067,116 @@ def calculate_and_store_single(
         st.session_state.fortune_cycles = None
 
     return {
-        "chart_generator": chart_generator,
         "pattern_info": pattern_info,
         "bazi_result": bazi_result,
     }
 
 
+# Widget keys dropped on a full reset so widgets re-read their defaults
+RESET_WIDGET_KEYS = frozenset({
+    "input_gender_widget",
+    "input_birth_date_widget",
+    "input_birth_hour_widget",
+    "input_birth_minute_widget",
+    "profile_search_input",
+    "save_profile_id_input",
+    "partner_gender",
+    "partner_cal_radio",
+    "partner_birthday",
+    "partner_lunar_year",
+    "partner_lunar_month",
+    "partner_lunar_day",
+    "partner_time_radio",
+    "partner_hour",
+    "partner_minute",
+    "partner_shichen",
+    "main_city_search",
+    "main_city_select",
+    "partner_city_search",
+    "partner_city_select",
+})
+
+
+def _make_recalc_reset_state() -> dict:
+    """Analysis outputs cleared on recalculation (fresh instances for mutable values)."""
+    return {
+        "bazi_calculated": False,
+        "has_result": False,
+        "bazi_result": "",
+        "time_info": "",
+        "user_context": "",
+        "clicked_topics": set(),
+        "responses": [],
+        "responses_trimmed": False,
+        "show_custom_input": False,
+        "custom_question_count": 0,
+        "is_first_response": True,
+        "scroll_to_topic": None,
+        "pattern_info": None,
+        "bazi_svg": None,
+        "energy_data": None,
+        "energy_svg": None,
+        "dominant_element": None,
+        "weakest_element": None,
+        "birth_datetime": "",
+        "oracle_mode": False,
+        "oracle_question": "",
+        "oracle_shake_count": 0,
+        "oracle_hex_result": None,
+        "oracle_used_today": False,
+        "oracle_usage_date": None,
+        # The chart no longer necessarily matches the loaded profile
+        "loaded_profile_sig": None,
+    }
+
+
+# Session defaults a full reset leaves alone (generation lock, storage flag, API quota)
+PRESERVED_ON_RESET_KEYS = frozenset({
+    "is_generating",
+    "clear_storage_requested",
+    "default_api_usage_count",
+    "using_default_api",
+})
+
+
+def _make_full_reset_state() -> dict:
+    """Everything reset_session_state restores: analysis outputs plus profile, partner and form inputs."""
+    state = {
+        key: value
+        for key, value in _make_session_defaults().items()
+        if key not in PRESERVED_ON_RESET_KEYS
+    }
+    state.update(_make_recalc_reset_state())
+    state.update({
+        "birthplace": "未指定",
+        "gender": "男",
+        "birth_year": None,
+        "partner_pattern_info": None,
+        "couple_svg": None,
+        "stored_partner_gender": None,
+        "stored_relation_type": None,
+        "data_loaded_from_storage": True,
+    })
+    return state
+
+
 def reset_session_state(clear_storage: bool) -> None:
     """Reset app state; optionally clear browser storage."""
-    to_clear = [
-        # Widget keys
-        "input_gender_widget",
-        "input_birth_date_widget",
-        "input_birth_hour_widget",
-        "input_birth_minute_widget",
-        "profile_search_input",
-        "save_profile_id_input",
-        "partner_gender",
-        "partner_cal_radio",
-        "partner_birthday",
-        "partner_lunar_year",
-        "partner_lunar_month",
-        "partner_lunar_day",
-        "partner_time_radio",
-        "partner_hour",
-        "partner_minute",
-        "partner_shichen",
-        "main_city_search",
-        "main_city_select",
-        "partner_city_search",
-        "partner_city_select",
-    ]
-    for key in to_clear:
-        st.session_state.pop(key, None)
-
-    st.session_state.bazi_calculated = False
-    st.session_state.has_result = False
-    st.session_state.bazi_result = ""
-    st.session_state.time_info = ""
-    st.session_state.user_context = ""
-    st.session_state.clicked_topics = set()
-    st.session_state.responses = []
-    st.session_state.show_custom_input = False
-    st.session_state.custom_question_count = 0
-    st.session_state.time_mode = "exact"
-    st.session_state.calendar_mode = "solar"
-    st.session_state.is_first_response = True
-    st.session_state.scroll_to_topic = None
-    st.session_state.loaded_profile = None
-    st.session_state.loaded_profile_id = None
-    st.session_state.pending_profile_load = None
-    st.session_state.pattern_info = None
-    st.session_state.bazi_svg = None
-    st.session_state.energy_data = None
-    st.session_state.energy_svg = None
-    st.session_state.dominant_element = None
-    st.session_state.weakest_element = None
-    st.session_state.fortune_cycles = None
-    st.session_state.birthplace = "未指定"
-    st.session_state.gender = "男"
-    st.session_state.birth_datetime = ""
-    st.session_state.birth_year = None
-    st.session_state.image_zip = None
-    st.session_state.compatibility_mode = False
-    st.session_state.partner_bazi = None
-    st.session_state.partner_info = None
-    st.session_state.partner_pattern_info = None
-    st.session_state.compatibility_result = None
-    st.session_state.couple_svg = None
-    st.session_state.stored_partner_gender = None
-    st.session_state.stored_relation_type = None
-    st.session_state.oracle_mode = False
-    st.session_state.oracle_question = ""
-    st.session_state.oracle_shake_count = 0
-    st.session_state.oracle_hex_result = None
-    st.session_state.oracle_used_today = False
-    st.session_state.oracle_usage_date = None
-
-    st.session_state.input_gender = "男"
-    st.session_state.input_birth_date = date(1990, 1, 1)
-    st.session_state.input_birth_hour = 12
-    st.session_state.input_birth_minute = 0
-    st.session_state.input_lunar_year = 1990
-    st.session_state.input_lunar_month = "1月"
-    st.session_state.input_lunar_day = 1
-    st.session_state.partner_calendar_mode = "solar"
-    st.session_state.partner_time_mode = "exact"
-
-    st.session_state.data_loaded_from_storage = True
+    for key in RESET_WIDGET_KEYS.intersection(st.session_state.keys()):
+        del st.session_state[key]
+
+    st.session_state.update(_make_full_reset_state())
     st.query_params.clear()
 
     if clear_storage:
         st.session_state.clear_storage_requested = True
+        # Force the next localStorage write even if the payload is unchanged
+        st.session_state.pop("_local_storage_hash", None)
 
 
 def reset_for_recalc() -> None:
     """Reset analysis outputs but keep current profile inputs."""
-    st.session_state.bazi_calculated = False
-    st.session_state.has_result = False
-    st.session_state.bazi_result = ""
-    st.session_state.time_info = ""
-    st.session_state.user_context = ""
-    st.session_state.clicked_topics = set()
-    st.session_state.responses = []
-    st.session_state.show_custom_input = False
-    st.session_state.custom_question_count = 0
-    st.session_state.is_first_response = True
-    st.session_state.scroll_to_topic = None
-    st.session_state.pattern_info = None
-    st.session_state.bazi_svg = None
-    st.session_state.energy_data = None
-    st.session_state.energy_svg = None
-    st.session_state.dominant_element = None
-    st.session_state.weakest_element = None
-    st.session_state.birth_datetime = ""
-    st.session_state.oracle_mode = False
-    st.session_state.oracle_question = ""
-    st.session_state.oracle_shake_count = 0
-    st.session_state.oracle_hex_result = None
-    st.session_state.oracle_used_today = False
-    st.session_state.oracle_usage_date = None
+    st.session_state.update(_make_recalc_reset_state())
 
 
 def reset_for_new_profile() -> None:
@@ -1180,51 +1186,105 @@ def reset_for_new_profile() -> None:
     st.session_state.loaded_profile_id = None
 
 
+def _profile_calc_inputs(profile_data: dict) -> dict:
+    """
+    Parse a stored profile into calculate_and_store_single keyword arguments.
+    Only called when a profile actually needs its chart computed.
+    """
+    birth_year = int(profile_data.get("birth_year", 1990))
+    birth_month = int(profile_data.get("birth_month", 1))
+    birth_day = int(profile_data.get("birth_day", 1))
+    is_lunar = bool(profile_data.get("is_lunar", False))
+
+    if is_lunar:
+        birthday = lunar_to_solar(birth_year, birth_month, birth_day)
+    else:
+        birthday = date(birth_year, birth_month, birth_day)
+
+    birth_hour_str = profile_data.get("birth_hour", "12:00")
+    hour_minute = parse_hh_mm(birth_hour_str) if birth_hour_str and ":" in birth_hour_str else None
+    if hour_minute:
+        final_hour, final_minute = hour_minute
+    elif birth_hour_str and "时" in birth_hour_str:
+        final_hour = get_shichen_mid_hour(birth_hour_str)
+        final_minute = 0
+    else:
+        final_hour = 12
+        final_minute = 0
+
+    birthplace = profile_data.get("city") or "未指定"
+    return {
+        "birthday": birthday,
+        "final_hour": final_hour,
+        "final_minute": final_minute,
+        "longitude": CITY_LONGITUDES.get(birthplace),
+        "gender": profile_data.get("gender", "男"),
+        "birthplace": birthplace,
+    }
+
+
+# Stored profile fields that determine the chart; used to detect an unchanged reload
+PROFILE_SIGNATURE_KEYS = ("gender", "birth_year", "birth_month", "birth_day", "birth_hour", "city", "is_lunar")
+
+
+def _profile_signature(profile_data: dict) -> tuple:
+    """Hashable snapshot of the chart-relevant profile fields."""
+    return tuple(profile_data.get(key) for key in PROFILE_SIGNATURE_KEYS)
+
+
 def load_profile_callback(profile_data: dict, profile_id: str):
     """
     Callback function to load profile data into session state.
     This updates all input keys and sets has_result flag.
     MUST be called before any UI rendering for proper updates.
     """
-    # 1. Update form input session state keys
-    st.session_state.input_gender = profile_data.get("gender", "男")
+    # Reloading the unchanged profile whose chart is already in session is a no-op
+    signature = _profile_signature(profile_data)
+    if (
+        st.session_state.get("bazi_calculated")
+        and st.session_state.get("loaded_profile_id") == profile_id
+        and st.session_state.get("loaded_profile_sig") == signature
+    ):
+        st.session_state.has_result = True
+        return
+
+    # 1. Update form inputs
+    form = st.session_state.form
+    form.gender = profile_data.get("gender", "男")
     
     # Handle date - either solar or lunar
     if profile_data.get("is_lunar", False):
         st.session_state.calendar_mode = "lunar"
-        st.session_state.input_lunar_year = profile_data.get("birth_year", 1990)
-        st.session_state.input_lunar_month = f"{profile_data.get('birth_month', 1)}月"
-        st.session_state.input_lunar_day = profile_data.get("birth_day", 1)
+        form.lunar_year = profile_data.get("birth_year", 1990)
+        form.lunar_month = f"{profile_data.get('birth_month', 1)}月"
+        form.lunar_day = profile_data.get("birth_day", 1)
     else:
         st.session_state.calendar_mode = "solar"
-        try:
-            st.session_state.input_birth_date = date(
-                profile_data.get("birth_year", 1990),
-                profile_data.get("birth_month", 1),
-                profile_data.get("birth_day", 1)
-            )
-        except:
-            st.session_state.input_birth_date = date(1990, 1, 1)
+        form.birth_date = safe_date(
+            profile_data.get("birth_year", 1990),
+            profile_data.get("birth_month", 1),
+            profile_data.get("birth_day", 1)
+        )
     
     # Handle time
     birth_hour_str = profile_data.get("birth_hour", "12:00")
     if birth_hour_str and ":" in birth_hour_str:
-        try:
-            h, m = birth_hour_str.split(":")
-            st.session_state.input_birth_hour = int(h)
-            st.session_state.input_birth_minute = int(m)
+        hour_minute = parse_hh_mm(birth_hour_str)
+        if hour_minute:
+            form.birth_hour, form.birth_minute = hour_minute
             st.session_state.time_mode = "exact"
-        except:
-            st.session_state.input_birth_hour = 12
-            st.session_state.input_birth_minute = 0
+        else:
+            form.birth_hour = 12
+            form.birth_minute = 0
     elif birth_hour_str and "时" in birth_hour_str:
         # Shichen format
         st.session_state.time_mode = "shichen"
-        st.session_state.input_birth_hour = 12  # Fallback
+        form.birth_hour = 12  # Fallback
     
     # Store loaded profile reference
     st.session_state.loaded_profile = profile_data
     st.session_state.loaded_profile_id = profile_id
+    st.session_state.loaded_profile_sig = signature
     
     # 2. Restore session data if available (bazi results, chat history, etc.)
     if profile_data.get("session_data"):
@@ -1235,42 +1295,7 @@ def load_profile_callback(profile_data: dict, profile_id: str):
 
     # 3. If no session data, auto-calculate to enter results page
     try:
-        birth_year = int(profile_data.get("birth_year", 1990))
-        birth_month = int(profile_data.get("birth_month", 1))
-        birth_day = int(profile_data.get("birth_day", 1))
-        is_lunar = bool(profile_data.get("is_lunar", False))
-
-        if is_lunar:
-            lunar_date = Lunar.fromYmd(birth_year, birth_month, birth_day)
-            solar_date = lunar_date.getSolar()
-            birthday = date(solar_date.getYear(), solar_date.getMonth(), solar_date.getDay())
-        else:
-            birthday = date(birth_year, birth_month, birth_day)
-
-        birth_hour_str = profile_data.get("birth_hour", "12:00")
-        if birth_hour_str and ":" in birth_hour_str:
-            h, m = birth_hour_str.split(":")
-            final_hour = int(h)
-            final_minute = int(m)
-        elif birth_hour_str and "时" in birth_hour_str:
-            final_hour = get_shichen_mid_hour(birth_hour_str)
-            final_minute = 0
-        else:
-            final_hour = 12
-            final_minute = 0
-
-        birthplace = profile_data.get("city") or "未指定"
-        longitude = CHINA_CITIES.get(birthplace)
-        gender = profile_data.get("gender", "男")
-
-        calculate_and_store_single(
-            birthday=birthday,
-            final_hour=final_hour,
-            final_minute=final_minute,
-            longitude=longitude,
-            gender=gender,
-            birthplace=birthplace,
-        )
+        calculate_and_store_single(**_profile_calc_inputs(profile_data))
     except Exception as e:
         st.error(f"档案自动加载失败: {str(e)}")
     
@@ -1278,6 +1303,26 @@ def load_profile_callback(profile_data: dict, profile_id: str):
     # st.cache_data.clear()  # Uncomment if caching causes issues
 
 
+# Static sidebar footer blocks (API limit note, save hint, author/version)
+SIDEBAR_FOOTER_HTML = (
+    f"""
+    <small style="color: #888;">
+    💡 默认 API 每会话限制 {DEFAULT_API_DAILY_LIMIT} 次请求。
+    </small>
+    """,
+    """
+    <small style="color: #666;">
+    💾 在主界面输入信息后可保存为档案
+    </small>
+    """,
+    f"""
+    <small style="color: #666;">
+    👤 作者：@daisyluvr | ✉️ daisylur8@gmail.com | 版本：{APP_VERSION}
+    </small>
+    """,
+)
+
+
 # ========== CRITICAL: Handle Pending Profile Load BEFORE Any UI ==========
 # This ensures profile data is loaded into session state before widgets render
 if st.session_state.pending_profile_load is not None:
@@ -1360,7 +1405,7 @@ with st.sidebar:
                     # Parse birth_datetime to extract year, month, day, hour
                     try:
                         # birth_datetime format is usually like "1990年1月1日 12:00"
-                        match = re.search(r'(\d+)年(\d+)月(\d+)日', birth_datetime)
+                        match = BIRTH_DATE_RE.search(birth_datetime)
                         if match:
                             b_year = int(match.group(1))
                             b_month = int(match.group(2))
@@ -1370,7 +1415,7 @@ with st.sidebar:
                             st.stop()
                         
                         # Extract hour if available
-                        hour_match = re.search(r'(\d{1,2})[:：](\d{2})', birth_datetime)
+                        hour_match = BIRTH_TIME_RE.search(birth_datetime)
                         if hour_match:
                             birth_hour = f"{hour_match.group(1)}:{hour_match.group(2)}"
                         else:
@@ -1385,13 +1430,11 @@ with st.sidebar:
                             birth_day=b_day,
                             birth_hour=birth_hour,
                             city=birthplace,
-                            is_lunar=False  # Assume solar for now
+                            is_lunar=False,  # Assume solar for now
+                            session_data=serialize_session_state()  # Saved in the same upsert for instant restore
                         )
                         
                         if success:
-                            # Also save session data for instant restore
-                            session_data_json = serialize_session_state()
-                            update_session_data(save_profile_id.strip(), session_data_json)
                             st.session_state.loaded_profile_id = save_profile_id.strip()
                             st.success(f"✓ 已保存为 {save_profile_id.strip()}")
                             st.rerun()
@@ -1407,12 +1450,10 @@ with st.sidebar:
     # Show loaded profile info
     if st.session_state.loaded_profile:
         profile = st.session_state.loaded_profile
-        st.markdown(f"""
-        <div style="background: rgba(255, 215, 0, 0.1); border-radius: 8px; padding: 10px; margin-top: 10px;">
-            <small style="color: #ffd700;">📋 当前: <b>{st.session_state.loaded_profile_id}</b></small><br>
-            <small style="color: #ccc;">{profile['gender']} | {profile['birth_year']}年{profile['birth_month']}月{profile['birth_day']}日</small>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(profile_card_html(
+            st.session_state.loaded_profile_id,
+            profile['gender'], profile['birth_year'], profile['birth_month'], profile['birth_day']
+        ), unsafe_allow_html=True)
         
         if st.button("✕ 填新档案", use_container_width=True):
             reset_for_new_profile()
@@ -1433,31 +1474,12 @@ with st.sidebar:
         reset_session_state(clear_storage=True)
         st.rerun()
     
-    st.markdown("""
-    <small style="color: #888;">
-    💡 默认 API 每会话限制 """ + str(DEFAULT_API_DAILY_LIMIT) + """ 次请求。
-    </small>
-    """, unsafe_allow_html=True)
-    st.markdown("""
-    <small style="color: #666;">
-    💾 在主界面输入信息后可保存为档案
-    </small>
-    """, unsafe_allow_html=True)
-    app_version = get_app_version()
-    st.markdown(f"""
-    <small style="color: #666;">
-    👤 作者：@daisyluvr | ✉️ daisylur8@gmail.com | 版本：{app_version}
-    </small>
-    """, unsafe_allow_html=True)
+    for footer_html in SIDEBAR_FOOTER_HTML:
+        st.markdown(footer_html, unsafe_allow_html=True)
 
 # Handle clear storage request - inject JavaScript to clear localStorage
 if st.session_state.clear_storage_requested:
-    components.html('''
-        <script>
-            localStorage.removeItem('fortune_teller_data');
-            console.log('localStorage cleared');
-        </script>
-    ''', height=0)
+    components.html(CLEAR_STORAGE_HTML, height=0)
     st.session_state.clear_storage_requested = False
 
 # Title
@@ -1467,90 +1489,59 @@ st.markdown("<h1>🔮 命理大师</h1>", unsafe_allow_html=True)
 # If a profile was loaded from sidebar, show notification and pre-fill values will be used
 if st.session_state.loaded_profile and not st.session_state.has_result:
     profile = st.session_state.loaded_profile
-    st.markdown(f"""
-    <div style="background: rgba(76, 175, 80, 0.1); border: 1px solid rgba(76, 175, 80, 0.3); 
-                border-radius: 10px; padding: 12px; margin-bottom: 15px;">
-        <span style="color: #4CAF50;">✓ 已加载档案:</span>
-        <strong style="color: #ffd700;">{st.session_state.loaded_profile_id}</strong>
-        <span style="color: #ccc;"> ({profile['gender']} | {profile['birth_year']}年{profile['birth_month']}月{profile['birth_day']}日)</span>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(loaded_profile_notice_html(
+        st.session_state.loaded_profile_id,
+        profile['gender'], profile['birth_year'], profile['birth_month'], profile['birth_day']
+    ), unsafe_allow_html=True)
 
-# ========== MAIN INTERFACE: Mutually Exclusive Pages ==========
-# Use has_result to determine which page to show
-if not st.session_state.has_result:
-    # Mode Toggle (Single vs Compatibility)
-    st.markdown('<p class="section-label">💫 分析模式</p>', unsafe_allow_html=True)
-    mode_selection = st.radio(
-        "分析模式",
-        options=["单人模式", "合盘模式 💕"],
-        index=1 if st.session_state.compatibility_mode else 0,
-        horizontal=True,
-        label_visibility="collapsed"
-    )
-    
-    # Update session state based on mode selection
-    if mode_selection == "合盘模式 💕" and not st.session_state.compatibility_mode:
-        st.session_state.compatibility_mode = True
-        st.rerun()
-    elif mode_selection == "单人模式" and st.session_state.compatibility_mode:
-        st.session_state.compatibility_mode = False
-        st.rerun()
-    
-    st.markdown("---")
-    
-    # Show form label based on mode
-    if st.session_state.compatibility_mode:
-        st.markdown("### 👤 甲方 (我的信息)")
-    
-    # Gender Selection - bound to session state for auto-update on profile load
-    st.markdown('<p class="section-label">👤 性别</p>', unsafe_allow_html=True)
-    
-    gender = st.selectbox(
-        "性别",
-        options=["男", "女"],
-        index=0 if st.session_state.input_gender == "男" else 1,
-        key="input_gender_widget",
-        label_visibility="collapsed"
-    )
-    # Sync widget value to session state
-    st.session_state.input_gender = gender
+# Mode value -> radio label for the form toggles
+COMPATIBILITY_MODE_LABELS = {False: "单人模式", True: "合盘模式 💕"}
+CALENDAR_MODE_LABELS = {"solar": "阳历", "lunar": "农历"}
+TIME_MODE_LABELS = {"exact": "精确时间", "shichen": "时辰"}
 
 
-    # Birth Date Input
-    st.markdown('<p class="section-label">📅 出生日期</p>', unsafe_allow_html=True)
-    
-    # Calendar type radio button (similar to time mode)
-    calendar_mode = st.radio(
-        "日历类型",
-        options=["阳历", "农历"],
-        index=0 if st.session_state.calendar_mode == "solar" else 1,
+def mode_radio(label: str, state_key: str, labels: dict, widget_key: str):
+    """
+    Horizontal radio bound to st.session_state[state_key].
+    The widget is synced from the mode before rendering (so profile loads/resets show up),
+    and an on_change callback writes the choice back, so toggling needs no extra st.rerun().
+    """
+    st.session_state[widget_key] = labels[st.session_state[state_key]]
+    values_by_label = {text: value for value, text in labels.items()}
+
+    def _sync_mode():
+        st.session_state[state_key] = values_by_label[st.session_state[widget_key]]
+
+    return st.radio(
+        label,
+        options=tuple(labels.values()),
+        key=widget_key,
+        on_change=_sync_mode,
         horizontal=True,
         label_visibility="collapsed"
     )
-    
-    # Update session state based on radio selection
-    if calendar_mode == "阳历" and st.session_state.calendar_mode != "solar":
-        st.session_state.calendar_mode = "solar"
-        st.rerun()
-    elif calendar_mode == "农历" and st.session_state.calendar_mode != "lunar":
-        st.session_state.calendar_mode = "lunar"
-        st.rerun()
-    
-    # Show appropriate date input based on calendar mode
+
+
+@st.fragment
+def render_birth_date_inputs() -> None:
+    """
+    Solar/lunar birth-date pickers for the main form.
+    Runs as a fragment so picking a year/month/day reruns only this row
+    (the lunar conversion included) instead of the whole input page.
+    The resolved solar date is published to st.session_state.birth_date_input.
+    """
     if st.session_state.calendar_mode == "solar":
         # Solar calendar - use Chinese selectboxes for consistent locale
         solar_col1, solar_col2, solar_col3 = st.columns(3)
         current_year = date.today().year
-        default_date = st.session_state.input_birth_date
+        default_date = st.session_state.form.birth_date
 
-        year_options = list(range(current_year, 1899, -1))
         with solar_col1:
             solar_year = st.selectbox(
                 "阳历年",
-                options=year_options,
-                index=year_options.index(default_date.year) if default_date.year in year_options else 0,
-                format_func=lambda x: f"{x}年"
+                options=year_options(current_year),
+                index=year_index(default_date.year, current_year),
+                format_func=format_year
             )
 
         with solar_col2:
@@ -1558,53 +1549,51 @@ if not st.session_state.has_result:
                 "阳历月",
                 options=list(range(1, 13)),
                 index=default_date.month - 1,
-                format_func=lambda x: f"{x}月"
+                format_func=format_month
             )
 
-        days_in_month = calendar.monthrange(solar_year, solar_month)[1]
-        day_options = list(range(1, days_in_month + 1))
-        default_day = min(default_date.day, days_in_month)
+        month_days = days_in_month(solar_year, solar_month)
+        default_day = min(default_date.day, month_days)
         with solar_col3:
             solar_day = st.selectbox(
                 "阳历日",
-                options=day_options,
-                index=day_options.index(default_day),
-                format_func=lambda x: f"{x}日"
+                options=day_options(month_days),
+                index=default_day - 1,
+                format_func=format_day
             )
 
         birthday = date(solar_year, solar_month, solar_day)
-        st.session_state.input_birth_date = birthday
+        st.session_state.form.birth_date = birthday
     else:
         # Lunar calendar - use dropdowns
         lunar_col1, lunar_col2, lunar_col3 = st.columns(3)
-        
+
         # Year selection (1900-current year)
         current_year = date.today().year
         with lunar_col1:
             lunar_year = st.selectbox(
                 "农历年",
-                options=list(range(current_year, 1899, -1)),  # Descending order
-                index=current_year - 1990  # Default to 1990
+                options=year_options(current_year),  # Descending order
+                index=year_index(1990, current_year)  # Default to 1990
             )
-        
+
         # Check if this lunar year has a leap month
-        lunar_year_obj = LunarYear.fromYear(lunar_year)
-        leap_month = lunar_year_obj.getLeapMonth()  # 0 if no leap month
-        
+        leap_month = leap_month_of(lunar_year)  # 0 if no leap month
+
         # Build month options
         month_options = []
         for m in range(1, 13):
             month_options.append(f"{m}月")
             if leap_month == m:
                 month_options.append(f"闰{m}月")
-        
+
         with lunar_col2:
             lunar_month_str = st.selectbox(
                 "农历月",
                 options=month_options,
                 index=0
             )
-        
+
         # Parse the selected month
         if lunar_month_str.startswith("闰"):
             is_leap_month = True
@@ -1612,48 +1601,328 @@ if not st.session_state.has_result:
         else:
             is_leap_month = False
             lunar_month = int(lunar_month_str[:-1])  # Extract number from "X月"
-        
+
         # Day selection (1-30, lunar months have max 30 days)
         with lunar_col3:
             lunar_day = st.selectbox(
                 "农历日",
                 options=list(range(1, 31)),
                 index=0,
-                format_func=lambda x: f"初{x}" if x <= 10 else (f"十{['一', '二', '三', '四', '五', '六', '七', '八', '九', '十'][x-11]}" if x <= 20 else (f"廿{['一', '二', '三', '四', '五', '六', '七', '八', '九', '十'][x-21]}" if x < 30 else "三十"))
+                format_func=format_lunar_day
             )
-        
+
         # Convert lunar date to solar date
         try:
-            # Use negative month number for leap months
-            lunar_month_param = -lunar_month if is_leap_month else lunar_month
-            lunar_date = Lunar.fromYmd(lunar_year, lunar_month_param, lunar_day)
-            solar_date = lunar_date.getSolar()
-            birthday = date(solar_date.getYear(), solar_date.getMonth(), solar_date.getDay())
-            
+            birthday = lunar_to_solar(lunar_year, lunar_month, lunar_day, is_leap_month)
+
             # Show the converted solar date
             st.caption(f"📅 对应阳历: {birthday.year}年{birthday.month}月{birthday.day}日")
         except Exception as e:
             st.error(f"农历日期无效: {str(e)}")
             birthday = date(1990, 1, 1)  # Fallback
 
-    # Time Input Section with radio button toggle
+    st.session_state.birth_date_input = birthday
+
+
+@st.fragment
+def render_partner_form() -> None:
+    """
+    Partner (乙方) inputs for compatibility mode.
+    Runs as a fragment: changing a partner widget reruns only this form.
+    The collected values are published to st.session_state.partner_form
+    for the calculate handler.
+    """
+    st.markdown("---")
+    st.markdown("### 💕 乙方 (Ta的信息)")
+
+    # Partner Gender
+    st.markdown('<p class="section-label">👤 性别</p>', unsafe_allow_html=True)
+    partner_gender = st.selectbox(
+        "对方性别",
+        options=["男", "女"],
+        index=1,  # Default to opposite
+        label_visibility="collapsed",
+        key="partner_gender"
+    )
+
+    # Relationship Type
+    st.markdown('<p class="section-label">💑 二位是什么关系？</p>', unsafe_allow_html=True)
+    relation_type = st.selectbox(
+        "关系类型",
+        options=["恋人/伴侣", "事业合伙人", "知己好友", "尚未确定"],
+        index=0,
+        label_visibility="collapsed",
+        key="relation_type"
+    )
+
+    # Partner Calendar Mode
+    st.markdown('<p class="section-label">📅 出生日期</p>', unsafe_allow_html=True)
+
+    mode_radio("乙方日历类型", "partner_calendar_mode", CALENDAR_MODE_LABELS, "partner_cal_radio")
+
+    # Partner Birth Date based on calendar mode
+    if st.session_state.partner_calendar_mode == "solar":
+        partner_birthday = st.date_input(
+            "对方出生日期",
+            value=date(1992, 1, 1),
+            min_value=date(1900, 1, 1),
+            max_value=date.today(),
+            label_visibility="collapsed",
+            key="partner_birthday"
+        )
+    else:
+        # Lunar calendar - use dropdowns
+        p_lunar_col1, p_lunar_col2, p_lunar_col3 = st.columns(3)
+
+        current_year = date.today().year
+        with p_lunar_col1:
+            p_lunar_year = st.selectbox(
+                "乙方农历年",
+                options=year_options(current_year),
+                index=year_index(1992, current_year),
+                key="partner_lunar_year"
+            )
+
+        # Check for leap month
+        p_leap_month = leap_month_of(p_lunar_year)
+
+        p_month_options = []
+        for m in range(1, 13):
+            p_month_options.append(f"{m}月")
+            if p_leap_month == m:
+                p_month_options.append(f"闰{m}月")
+
+        with p_lunar_col2:
+            p_lunar_month_str = st.selectbox(
+                "乙方农历月",
+                options=p_month_options,
+                index=0,
+                key="partner_lunar_month"
+            )
+
+        # Parse month
+        if p_lunar_month_str.startswith("闰"):
+            p_is_leap = True
+            p_lunar_month = int(p_lunar_month_str[1:-1])
+        else:
+            p_is_leap = False
+            p_lunar_month = int(p_lunar_month_str[:-1])
+
+        with p_lunar_col3:
+            p_lunar_day = st.selectbox(
+                "乙方农历日",
+                options=list(range(1, 31)),
+                index=0,
+                format_func=format_lunar_day,
+                key="partner_lunar_day"
+            )
+
+        # Convert to solar
+        try:
+            partner_birthday = lunar_to_solar(p_lunar_year, p_lunar_month, p_lunar_day, p_is_leap)
+            st.caption(f"📅 对应阳历: {partner_birthday.year}年{partner_birthday.month}月{partner_birthday.day}日")
+        except Exception as e:
+            st.error(f"乙方农历日期无效: {str(e)}")
+            partner_birthday = date(1992, 1, 1)
+
+    # Partner Birth Time - with shichen option
     st.markdown('<p class="section-label">⏰ 出生时间</p>', unsafe_allow_html=True)
 
-    time_mode = st.radio(
-        "时间类型",
-        options=["精确时间", "时辰"],
-        index=0 if st.session_state.time_mode == "exact" else 1,
-        horizontal=True,
+    mode_radio("乙方时间类型", "partner_time_mode", TIME_MODE_LABELS, "partner_time_radio")
+
+    if st.session_state.partner_time_mode == "exact":
+        partner_time_col_h, partner_time_col_m = st.columns(2)
+        with partner_time_col_h:
+            partner_birth_hour = st.selectbox(
+                "对方小时",
+                options=list(range(24)),
+                index=12,
+                format_func=format_two_digits,
+                key="partner_hour"
+            )
+        with partner_time_col_m:
+            partner_birth_minute = st.selectbox(
+                "对方分钟",
+                options=list(range(0, 60, 5)),
+                index=0,
+                format_func=format_two_digits,
+                key="partner_minute"
+            )
+        partner_final_hour = partner_birth_hour
+        partner_final_minute = partner_birth_minute
+    else:
+        # Shichen mode
+        partner_shichen = st.selectbox(
+            "乙方时辰",
+            options=SHICHEN_OPTIONS,
+            index=6,
+            key="partner_shichen"
+        )
+        partner_final_hour = SHICHEN_MID_HOURS[partner_shichen]
+        partner_final_minute = 0
+
+    # Partner Birthplace - Searchable Dropdown
+    st.markdown('<p class="section-label">📍 出生地点</p>', unsafe_allow_html=True)
+
+    partner_birthplace, partner_longitude = searchable_city_select(
+        label="对方出生城市",
+        key_prefix="partner_city"
+    )
+
+    st.session_state.partner_form = {
+        "gender": partner_gender,
+        "relation_type": relation_type,
+        "birthday": partner_birthday,
+        "final_hour": partner_final_hour,
+        "final_minute": partner_final_minute,
+        "birthplace": partner_birthplace,
+        "longitude": partner_longitude,
+    }
+
+
+def select_topic(topic: str, focus_instruction: str = "") -> None:
+    """Scroll to a topic's existing answer, or queue the topic for generation."""
+    if topic in st.session_state.clicked_topics:
+        st.session_state.scroll_to_topic = topic
+    else:
+        st.session_state.clicked_topics.add(topic)
+        st.session_state.pending_topic = topic
+        st.session_state.is_generating = True
+        if focus_instruction:
+            st.session_state.pending_focus_instruction = focus_instruction
+
+
+def open_custom_input() -> None:
+    """on_click: show the 大师解惑 question box."""
+    st.session_state.show_custom_input = True
+
+
+def submit_custom_question(widget_key: str) -> None:
+    """on_click: queue the typed 大师解惑 question (ignored when blank)."""
+    custom_question = st.session_state.get(widget_key, "")
+    if custom_question.strip():
+        st.session_state.pending_topic = "大师解惑"
+        st.session_state.pending_custom_question = custom_question
+        st.session_state.custom_question_count += 1
+        st.session_state.show_custom_input = False
+        st.session_state.is_generating = True
+
+
+def queue_batch_topics(topics: list) -> None:
+    """on_click: queue all remaining fixed topics for one batch request."""
+    st.session_state.clicked_topics.update(topics)
+    st.session_state.pending_batch_topics = list(topics)
+    st.session_state.is_generating = True
+
+
+def open_oracle(has_quota: bool) -> None:
+    """on_click for 每日一卦: scroll to today's reading, or start a new one if quota remains."""
+    if "oracle" in st.session_state.clicked_topics:
+        st.session_state.scroll_to_topic = "oracle"
+    elif has_quota:
+        st.session_state.oracle_mode = True
+
+
+def confirm_oracle_question() -> None:
+    """on_click: accept the oracle question, or flag it as missing."""
+    oracle_question = st.session_state.get("oracle_question_input", "").strip()
+    if oracle_question:
+        st.session_state.oracle_question = oracle_question
+        st.session_state.oracle_shake_count = 0
+    else:
+        st.session_state.oracle_question_missing = True
+
+
+def shake_coins() -> None:
+    """on_click: one coin toss; the third toss casts the hexagram."""
+    st.session_state.oracle_shake_count += 1
+    if st.session_state.oracle_shake_count >= 3:
+        st.session_state.oracle_hex_result = _zhouyi_calculator().cast_hexagram()
+
+
+def reset_oracle() -> None:
+    """on_click: leave oracle mode (cancel or finish)."""
+    st.session_state.oracle_mode = False
+    st.session_state.oracle_question = ""
+    st.session_state.oracle_shake_count = 0
+    st.session_state.oracle_hex_result = None
+
+
+def _on_topic_pill(widget_key: str, focus_prompts: Optional[dict]) -> None:
+    """on_change for topic_pills: act on the pick, then clear it so the pills behave like buttons."""
+    topic = st.session_state[widget_key]
+    st.session_state[widget_key] = None
+    if topic:
+        select_topic(topic, focus_prompts.get(topic, "") if focus_prompts else "")
+
+
+def topic_pills(label: str, topics: tuple, widget_key: str, icons: Optional[dict] = None,
+                focus_prompts: Optional[dict] = None, disabled: bool = False) -> None:
+    """
+    Render a group of analysis topics as a single st.pills widget.
+    Answered topics are marked with ✓; picking one scrolls to its answer.
+    """
+    clicked_topics = st.session_state.clicked_topics
+
+    def format_topic(topic: str) -> str:
+        if topic in clicked_topics:
+            return f"✓ {topic}"
+        return f"{icons[topic]} {topic}" if icons else topic
+
+    st.pills(
+        label,
+        options=topics,
+        selection_mode="single",
+        format_func=format_topic,
+        key=widget_key,
+        on_change=_on_topic_pill,
+        args=(widget_key, focus_prompts),
+        disabled=disabled,
+        label_visibility="collapsed",
+    )
+
+
+# ========== MAIN INTERFACE: Mutually Exclusive Pages ==========
+# Use has_result to determine which page to show
+if not st.session_state.has_result:
+    # Mode Toggle (Single vs Compatibility)
+    st.markdown('<p class="section-label">💫 分析模式</p>', unsafe_allow_html=True)
+    mode_radio("分析模式", "compatibility_mode", COMPATIBILITY_MODE_LABELS, "compatibility_mode_radio")
+    
+    st.markdown("---")
+    
+    # Show form label based on mode
+    if st.session_state.compatibility_mode:
+        st.markdown("### 👤 甲方 (我的信息)")
+    
+    # Gender Selection - bound to session state for auto-update on profile load
+    st.markdown('<p class="section-label">👤 性别</p>', unsafe_allow_html=True)
+    
+    gender = st.selectbox(
+        "性别",
+        options=["男", "女"],
+        index=0 if st.session_state.form.gender == "男" else 1,
+        key="input_gender_widget",
         label_visibility="collapsed"
     )
+    # Sync widget value to session state
+    st.session_state.form.gender = gender
+
+
+    # Birth Date Input
+    st.markdown('<p class="section-label">📅 出生日期</p>', unsafe_allow_html=True)
     
-    # Update session state based on radio selection
-    if time_mode == "精确时间" and st.session_state.time_mode != "exact":
-        st.session_state.time_mode = "exact"
-        st.rerun()
-    elif time_mode == "时辰" and st.session_state.time_mode != "shichen":
-        st.session_state.time_mode = "shichen"
-        st.rerun()
+    # Calendar type radio button (similar to time mode)
+    mode_radio("日历类型", "calendar_mode", CALENDAR_MODE_LABELS, "calendar_mode_radio")
+    
+    # Show appropriate date input based on calendar mode
+    render_birth_date_inputs()
+    birthday = st.session_state.birth_date_input
+
+    # Time Input Section with radio button toggle
+    st.markdown('<p class="section-label">⏰ 出生时间</p>', unsafe_allow_html=True)
+
+    mode_radio("时间类型", "time_mode", TIME_MODE_LABELS, "time_mode_radio")
 
     # Show appropriate time input based on mode
     if st.session_state.time_mode == "exact":
@@ -1662,280 +1931,48 @@ if not st.session_state.has_result:
             birth_hour = st.selectbox(
                 "小时",
                 options=list(range(24)),
-                index=st.session_state.input_birth_hour,
+                index=st.session_state.form.birth_hour,
                 key="input_birth_hour_widget",
-                format_func=lambda x: f"{x:02d}"
+                format_func=format_two_digits
             )
-            st.session_state.input_birth_hour = birth_hour
+            st.session_state.form.birth_hour = birth_hour
         with time_col_m:
             # Calculate minute index (options are 0, 5, 10, ... 55)
             _minute_options = list(range(0, 60, 5))
-            _minute_idx = _minute_options.index(st.session_state.input_birth_minute) if st.session_state.input_birth_minute in _minute_options else 0
+            _minute_idx = _minute_options.index(st.session_state.form.birth_minute) if st.session_state.form.birth_minute in _minute_options else 0
             birth_minute = st.selectbox(
                 "分钟",
                 options=_minute_options,
                 index=_minute_idx,
                 key="input_birth_minute_widget",
-                format_func=lambda x: f"{x:02d}"
-            )
-            st.session_state.input_birth_minute = birth_minute
-        final_hour = birth_hour
-        final_minute = birth_minute
-
-    else:  # shichen mode
-        shichen = st.selectbox(
-            "选择时辰",
-            options=list(SHICHEN_HOURS.keys()),
-            index=6
-        )
-        final_hour = get_shichen_mid_hour(shichen)
-        final_minute = 0
-
-    # Birthplace Input Section - Searchable Dropdown
-    st.markdown('<p class="section-label">📍 出生地点 (用于真太阳时计算)</p>', unsafe_allow_html=True)
-    
-    birthplace, longitude = searchable_city_select(
-        label="选择出生城市",
-        key_prefix="main_city"
-    )
-
-
-    # ========== Partner Input Form (Compatibility Mode Only) ==========
-    if st.session_state.compatibility_mode:
-        st.markdown("---")
-        st.markdown("### 💕 乙方 (Ta的信息)")
-        
-        # Partner Gender
-        st.markdown('<p class="section-label">👤 性别</p>', unsafe_allow_html=True)
-        partner_gender = st.selectbox(
-            "对方性别",
-            options=["男", "女"],
-            index=1,  # Default to opposite
-            label_visibility="collapsed",
-            key="partner_gender"
-        )
-        
-        # Relationship Type
-        st.markdown('<p class="section-label">💑 二位是什么关系？</p>', unsafe_allow_html=True)
-        relation_type = st.selectbox(
-            "关系类型",
-            options=["恋人/伴侣", "事业合伙人", "知己好友", "尚未确定"],
-            index=0,
-            label_visibility="collapsed",
-            key="relation_type"
-        )
-        
-        # Partner Calendar Mode
-        st.markdown('<p class="section-label">📅 出生日期</p>', unsafe_allow_html=True)
-        
-        # Initialize partner calendar mode
-        if "partner_calendar_mode" not in st.session_state:
-            st.session_state.partner_calendar_mode = "solar"
-        
-        partner_calendar_mode = st.radio(
-            "乙方日历类型",
-            options=["阳历", "农历"],
-            index=0 if st.session_state.partner_calendar_mode == "solar" else 1,
-            horizontal=True,
-            label_visibility="collapsed",
-            key="partner_cal_radio"
-        )
-        
-        # Update session state
-        if partner_calendar_mode == "阳历" and st.session_state.partner_calendar_mode != "solar":
-            st.session_state.partner_calendar_mode = "solar"
-            st.rerun()
-        elif partner_calendar_mode == "农历" and st.session_state.partner_calendar_mode != "lunar":
-            st.session_state.partner_calendar_mode = "lunar"
-            st.rerun()
-        
-        # Partner Birth Date based on calendar mode
-        if st.session_state.partner_calendar_mode == "solar":
-            partner_birthday = st.date_input(
-                "对方出生日期",
-                value=date(1992, 1, 1),
-                min_value=date(1900, 1, 1),
-                max_value=date.today(),
-                label_visibility="collapsed",
-                key="partner_birthday"
-            )
-        else:
-            # Lunar calendar - use dropdowns
-            p_lunar_col1, p_lunar_col2, p_lunar_col3 = st.columns(3)
-            
-            current_year = date.today().year
-            with p_lunar_col1:
-                p_lunar_year = st.selectbox(
-                    "乙方农历年",
-                    options=list(range(current_year, 1899, -1)),
-                    index=current_year - 1992,
-                    key="partner_lunar_year"
-                )
-            
-            # Check for leap month
-            p_lunar_year_obj = LunarYear.fromYear(p_lunar_year)
-            p_leap_month = p_lunar_year_obj.getLeapMonth()
-            
-            p_month_options = []
-            for m in range(1, 13):
-                p_month_options.append(f"{m}月")
-                if p_leap_month == m:
-                    p_month_options.append(f"闰{m}月")
-            
-            with p_lunar_col2:
-                p_lunar_month_str = st.selectbox(
-                    "乙方农历月",
-                    options=p_month_options,
-                    index=0,
-                    key="partner_lunar_month"
-                )
-            
-            # Parse month
-            if p_lunar_month_str.startswith("闰"):
-                p_is_leap = True
-                p_lunar_month = int(p_lunar_month_str[1:-1])
-            else:
-                p_is_leap = False
-                p_lunar_month = int(p_lunar_month_str[:-1])
-            
-            with p_lunar_col3:
-                p_lunar_day = st.selectbox(
-                    "乙方农历日",
-                    options=list(range(1, 31)),
-                    index=0,
-                    format_func=lambda x: f"初{x}" if x <= 10 else (f"十{['一', '二', '三', '四', '五', '六', '七', '八', '九', '十'][x-11]}" if x <= 20 else (f"廿{['一', '二', '三', '四', '五', '六', '七', '八', '九', '十'][x-21]}" if x < 30 else "三十")),
-                    key="partner_lunar_day"
-                )
-            
-            # Convert to solar
-            try:
-                p_lunar_month_param = -p_lunar_month if p_is_leap else p_lunar_month
-                p_lunar_date = Lunar.fromYmd(p_lunar_year, p_lunar_month_param, p_lunar_day)
-                p_solar_date = p_lunar_date.getSolar()
-                partner_birthday = date(p_solar_date.getYear(), p_solar_date.getMonth(), p_solar_date.getDay())
-                st.caption(f"📅 对应阳历: {partner_birthday.year}年{partner_birthday.month}月{partner_birthday.day}日")
-            except Exception as e:
-                st.error(f"乙方农历日期无效: {str(e)}")
-                partner_birthday = date(1992, 1, 1)
-        
-        # Partner Birth Time - with shichen option
-        st.markdown('<p class="section-label">⏰ 出生时间</p>', unsafe_allow_html=True)
-        
-        if "partner_time_mode" not in st.session_state:
-            st.session_state.partner_time_mode = "exact"
-        
-        partner_time_mode = st.radio(
-            "乙方时间类型",
-            options=["精确时间", "时辰"],
-            index=0 if st.session_state.partner_time_mode == "exact" else 1,
-            horizontal=True,
-            label_visibility="collapsed",
-            key="partner_time_radio"
-        )
-        
-        if partner_time_mode == "精确时间" and st.session_state.partner_time_mode != "exact":
-            st.session_state.partner_time_mode = "exact"
-            st.rerun()
-        elif partner_time_mode == "时辰" and st.session_state.partner_time_mode != "shichen":
-            st.session_state.partner_time_mode = "shichen"
-            st.rerun()
-        
-        if st.session_state.partner_time_mode == "exact":
-            partner_time_col_h, partner_time_col_m = st.columns(2)
-            with partner_time_col_h:
-                partner_birth_hour = st.selectbox(
-                    "对方小时",
-                    options=list(range(24)),
-                    index=12,
-                    format_func=lambda x: f"{x:02d}",
-                    key="partner_hour"
-                )
-            with partner_time_col_m:
-                partner_birth_minute = st.selectbox(
-                    "对方分钟",
-                    options=list(range(0, 60, 5)),
-                    index=0,
-                    format_func=lambda x: f"{x:02d}",
-                    key="partner_minute"
-                )
-            partner_final_hour = partner_birth_hour
-            partner_final_minute = partner_birth_minute
-        else:
-            # Shichen mode
-            partner_shichen = st.selectbox(
-                "乙方时辰",
-                options=list(SHICHEN_HOURS.keys()),
-                index=6,
-                key="partner_shichen"
+                format_func=format_two_digits
             )
-            partner_final_hour = get_shichen_mid_hour(partner_shichen)
-            partner_final_minute = 0
-        
-        # Partner Birthplace - Searchable Dropdown
-        st.markdown('<p class="section-label">📍 出生地点</p>', unsafe_allow_html=True)
-        
-        partner_birthplace, partner_longitude = searchable_city_select(
-            label="对方出生城市",
-            key_prefix="partner_city"
+            st.session_state.form.birth_minute = birth_minute
+        final_hour = birth_hour
+        final_minute = birth_minute
+
+    else:  # shichen mode
+        shichen = st.selectbox(
+            "选择时辰",
+            options=SHICHEN_OPTIONS,
+            index=6
         )
+        final_hour = SHICHEN_MID_HOURS[shichen]
+        final_minute = 0
 
+    # Birthplace Input Section - Searchable Dropdown
+    st.markdown('<p class="section-label">📍 出生地点 (用于真太阳时计算)</p>', unsafe_allow_html=True)
+    
+    birthplace, longitude = searchable_city_select(
+        label="选择出生城市",
+        key_prefix="main_city"
+    )
+
+
+    # ========== Partner Input Form (Compatibility Mode Only) ==========
+    if st.session_state.compatibility_mode:
+        render_partner_form()
 
-    # ========== Save Profile Dialog ==========
-    @st.dialog("保存档案")
-    def save_profile_dialog():
-        """Dialog to save current form values as a profile with user-defined ID."""
-        st.markdown("为当前输入的信息设置一个唯一ID，以便日后快速加载。")
-        
-        new_profile_id = st.text_input(
-            "档案ID",
-            placeholder="输入字母/数字组合，如: Boss123",
-            max_chars=50
-        )
-        
-        col_confirm, col_cancel = st.columns(2)
-        with col_confirm:
-            if st.button("✓ 确认保存", use_container_width=True, type="primary"):
-                if not new_profile_id.strip():
-                    st.error("请输入档案ID")
-                elif profile_exists(new_profile_id.strip()):
-                    st.error("❌ ID已存在，请换一个")
-                else:
-                    # Get current form values from session state
-                    # These need to be captured before dialog opens
-                    save_success = save_profile(
-                        profile_id=new_profile_id.strip(),
-                        gender=st.session_state.get("_save_gender", "男"),
-                        birth_year=st.session_state.get("_save_year", 1990),
-                        birth_month=st.session_state.get("_save_month", 1),
-                        birth_day=st.session_state.get("_save_day", 1),
-                        birth_hour=st.session_state.get("_save_hour", "午时 (11:00-13:00)"),
-                        city=st.session_state.get("_save_city", None),
-                        is_lunar=st.session_state.get("_save_is_lunar", False)
-                    )
-                    if save_success:
-                        # Update session state immediately to sync with daily divination
-                        st.session_state.loaded_profile_id = new_profile_id.strip()
-                        st.session_state.loaded_profile = {
-                            "id": new_profile_id.strip(),
-                            "gender": st.session_state.get("_save_gender", "男"),
-                            "birth_year": st.session_state.get("_save_year", 1990),
-                            "birth_month": st.session_state.get("_save_month", 1),
-                            "birth_day": st.session_state.get("_save_day", 1),
-                            "birth_hour": st.session_state.get("_save_hour", "12:00"),
-                            "city": st.session_state.get("_save_city", None)
-                        }
-                        
-                        st.success(f"✓ 档案 '{new_profile_id.strip()}' 已保存!")
-                        st.balloons()
-                        import time
-                        time.sleep(0.5)  # Give user a moment to see success
-                        st.rerun()  # Close dialog by rerunning
-                    else:
-                        st.error("保存失败")
-        
-        with col_cancel:
-            if st.button("✕ 取消", use_container_width=True):
-                st.rerun()
 
     # Calculate and Save buttons row
     st.markdown("")
@@ -1970,7 +2007,7 @@ if not st.session_state.has_result:
         
         provider = st.selectbox(
             "选择 AI 提供商",
-            list(AI_PROVIDERS.keys()),
+            AI_PROVIDER_NAMES,
             index=0
         )
         
@@ -2037,14 +2074,21 @@ if not st.session_state.has_result:
             gender=gender,
             birthplace=birthplace,
         )
-        chart_generator = result["chart_generator"]
         pattern_info = result["pattern_info"]
         bazi_result = result["bazi_result"]
         
         # ========== Compatibility Mode: Calculate Partner's Bazi ==========
         if st.session_state.compatibility_mode:
+            partner = st.session_state.partner_form
+            partner_gender = partner["gender"]
+            relation_type = partner["relation_type"]
+            partner_birthday = partner["birthday"]
+            partner_final_hour = partner["final_hour"]
+            partner_final_minute = partner["final_minute"]
+            partner_longitude = partner["longitude"]
+
             # Calculate partner's Bazi
-            partner_bazi_result, partner_time_info, partner_pattern_info = calculate_bazi(
+            partner_bazi_result, partner_time_info, partner_pattern_info = cached_calculate_bazi(
                 partner_birthday.year,
                 partner_birthday.month,
                 partner_birthday.day,
@@ -2059,54 +2103,35 @@ if not st.session_state.has_result:
             st.session_state.stored_partner_gender = partner_gender
             st.session_state.stored_relation_type = relation_type
             
-            # Build partner chart data for couple chart
-            partner_chart_data = {
-                "year_pillar": (partner_pattern_info.get("year_pillar", "??")[0], partner_pattern_info.get("year_pillar", "??")[1]),
-                "month_pillar": (partner_pattern_info.get("month_pillar", "??")[0], partner_pattern_info.get("month_pillar", "??")[1]),
-                "day_pillar": (partner_pattern_info.get("day_pillar", "??")[0], partner_pattern_info.get("day_pillar", "??")[1]),
-                "hour_pillar": (partner_pattern_info.get("hour_pillar", "??")[0], partner_pattern_info.get("hour_pillar", "??")[1]),
-            }
-            
-            # Build my chart data for couple chart
-            my_chart_data = {
-                "year_pillar": (pattern_info.get("year_pillar", "??")[0], pattern_info.get("year_pillar", "??")[1]),
-                "month_pillar": (pattern_info.get("month_pillar", "??")[0], pattern_info.get("month_pillar", "??")[1]),
-                "day_pillar": (pattern_info.get("day_pillar", "??")[0], pattern_info.get("day_pillar", "??")[1]),
-                "hour_pillar": (pattern_info.get("hour_pillar", "??")[0], pattern_info.get("hour_pillar", "??")[1]),
-            }
+            # Both people's pillars as hashable tuples for the couple chart / compatibility caches
+            my_pillars = couple_pillars(pattern_info)
+            partner_pillars = couple_pillars(partner_pattern_info)
             
             # Generate couple chart SVG
-            st.session_state.couple_svg = chart_generator.generate_couple_chart(my_chart_data, partner_chart_data)
+            st.session_state.couple_svg = cached_couple_chart_svg(my_pillars, partner_pillars)
             
             # Run compatibility analysis
-            compatibility_calc = BaziCompatibilityCalculator()
-            compat_result = compatibility_calc.analyze_compatibility(my_chart_data, partner_chart_data)
+            compat_result = cached_compatibility(my_pillars, partner_pillars)
             st.session_state.compatibility_result = compat_result
             
             # Build combined user context for LLM
             partner_birth_dt = f"{partner_birthday.year}年{partner_birthday.month}月{partner_birthday.day}日 {partner_final_hour:02d}:{partner_final_minute:02d}"
             
             # Add compatibility info to user context
-            compatibility_context = f"""
-【双人合盘信息】
-
-**甲方 (我)：**
-{bazi_result}
-性别：{gender}
-
-**乙方 (Ta)：**
-{partner_bazi_result}
-性别：{partner_gender}
-
-**后端计算的日柱关系：**
-"""
-            for detail in compat_result['details']:
-                compatibility_context += f"- {detail}\n"
-            
-            compatibility_context += f"\n**初步匹配分数：** {compat_result['base_score']}/100\n"
+            context_parts = [
+                st.session_state.user_context,
+                COMPATIBILITY_CONTEXT_TEMPLATE.format(
+                    bazi_result=bazi_result,
+                    gender=gender,
+                    partner_bazi_result=partner_bazi_result,
+                    partner_gender=partner_gender,
+                ),
+            ]
+            context_parts.extend(f"- {detail}\n" for detail in compat_result['details'])
+            context_parts.append(f"\n**初步匹配分数：** {compat_result['base_score']}/100\n")
             
-            # Append compatibility context to user context
-            st.session_state.user_context += compatibility_context
+            # Append compatibility context to user context in one join
+            st.session_state.user_context = "".join(context_parts)
         
         st.rerun()
 
@@ -2114,15 +2139,13 @@ if not st.session_state.has_result:
 # Show results if Bazi is calculated
 else:
     # Display chart based on mode
-    if st.session_state.compatibility_mode and hasattr(st.session_state, 'couple_svg') and st.session_state.couple_svg:
+    if st.session_state.compatibility_mode and st.session_state.get('couple_svg'):
         # Show couple chart in compatibility mode
         st.markdown("### 💕 双人排盘")
-        couple_svg_container = f'''
-        <div class="bazi-chart-container" style="max-width: 800px;">
-            {st.session_state.couple_svg}
-        </div>
-        '''
-        st.markdown(couple_svg_container, unsafe_allow_html=True)
+        st.markdown(
+            chart_container_html(st.session_state.couple_svg, style="max-width: 800px;"),
+            unsafe_allow_html=True
+        )
         
         # Show compatibility score preview
         if st.session_state.compatibility_result:
@@ -2140,9 +2163,9 @@ else:
                     st.markdown(f"<p style='color: #e0e0e0; margin: 5px 0;'>{detail}</p>", unsafe_allow_html=True)
         
         # Show both genders
-        st.markdown(f'<div class="time-info">👤 甲方: {st.session_state.gender} | 👤 乙方: {getattr(st.session_state, "stored_partner_gender", "未知")}</div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="time-info">👤 甲方: {st.session_state.gender} | 👤 乙方: {st.session_state.get("stored_partner_gender", "未知")}</div>', unsafe_allow_html=True)
         
-    elif hasattr(st.session_state, 'pattern_info') and st.session_state.pattern_info:
+    elif st.session_state.get('pattern_info'):
         if st.session_state.time_info:
             st.markdown(
                 f'<div class="time-info">📐 {st.session_state.time_info} | 出生地: {st.session_state.birthplace} | 性别: {st.session_state.gender}</div>',
@@ -2175,45 +2198,30 @@ else:
             st.markdown(basic_info_html, unsafe_allow_html=True)
 
         with tabs[1]:
-            if hasattr(st.session_state, 'bazi_svg') and st.session_state.bazi_svg:
-                centered_svg = f'''
-                <div class="bazi-chart-container">
-                    {st.session_state.bazi_svg}
-                </div>
-                '''
-                st.markdown(centered_svg, unsafe_allow_html=True)
-
-            if hasattr(st.session_state, 'energy_svg') and st.session_state.energy_svg:
+            if st.session_state.get('bazi_svg'):
+                st.markdown(chart_container_html(st.session_state.bazi_svg), unsafe_allow_html=True)
+
+            if st.session_state.get('energy_svg'):
                 st.markdown("")
                 st.markdown('<h3 style="text-align: center; color: #FFD700; margin-bottom: 10px;">📊 五行能量分布</h3>', unsafe_allow_html=True)
 
-                import base64
-                energy_svg_b64 = base64.b64encode(st.session_state.energy_svg.encode()).decode()
-                energy_chart_html = f'''
-                <div style="display: flex; justify-content: center; margin: 15px 0;">
-                    <img src="data:image/svg+xml;base64,{energy_svg_b64}" style="max-width: 100%; width: 400px; height: auto;"/>
-                </div>
-                '''
-                st.markdown(energy_chart_html, unsafe_allow_html=True)
+                # Inline SVG (no base64 round-trip); sized by .energy-chart-container
+                st.markdown(
+                    chart_container_html(st.session_state.energy_svg, "energy-chart-container"),
+                    unsafe_allow_html=True
+                )
 
-                if hasattr(st.session_state, 'dominant_element') and hasattr(st.session_state, 'weakest_element'):
+                if 'dominant_element' in st.session_state and 'weakest_element' in st.session_state:
                     dominant = st.session_state.dominant_element
                     weakest = st.session_state.weakest_element
-                    element_colors = {"木": "🟢", "火": "🔴", "土": "🟠", "金": "🟡", "水": "🔵"}
-                    metrics_html = f'''
-                    <div style="display: flex; justify-content: center; gap: 60px; margin: 20px 0;">
-                        <div style="text-align: center;">
-                            <div style="color: #888; font-size: 0.9rem; margin-bottom: 5px;">⬆️ 最强五行</div>
-                            <div style="font-size: 2rem; font-weight: bold; color: #FFFFFF;">{element_colors.get(dominant[0], '')} {dominant[0]}</div>
-                            <div style="color: #2ecc71; font-size: 0.9rem;">↑ {int(dominant[1] * 100)}%</div>
-                        </div>
-                        <div style="text-align: center;">
-                            <div style="color: #888; font-size: 0.9rem; margin-bottom: 5px;">⬇️ 最弱五行</div>
-                            <div style="font-size: 2rem; font-weight: bold; color: #FFFFFF;">{element_colors.get(weakest[0], '')} {weakest[0]}</div>
-                            <div style="color: #e74c3c; font-size: 0.9rem;">↓ {int(weakest[1] * 100)}%</div>
-                        </div>
-                    </div>
-                    '''
+                    metrics_html = ENERGY_METRICS_TEMPLATE.format(
+                        dominant_icon=ELEMENT_COLOR_EMOJI.get(dominant[0], ''),
+                        dominant=dominant[0],
+                        dominant_pct=int(dominant[1] * 100),
+                        weakest_icon=ELEMENT_COLOR_EMOJI.get(weakest[0], ''),
+                        weakest=weakest[0],
+                        weakest_pct=int(weakest[1] * 100),
+                    )
                     st.markdown(metrics_html, unsafe_allow_html=True)
                 st.markdown("")
 
@@ -2404,7 +2412,7 @@ else:
 
             tables_html_parts = [table_html]
 
-            fortune = st.session_state.fortune_cycles if hasattr(st.session_state, "fortune_cycles") else None
+            fortune = st.session_state.fortune_cycles if "fortune_cycles" in st.session_state else None
             if fortune:
                 def format_ganzhi(gz: str) -> str:
                     if not gz or len(gz) < 2:
@@ -2577,592 +2585,482 @@ else:
         st.markdown(f'<div class="bazi-display">{st.session_state.bazi_result}</div>', unsafe_allow_html=True)
     
 
-    st.markdown("---")
+    # Topic buttons, oracle, generation and history run as one fragment: clicks here
+    # rerun only this panel, not the charts above or the sidebar (st.rerun() stays app-wide)
+    @st.fragment
+    def render_results_panel() -> None:
+        """Interactive half of the results page (topics, oracle, pending generation, history, export)."""
+        st.markdown("---")
     
-    # Check if currently generating
-    is_generating = st.session_state.is_generating
+        # Check if currently generating
+        is_generating = st.session_state.is_generating
     
-    # ========== Different Button Layout for Single vs Compatibility Mode ==========
-    if st.session_state.compatibility_mode:
-        # Compatibility Mode - 4 focused analysis buttons in 2x2 layout
-        st.markdown("### 🤔 你想问什么？")
-        
-        # Define focused prompt templates for each topic
-        COUPLE_PROMPTS = {
-            "缘分契合度": "请重点从【性格互补】和【灵魂羁绊】的角度分析。判断两人是正缘还是孽缘，用唯美的比喻描述这段关系。",
-            "婚姻前景": "请重点分析【未来5年的流年走势】。判断两人结婚的概率，最佳结婚年份，以及未来可能遇到的感情危机年份。",
-            "避雷指南": "请重点分析两人的【矛盾引爆点】。例如一方冷战一方暴躁。请给出具体的、心理学层面的沟通建议和哄人技巧。",
-            "对方旺我吗": "请重点分析【五行能量的相互影响】。判断乙方是否能补足甲方的喜用神。和对方在一起，甲方的财运、事业运是会提升还是被消耗？"
-        }
-        
-        # 2x2 button layout
-        col1, col2 = st.columns(2)
-        with col1:
-            is_clicked_soul = "缘分契合度" in st.session_state.clicked_topics
-            btn_soul = st.button(
-                f"{'✓' if is_clicked_soul else '💖'} 缘分契合度", 
-                key="btn_compat_soul", 
-                use_container_width=True, 
-                disabled=is_generating
-            )
-            is_clicked_conflict = "避雷指南" in st.session_state.clicked_topics
-            btn_conflict = st.button(
-                f"{'✓' if is_clicked_conflict else '💣'} 避雷指南", 
-                key="btn_compat_conflict", 
-                use_container_width=True, 
-                disabled=is_generating
-            )
-        with col2:
-            is_clicked_marriage = "婚姻前景" in st.session_state.clicked_topics
-            btn_marriage = st.button(
-                f"{'✓' if is_clicked_marriage else '💍'} 婚姻前景", 
-                key="btn_compat_marriage", 
-                use_container_width=True, 
-                disabled=is_generating
-            )
-            is_clicked_wealth = "对方旺我吗" in st.session_state.clicked_topics
-            btn_wealth = st.button(
-                f"{'✓' if is_clicked_wealth else '💰'} 对方旺我吗", 
-                key="btn_compat_wealth", 
-                use_container_width=True, 
-                disabled=is_generating
+        # ========== Different Button Layout for Single vs Compatibility Mode ==========
+        if st.session_state.compatibility_mode:
+            # Compatibility Mode - 4 focused analysis topics
+            st.markdown("### 🤔 你想问什么？")
+
+            # One pills widget instead of a 2x2 button grid
+            topic_pills(
+                "合盘主题",
+                COUPLE_TOPICS,
+                "compat_topic_pills",
+                icons=COUPLE_TOPIC_ICONS,
+                focus_prompts=COUPLE_PROMPTS,
+                disabled=is_generating,
             )
+
+            # "大师解惑" button below the topics
+            st.markdown("")
+            st.button("💬 大师解惑", key="btn_compat_custom", use_container_width=True,
+                      disabled=is_generating, on_click=open_custom_input)
+        else:
+            # Single Mode - topic pills + Oracle button
+            st.markdown("### 🌟 选择想要了解的内容")
         
-        # "大师解惑" button below the 2x2 grid
-        st.markdown("")
-        if st.button("💬 大师解惑", key="btn_compat_custom", use_container_width=True, disabled=is_generating):
-            st.session_state.show_custom_input = True
-            st.rerun()
-        
-        # Determine which button was clicked and set the focus instruction
-        selected_topic = None
-        selected_focus = ""
-        
-        if btn_soul:
-            selected_topic = "缘分契合度"
-            selected_focus = COUPLE_PROMPTS["缘分契合度"]
-        elif btn_marriage:
-            selected_topic = "婚姻前景"
-            selected_focus = COUPLE_PROMPTS["婚姻前景"]
-        elif btn_conflict:
-            selected_topic = "避雷指南"
-            selected_focus = COUPLE_PROMPTS["避雷指南"]
-        elif btn_wealth:
-            selected_topic = "对方旺我吗"
-            selected_focus = COUPLE_PROMPTS["对方旺我吗"]
-        
-        if selected_topic:
-            if selected_topic in st.session_state.clicked_topics:
-                # Already clicked - scroll to existing result
-                st.session_state.scroll_to_topic = selected_topic
-                st.session_state.scroll_timestamp = datetime.now().timestamp()
-                st.rerun()
-            else:
-                # New click - trigger analysis
-                st.session_state.clicked_topics.add(selected_topic)
-                st.session_state.pending_topic = selected_topic
-                st.session_state.pending_focus_instruction = selected_focus  # Store focus instruction
-                st.session_state.is_generating = True
-                st.rerun()
-    else:
-        # Single Mode - Regular buttons + Oracle button
-        st.markdown("### 🌟 选择想要了解的内容")
-        
-        # Button array - buttons are disabled during generation
-        # First row: 4 main topics
-        cols = st.columns(4)
-        
-        for i, topic in enumerate(ANALYSIS_TOPICS[:4]):
-            with cols[i]:
-                is_clicked = topic in st.session_state.clicked_topics
-                button_label = f"✓ {topic}" if is_clicked else topic
-                if st.button(button_label, key=f"btn_{topic}", use_container_width=True, disabled=is_generating):
-                    if topic in st.session_state.clicked_topics:
-                        st.session_state.scroll_to_topic = topic
-                        st.session_state.scroll_timestamp = datetime.now().timestamp()
-                        st.rerun()
-                    else:
-                        st.session_state.clicked_topics.add(topic)
-                        st.session_state.pending_topic = topic
-                        st.session_state.is_generating = True
-                        st.rerun()
-        
-        # Second row: Remaining 2 topics + Oracle button + 大师解惑
-        cols2 = st.columns(4)
-        
-        # 开运建议 (index 4)
-        with cols2[0]:
-            topic = ANALYSIS_TOPICS[4]
-            is_clicked = topic in st.session_state.clicked_topics
-            button_label = f"✓ {topic}" if is_clicked else topic
-            if st.button(button_label, key=f"btn_{topic}", use_container_width=True, disabled=is_generating):
-                if topic in st.session_state.clicked_topics:
-                    st.session_state.scroll_to_topic = topic
-                    st.session_state.scroll_timestamp = datetime.now().timestamp()
-                    st.rerun()
-                else:
-                    st.session_state.clicked_topics.add(topic)
-                    st.session_state.pending_topic = topic
-                    st.session_state.is_generating = True
-                    st.rerun()
-        
-        # 大运流年 (index 5)
-        with cols2[1]:
-            topic = ANALYSIS_TOPICS[5]
-            is_clicked = topic in st.session_state.clicked_topics
-            button_label = f"✓ {topic}" if is_clicked else topic
-            if st.button(button_label, key=f"btn_{topic}", use_container_width=True, disabled=is_generating):
-                if topic in st.session_state.clicked_topics:
-                    st.session_state.scroll_to_topic = topic
-                    st.session_state.scroll_timestamp = datetime.now().timestamp()
-                    st.rerun()
-                else:
-                    st.session_state.clicked_topics.add(topic)
-                    st.session_state.pending_topic = topic
-                    st.session_state.is_generating = True
-                    st.rerun()
-        
-        # 🎴 每日一卦 (Oracle button)
-        with cols2[2]:
-            # Check if profile is loaded (required for daily quota)
-            has_profile = st.session_state.loaded_profile_id is not None
-            oracle_label = "✓ 每日一卦" if "oracle" in st.session_state.clicked_topics else "🎴 每日一卦"
+            # Six fixed topics as one pills widget (disabled during generation)
+            topic_pills("分析主题", ANALYSIS_TOPICS[:6], "topic_pills", disabled=is_generating)
+
+            # Oracle button + 大师解惑
+            cols2 = st.columns(2)
+
+            # 🎴 每日一卦 (Oracle button)
+            with cols2[0]:
+                # Check if profile is loaded (required for daily quota)
+                has_profile = st.session_state.loaded_profile_id is not None
+                oracle_label = "✓ 每日一卦" if "oracle" in st.session_state.clicked_topics else "🎴 每日一卦"
             
-            if not has_profile:
-                # No profile loaded - show disabled button with tooltip
-                st.button(oracle_label, key="btn_oracle", use_container_width=True, disabled=True, help="需读取或建立档案")
-            else:
-                # Check database quota
-                has_quota = check_daily_quota(st.session_state.loaded_profile_id)
-                oracle_disabled = is_generating or (not has_quota and "oracle" not in st.session_state.clicked_topics)
+                if not has_profile:
+                    # No profile loaded - show disabled button with tooltip
+                    st.button(oracle_label, key="btn_oracle", use_container_width=True, disabled=True, help="需读取或建立档案")
+                else:
+                    # Check database quota
+                    has_quota = check_daily_quota(st.session_state.loaded_profile_id)
+                    oracle_disabled = is_generating or (not has_quota and "oracle" not in st.session_state.clicked_topics)
                 
-                if st.button(oracle_label, key="btn_oracle", use_container_width=True, disabled=oracle_disabled):
-                    if "oracle" in st.session_state.clicked_topics:
-                        # Scroll to existing oracle result
-                        st.session_state.scroll_to_topic = "oracle"
-                        st.session_state.scroll_timestamp = datetime.now().timestamp()
-                        st.rerun()
-                    elif has_quota:
-                        st.session_state.oracle_mode = True
-                        st.rerun()
+                    st.button(oracle_label, key="btn_oracle", use_container_width=True, disabled=oracle_disabled,
+                              on_click=open_oracle, args=(has_quota,))
                 
-                # Show quota status below button
-                if not has_quota and "oracle" not in st.session_state.clicked_topics:
-                    st.caption("🍵 今日已用")
-        
-        # 大师解惑 (index 6)
-        with cols2[3]:
-            topic = ANALYSIS_TOPICS[6]  # "大师解惑"
-            if st.button(f"💬 {topic}", key=f"btn_{topic}", use_container_width=True, disabled=is_generating):
-                st.session_state.show_custom_input = True
-                st.rerun()
-    
-    
-    # Custom question input
-    if st.session_state.show_custom_input:
-        st.markdown("---")
-        custom_col1, custom_col2 = st.columns([4, 1])
-        with custom_col1:
-            custom_question = st.text_input(
-                "💬 请输入您的问题",
-                key=f"custom_q_{st.session_state.custom_question_count}",
-                placeholder="例如：我今年适合跳槽吗？"
-            )
-        with custom_col2:
-            st.markdown("<br>", unsafe_allow_html=True)
-            if st.button("提交", key="submit_custom", use_container_width=True, disabled=is_generating):
-                if custom_question.strip():
-                    st.session_state.pending_topic = "大师解惑"
-                    st.session_state.pending_custom_question = custom_question
-                    st.session_state.custom_question_count += 1
-                    st.session_state.show_custom_input = False
-                    st.session_state.is_generating = True
-                    st.rerun()
-    
-    # ========== Oracle Mode (每日一卦) UI ==========
-    if st.session_state.oracle_mode:
-        st.markdown("---")
-        st.markdown('<h3 style="color: #FFD700; text-shadow: 0 1px 3px rgba(0,0,0,0.5);">🎴 每日一卦 - 周易占卜</h3>', unsafe_allow_html=True)
-        
-        # Step 1: Input question (if not already set)
-        if not st.session_state.oracle_question:
-            oracle_question = st.text_input(
-                "🔮 请输入您想卜问的事情",
-                key="oracle_question_input",
-                placeholder="例如：这份工作机会值得抓住吗？"
-            )
-            if st.button("确认卜问", key="confirm_oracle_question", use_container_width=True):
-                if oracle_question.strip():
-                    st.session_state.oracle_question = oracle_question.strip()
-                    st.session_state.oracle_shake_count = 0
-                    st.rerun()
-                else:
+                    # Show quota status below button
+                    if not has_quota and "oracle" not in st.session_state.clicked_topics:
+                        st.caption("🍵 今日已用")
+        
+            # 大师解惑 (index 6)
+            with cols2[1]:
+                topic = ANALYSIS_TOPICS[6]  # "大师解惑"
+                st.button(f"💬 {topic}", key=f"btn_{topic}", use_container_width=True,
+                          disabled=is_generating, on_click=open_custom_input)
+        
+            # Generate all remaining fixed topics with one LLM request
+            remaining_topics = [
+                t for t in ANALYSIS_TOPICS[:6] if t not in st.session_state.clicked_topics
+            ]
+            if len(remaining_topics) > 1:
+                st.button(
+                    f"⚡ 一次性生成剩余 {len(remaining_topics)} 个主题",
+                    key="btn_batch_topics",
+                    use_container_width=True,
+                    disabled=is_generating,
+                    on_click=queue_batch_topics,
+                    args=(remaining_topics,)
+                )
+            batch_error = st.session_state.pop("batch_error", None)
+            if batch_error:
+                st.error(f"❌ 批量生成失败：{batch_error}")
+    
+    
+        # Custom question input
+        if st.session_state.show_custom_input:
+            st.markdown("---")
+            custom_col1, custom_col2 = st.columns([4, 1])
+            custom_question_key = f"custom_q_{st.session_state.custom_question_count}"
+            with custom_col1:
+                st.text_input(
+                    "💬 请输入您的问题",
+                    key=custom_question_key,
+                    placeholder="例如：我今年适合跳槽吗？"
+                )
+            with custom_col2:
+                st.markdown("<br>", unsafe_allow_html=True)
+                st.button("提交", key="submit_custom", use_container_width=True, disabled=is_generating,
+                          on_click=submit_custom_question, args=(custom_question_key,))
+    
+        # ========== Oracle Mode (每日一卦) UI ==========
+        if st.session_state.oracle_mode:
+            st.markdown("---")
+            st.markdown('<h3 style="color: #FFD700; text-shadow: 0 1px 3px rgba(0,0,0,0.5);">🎴 每日一卦 - 周易占卜</h3>', unsafe_allow_html=True)
+        
+            # Step 1: Input question (if not already set)
+            if not st.session_state.oracle_question:
+                st.text_input(
+                    "🔮 请输入您想卜问的事情",
+                    key="oracle_question_input",
+                    placeholder="例如：这份工作机会值得抓住吗？"
+                )
+                st.button("确认卜问", key="confirm_oracle_question", use_container_width=True,
+                          on_click=confirm_oracle_question)
+                if st.session_state.pop("oracle_question_missing", False):
                     st.warning("请先输入您想卜问的事情")
         
-        # Step 2: Shaking / Clicking 3 times
-        elif st.session_state.oracle_shake_count < 3:
-            st.info(f"📿 您正在卜问：**{st.session_state.oracle_question}**")
+            # Step 2: Shaking / Clicking 3 times
+            elif st.session_state.oracle_shake_count < 3:
+                st.info(f"📿 您正在卜问：**{st.session_state.oracle_question}**")
             
-            # Reminder to silently repeat the question 3 times
-            st.markdown('''
-            <div style="background: linear-gradient(145deg, rgba(255, 215, 0, 0.15), rgba(255, 140, 0, 0.1)); 
-                        border: 1px solid rgba(255, 215, 0, 0.4); 
-                        border-radius: 12px; 
-                        padding: 15px 20px; 
-                        margin: 15px 0;
-                        text-align: center;">
-                <p style="color: #FFD700; font-family: 'Noto Serif SC', serif; font-size: 1.1rem; margin: 0;">
-                    🙏 请在心中默念您的问题三遍后，再投掷铜钱
-                </p>
-                <p style="color: #CCCCCC; font-size: 0.9rem; margin-top: 8px; margin-bottom: 0;">
-                    诚心诚意，心诚则灵
-                </p>
-            </div>
-            ''', unsafe_allow_html=True)
+                # Reminder to silently repeat the question 3 times
+                st.markdown(ORACLE_REMINDER_HTML, unsafe_allow_html=True)
             
-            # Progress display
-            shake_progress = "🪙" * st.session_state.oracle_shake_count + "⚪" * (3 - st.session_state.oracle_shake_count)
-            st.markdown(f"### 进度：{shake_progress} ({st.session_state.oracle_shake_count}/3)")
-            st.caption("点击下方按钮 3 次，或摇动手机（移动端）完成起卦")
+                # Progress display
+                shake_progress = "🪙" * st.session_state.oracle_shake_count + "⚪" * (3 - st.session_state.oracle_shake_count)
+                st.markdown(f"### 进度：{shake_progress} ({st.session_state.oracle_shake_count}/3)")
+                st.caption("点击下方按钮 3 次，或摇动手机（移动端）完成起卦")
             
-            # Shake button
-            if st.button("🪙 投掷铜钱", key=f"shake_{st.session_state.oracle_shake_count}", use_container_width=True):
-                st.session_state.oracle_shake_count += 1
-                if st.session_state.oracle_shake_count >= 3:
-                    # Cast hexagram
-                    calculator = ZhouyiCalculator()
-                    st.session_state.oracle_hex_result = calculator.cast_hexagram()
-                st.rerun()
+                # Shake button
+                st.button("🪙 投掷铜钱", key=f"shake_{st.session_state.oracle_shake_count}", use_container_width=True,
+                          on_click=shake_coins)
             
-            # Mobile shake detection (JavaScript injection with iOS permission handling)
-            shake_js = f'''
-            <script>
-            (function() {{
-                // Prevent duplicate initialization
-                if (window.shakeHandlerInitialized) return;
-                window.shakeHandlerInitialized = true;
-                
-                var lastShakeTime = 0;
-                var shakeThreshold = 20;
-                
-                function handleMotion(event) {{
-                    var acceleration = event.accelerationIncludingGravity;
-                    if (!acceleration) return;
-                    
-                    var total = Math.abs(acceleration.x || 0) + Math.abs(acceleration.y || 0) + Math.abs(acceleration.z || 0);
-                    
-                    if (total > shakeThreshold && Date.now() - lastShakeTime > 600) {{
-                        lastShakeTime = Date.now();
-                        // Find the coin toss button using multiple selectors for reliability
-                        var btn = null;
-                        var buttons = document.querySelectorAll('button');
-                        for (var i = 0; i < buttons.length; i++) {{
-                            if (buttons[i].textContent.includes('投掷铜钱')) {{
-                                btn = buttons[i];
-                                break;
-                            }}
-                        }}
-                        if (btn) {{
-                            btn.click();
-                        }}
-                    }}
-                }}
-                
-                // Check if DeviceMotionEvent requires permission (iOS 13+)
-                if (typeof DeviceMotionEvent !== 'undefined' && typeof DeviceMotionEvent.requestPermission === 'function') {{
-                    // iOS 13+ - need to request permission on user gesture
-                    // Create a one-time button to request permission
-                    if (!window.motionPermissionRequested) {{
-                        window.motionPermissionRequested = true;
-                        // Automatically try to add listener after any user interaction
-                        document.addEventListener('click', function requestMotionPermission() {{
-                            DeviceMotionEvent.requestPermission()
-                                .then(function(permissionState) {{
-                                    if (permissionState === 'granted') {{
-                                        window.addEventListener('devicemotion', handleMotion);
-                                    }}
-                                }})
-                                .catch(console.error);
-                            document.removeEventListener('click', requestMotionPermission);
-                        }}, {{ once: true }});
-                    }}
-                }} else if (window.DeviceMotionEvent) {{
-                    // Non-iOS or older iOS - can add listener directly
-                    window.addEventListener('devicemotion', handleMotion);
-                }}
-            }})();
-            </script>
-            '''
-            components.html(shake_js, height=0)
+                # Mobile shake detection (JavaScript injection with iOS permission handling)
+                components.html(SHAKE_DETECTION_HTML, height=0)
             
-            # Cancel button
-            if st.button("❌ 取消卜卦", key="cancel_oracle", use_container_width=True):
-                st.session_state.oracle_mode = False
-                st.session_state.oracle_question = ""
-                st.session_state.oracle_shake_count = 0
-                st.rerun()
+                # Cancel button
+                st.button("❌ 取消卜卦", key="cancel_oracle", use_container_width=True, on_click=reset_oracle)
         
-        # Step 3: Display hexagram result and get LLM interpretation
-        else:
-            hex_result = st.session_state.oracle_hex_result
-            if hex_result:
-                st.success("✨ 起卦成功！")
-                
-                # Display hexagram SVG
-                st.markdown("#### 🔮 卦象")
-                col_hex1, col_hex2 = st.columns(2)
+            # Step 3: Display hexagram result and get LLM interpretation
+            else:
+                hex_result = st.session_state.oracle_hex_result
+                if hex_result:
+                    st.success("✨ 起卦成功！")
                 
-                with col_hex1:
-                    st.markdown(f"**本卦：{hex_result['original_hex']}**")
-                    st.markdown(f'<p style="color: #ffd700; font-size: 0.9em;">{hex_result["original_meaning"]}</p>', unsafe_allow_html=True)
-                    hex_svg = draw_hexagram_svg(hex_result['original_binary'])
-                    st.markdown(f'<div style="text-align:center;">{hex_svg}</div>', unsafe_allow_html=True)
+                    # Display hexagram SVG
+                    st.markdown("#### 🔮 卦象")
+                    col_hex1, col_hex2 = st.columns(2)
                 
-                with col_hex2:
-                    if hex_result['has_change']:
-                        st.markdown(f"**变卦：{hex_result['future_hex']}**")
-                        st.markdown(f'<p style="color: #ffd700; font-size: 0.9em;">{hex_result["future_meaning"]}</p>', unsafe_allow_html=True)
-                        future_svg = draw_hexagram_svg(hex_result['future_binary'])
-                        st.markdown(f'<div style="text-align:center;">{future_svg}</div>', unsafe_allow_html=True)
-                    else:
-                        st.markdown("**无变卦**")
-                        st.caption("六爻皆静，本卦即是答案")
+                    with col_hex1:
+                        st.markdown(f"**本卦：{hex_result['original_hex']}**")
+                        st.markdown(f'<p style="color: #ffd700; font-size: 0.9em;">{hex_result["original_meaning"]}</p>', unsafe_allow_html=True)
+                        st.markdown(cached_hexagram_html(hex_result['original_binary']), unsafe_allow_html=True)
                 
-                # Hexagram details
-                with st.expander("📜 卦象详情"):
-                    st.markdown(f"**上卦（外卦）**：{hex_result['upper_trigram']}")
-                    st.markdown(f"**下卦（内卦）**：{hex_result['lower_trigram']}")
-                    if hex_result['changing_lines']:
-                        st.markdown(f"**动爻**：第 {', '.join(map(str, hex_result['changing_lines']))} 爻")
-                    st.markdown("---")
-                    for detail in hex_result['details']:
-                        st.caption(detail)
+                    with col_hex2:
+                        if hex_result['has_change']:
+                            st.markdown(f"**变卦：{hex_result['future_hex']}**")
+                            st.markdown(f'<p style="color: #ffd700; font-size: 0.9em;">{hex_result["future_meaning"]}</p>', unsafe_allow_html=True)
+                            st.markdown(cached_hexagram_html(hex_result['future_binary']), unsafe_allow_html=True)
+                        else:
+                            st.markdown("**无变卦**")
+                            st.caption("六爻皆静，本卦即是答案")
                 
-                # Build bazi context for oracle
-                bazi_data_for_oracle = {
-                    "day_pillar": st.session_state.bazi_result.split()[2] if st.session_state.bazi_result else ("?", "?"),
-                    "pattern_name": getattr(st.session_state, 'pattern_info', {}).get('name', '普通格局'),
-                    "strength": getattr(st.session_state, 'pattern_info', {}).get('strength', '未知'),
-                    "joy_elements": getattr(st.session_state, 'pattern_info', {}).get('joy_elements', '未知')
-                }
+                    # Hexagram details
+                    with st.expander("📜 卦象详情"):
+                        st.markdown(f"**上卦（外卦）**：{hex_result['upper_trigram']}")
+                        st.markdown(f"**下卦（内卦）**：{hex_result['lower_trigram']}")
+                        if hex_result['changing_lines']:
+                            st.markdown(f"**动爻**：第 {', '.join(map(str, hex_result['changing_lines']))} 爻")
+                        st.markdown("---")
+                        for detail in hex_result['details']:
+                            st.caption(detail)
                 
-                # Try to get better bazi data from user_context if available
-                if hasattr(st.session_state, 'pattern_info') and st.session_state.pattern_info:
-                    pattern_info = st.session_state.pattern_info
-                    bazi_data_for_oracle = {
-                        "day_pillar": (pattern_info.get('day_master', '?'), pattern_info.get('day_branch', '?')),
-                        "pattern_name": pattern_info.get('name', '普通格局'),
-                        "strength": pattern_info.get('strength', '未知'),
-                        "joy_elements": pattern_info.get('joy_elements', '未知')
-                    }
+                    # Build bazi context for oracle (prefer structured pattern_info)
+                    if pattern_info := st.session_state.get("pattern_info"):
+                        bazi_data_for_oracle = {
+                            "day_pillar": (pattern_info.get('day_master', '?'), pattern_info.get('day_branch', '?')),
+                            "pattern_name": pattern_info.get('name', '普通格局'),
+                            "strength": pattern_info.get('strength', '未知'),
+                            "joy_elements": pattern_info.get('joy_elements', '未知')
+                        }
+                    else:
+                        # Fall back to the plain-text bazi result
+                        bazi_parts = st.session_state.bazi_result.split() if st.session_state.bazi_result else []
+                        bazi_data_for_oracle = {
+                            "day_pillar": bazi_parts[2] if len(bazi_parts) > 2 else ("?", "?"),
+                            "pattern_name": '普通格局',
+                            "strength": '未知',
+                            "joy_elements": '未知'
+                        }
                 
-                # Trigger LLM interpretation
-                st.markdown("---")
-                st.markdown("### 🧙 大师解卦")
+                    # Trigger LLM interpretation
+                    st.markdown("---")
+                    st.markdown("### 🧙 大师解卦")
                 
-                # Build oracle prompt
-                oracle_prompt = build_oracle_prompt(
-                    user_question=st.session_state.oracle_question,
-                    hex_data=hex_result,
-                    bazi_data=bazi_data_for_oracle
-                )
+                    # Build oracle prompt
+                    oracle_prompt = build_oracle_prompt(
+                        user_question=st.session_state.oracle_question,
+                        hex_data=hex_result,
+                        bazi_data=bazi_data_for_oracle
+                    )
                 
-                # Get API config
-                api_config = st.session_state.api_config
+                    # Get API config
+                    api_config = st.session_state.api_config
                 
-                # Rate limiting check
-                if st.session_state.using_default_api:
-                    if st.session_state.default_api_usage_count >= DEFAULT_API_DAILY_LIMIT:
-                        st.error(f"⚠️ 默认 API 本次会话已达到 {DEFAULT_API_DAILY_LIMIT} 次使用限制。")
-                    elif not DEFAULT_API_KEY:
-                        st.error("⚠️ 服务器未配置默认 API Key。")
-                    else:
-                        # Stream LLM response
-                        with st.spinner("大师正在解读卦象..."):
-                            try:
-                                if st.session_state.using_default_api:
-                                    client = get_llm_client(DEFAULT_API_KEY, DEFAULT_BASE_URL)
-                                    model = DEFAULT_MODEL
-                                else:
-                                    client = get_llm_client(api_config['api_key'], api_config['base_url'])
-                                    model = api_config['model']
+                    # Rate limiting check
+                    if st.session_state.using_default_api:
+                        if st.session_state.default_api_usage_count >= DEFAULT_API_DAILY_LIMIT:
+                            st.error(f"⚠️ 默认 API 本次会话已达到 {DEFAULT_API_DAILY_LIMIT} 次使用限制。")
+                        elif not DEFAULT_API_KEY:
+                            st.error("⚠️ 服务器未配置默认 API Key。")
+                        else:
+                            # Stream LLM response
+                            with st.spinner("大师正在解读卦象..."):
+                                try:
+                                    if st.session_state.using_default_api:
+                                        client = get_llm_client(DEFAULT_API_KEY, DEFAULT_BASE_URL)
+                                        model = DEFAULT_MODEL
+                                    else:
+                                        client = get_llm_client(api_config['api_key'], api_config['base_url'])
+                                        model = api_config['model']
                                 
-                                response = client.chat.completions.create(
-                                    model=model,
-                                    messages=[
-                                        {"role": "system", "content": "你是一位精通《周易》六爻与《子平八字》的国学大师。"},
+                                    oracle_messages = [
+                                        # Static rubric as the system prompt: a shared prefix the provider can cache
+                                        {"role": "system", "content": ORACLE_SYSTEM_PROMPT},
                                         {"role": "user", "content": oracle_prompt}
-                                    ],
-                                    stream=True,
-                                    max_tokens=4000
-                                )
+                                    ]
                                 
-                                oracle_response = ""
-                                response_placeholder = st.empty()
-                                last_render_len = 0
-                                last_render_time = time.monotonic()
-                                render_min_chars = 120
-                                render_min_interval = 0.15
-                                render_updates = 0
-                                first_render_time = None
-                                start_time = time.monotonic()
-                                
-                                for chunk in response:
-                                    if chunk.choices[0].delta.content:
-                                        oracle_response += chunk.choices[0].delta.content
-                                        now = time.monotonic()
-                                        if (
-                                            len(oracle_response) - last_render_len >= render_min_chars
-                                            or now - last_render_time >= render_min_interval
-                                        ):
-                                            cleaned = clean_markdown_for_display(oracle_response)
-                                            response_placeholder.markdown(
-                                                f'<div class="fortune-text">{cleaned}</div>',
-                                                unsafe_allow_html=True
-                                            )
-                                            render_updates += 1
-                                            if first_render_time is None:
-                                                first_render_time = now
-                                            last_render_len = len(oracle_response)
-                                            last_render_time = now
-                                
-                                if last_render_len != len(oracle_response):
+                                    response_placeholder = st.empty()
+                                    stream_stats = {"first_token_time": None}
+                                    start_time = time.monotonic()
+
+                                    def _oracle_tokens():
+                                        """Yield non-empty content deltas from the OpenAI stream."""
+                                        response = client.chat.completions.create(
+                                            model=model,
+                                            messages=oracle_messages,
+                                            stream=True,
+                                            max_tokens=4000
+                                        )
+                                        for chunk in response:
+                                            delta = chunk.choices[0].delta.content
+                                            if delta:
+                                                if stream_stats["first_token_time"] is None:
+                                                    stream_stats["first_token_time"] = time.monotonic()
+                                                yield delta
+
+                                    # Merge tiny deltas so each websocket update carries a useful amount of text
+                                    with response_placeholder.container():
+                                        # A repeated reading (same model, hexagram, question and chart) comes from the response cache
+                                        oracle_stream = cached_stream(
+                                            response_cache_key(model, oracle_messages, max_tokens=4000),
+                                            _oracle_tokens,
+                                        )
+                                        oracle_response = st.write_stream(coalesce_stream(prefetch_stream(oracle_stream)))
+                                    if not isinstance(oracle_response, str):
+                                        oracle_response = "".join(str(part) for part in (oracle_response or []))
+                                    first_token_time = stream_stats["first_token_time"]
+
+                                    # Final styled render, cleaned once
                                     cleaned = clean_markdown_for_display(oracle_response)
                                     response_placeholder.markdown(
                                         f'<div class="fortune-text">{cleaned}</div>',
                                         unsafe_allow_html=True
                                     )
-                                    render_updates += 1
-                                    if first_render_time is None:
-                                        first_render_time = time.monotonic()
-                                
-                                if PERF_LOG:
-                                    total_ms = int((time.monotonic() - start_time) * 1000)
-                                    first_render_ms = (
-                                        int((first_render_time - start_time) * 1000)
-                                        if first_render_time else "NA"
-                                    )
-                                    print(
-                                        f"[PERF] oracle_ui total_ms={total_ms} first_render_ms={first_render_ms} "
-                                        f"renders={render_updates} chars={len(oracle_response)}",
-                                        flush=True
-                                    )
                                 
-                                # Save response and mark daily usage
-                                st.session_state.clicked_topics.add("oracle")
-                                st.session_state.responses.append(("oracle", f"🎴 {st.session_state.oracle_question}", oracle_response))
-                                st.session_state.oracle_used_today = True
-                                st.session_state.oracle_usage_date = datetime.now().strftime("%Y-%m-%d")
-                                st.session_state.default_api_usage_count += 1
+                                    if PERF_LOG:
+                                        total_ms = int((time.monotonic() - start_time) * 1000)
+                                        first_token_ms = (
+                                            int((first_token_time - start_time) * 1000)
+                                            if first_token_time else "NA"
+                                        )
+                                        print(
+                                            f"[PERF] oracle_ui total_ms={total_ms} first_token_ms={first_token_ms} "
+                                            f"chars={len(oracle_response)}",
+                                            flush=True
+                                        )
                                 
-                                # Consume daily quota in database (if profile loaded)
-                                if st.session_state.loaded_profile_id:
-                                    consume_daily_quota(st.session_state.loaded_profile_id)
+                                    # Save response and mark daily usage
+                                    st.session_state.clicked_topics.add("oracle")
+                                    append_response("oracle", f"🎴 {st.session_state.oracle_question}", oracle_response)
+                                    st.session_state.oracle_used_today = True
+                                    st.session_state.oracle_usage_date = datetime.now().strftime("%Y-%m-%d")
+                                    st.session_state.default_api_usage_count += 1
                                 
-                                # Auto-save session data if profile is loaded
-                                if st.session_state.loaded_profile_id:
-                                    update_session_data(st.session_state.loaded_profile_id, serialize_session_state())
+                                    # Consume daily quota and auto-save session data in one update (if profile loaded)
+                                    if st.session_state.loaded_profile_id:
+                                        consume_daily_quota(
+                                            st.session_state.loaded_profile_id,
+                                            session_data=serialize_session_state()
+                                        )
                                 
-                            except Exception as e:
-                                st.error(f"❌ 解卦失败：{str(e)}")
+                                except Exception as e:
+                                    st.error(f"❌ 解卦失败：{str(e)}")
                 
-                # Reset button
-                if st.button("🔄 完成", key="finish_oracle", use_container_width=True):
-                    st.session_state.oracle_mode = False
-                    st.session_state.oracle_question = ""
-                    st.session_state.oracle_shake_count = 0
-                    st.session_state.oracle_hex_result = None
-                    st.rerun()
+                    # Reset button
+                    st.button("🔄 完成", key="finish_oracle", use_container_width=True, on_click=reset_oracle)
 
-    # Process pending topic
-    if hasattr(st.session_state, 'pending_topic') and st.session_state.pending_topic:
-        topic = st.session_state.pending_topic
-        custom_q = getattr(st.session_state, 'pending_custom_question', None)
+        # Process pending batch (all remaining fixed topics in one request)
+        if st.session_state.get("pending_batch_topics"):
+            batch_topics = st.session_state.pending_batch_topics
+            st.session_state.pending_batch_topics = None
+            api_config = st.session_state.api_config
+        
+            # Same default-API guards as the single-topic path
+            batch_error = None
+            if st.session_state.using_default_api:
+                if st.session_state.default_api_usage_count >= DEFAULT_API_DAILY_LIMIT:
+                    batch_error = f"默认 API 本次会话已达到 {DEFAULT_API_DAILY_LIMIT} 次使用限制。请在「AI 模型设置」中配置您自己的 API Key 后继续使用。"
+                elif not DEFAULT_API_KEY:
+                    batch_error = "服务器未配置默认 API Key。请在「AI 模型设置」中配置您自己的 API Key。"
+        
+            sections = {}
+            if batch_error is None:
+                conversation_history = get_conversation_history()
+                with st.spinner(f"正在一次性分析 {len(batch_topics)} 个主题..."):
+                    try:
+                        sections = get_batch_fortune_analysis(
+                            batch_topics,
+                            st.session_state.user_context,
+                            api_key=api_config['api_key'],
+                            base_url=api_config['base_url'],
+                            model=api_config['model'],
+                            is_first_response=st.session_state.is_first_response,
+                            conversation_history=conversation_history if not st.session_state.is_first_response else None
+                        )
+                    except Exception as e:
+                        batch_error = str(e)
         
-        # Clear pending
-        st.session_state.pending_topic = None
-        st.session_state.pending_custom_question = None
+            # Topics the model did not answer become clickable again
+            for topic in batch_topics:
+                if topic in sections:
+                    append_response(topic, f"📌 {topic}", sections[topic])
+                else:
+                    st.session_state.clicked_topics.discard(topic)
         
-        # Build conversation history from previous responses (for context continuity)
-        conversation_history = []
-        if st.session_state.responses:
-            for prev_topic_key, prev_topic_display, prev_response in st.session_state.responses:
-                # Extract topic name without emoji prefix
-                topic_name = prev_topic_display.replace("📌 ", "").replace("💬 ", "")
-                # Use full response for better context continuity
-                conversation_history.append((topic_name, prev_response))
+            if sections:
+                st.session_state.is_first_response = False
+                if st.session_state.using_default_api:
+                    st.session_state.default_api_usage_count += 1
+                if st.session_state.loaded_profile_id:
+                    save_session_in_background(st.session_state.loaded_profile_id)
+                st.session_state.scroll_to_topic = next(t for t in batch_topics if t in sections)
+            elif batch_error is None:
+                batch_error = "未收到模型回复。请检查 API Key、额度或网络连接后重试。"
+            st.session_state.batch_error = batch_error
+            st.session_state.is_generating = False
+            st.rerun()
+
+        # Process pending topic
+        if st.session_state.get('pending_topic'):
+            topic = st.session_state.pending_topic
+            custom_q = st.session_state.get('pending_custom_question')
         
-        # Stream response
-        response_text = ""
-        topic_key = topic if topic != "大师解惑" else f"custom_{st.session_state.custom_question_count}"
-        topic_display = f"💬 {custom_q}" if topic == "大师解惑" and custom_q else f"📌 {topic}"
+            # Clear pending
+            st.session_state.pending_topic = None
+            st.session_state.pending_custom_question = None
         
-        api_config = st.session_state.api_config
+            # Conversation history from previous responses (for context continuity)
+            conversation_history = get_conversation_history()
         
-        # Rate limiting check for default API key
-        if st.session_state.using_default_api:
-            if st.session_state.default_api_usage_count >= DEFAULT_API_DAILY_LIMIT:
-                st.error(f"⚠️ 默认 API 本次会话已达到 {DEFAULT_API_DAILY_LIMIT} 次使用限制。请在「AI 模型设置」中配置您自己的 API Key 后继续使用。")
-                st.session_state.is_generating = False
-                st.rerun()
-            # Check if default API key is configured
-            if not DEFAULT_API_KEY:
-                st.error("⚠️ 服务器未配置默认 API Key。请在「AI 模型设置」中配置您自己的 API Key。")
-                st.session_state.is_generating = False
-                st.rerun()
+            # Stream response
+            response_text = ""
+            topic_key = topic if topic != "大师解惑" else f"custom_{st.session_state.custom_question_count}"
+            topic_display = f"💬 {custom_q}" if topic == "大师解惑" and custom_q else f"📌 {topic}"
         
-        # ========== Special handling for Compatibility Mode topics ==========
-        COUPLE_TOPICS = ["缘分契合度", "婚姻前景", "避雷指南", "对方旺我吗"]
-        if topic in COUPLE_TOPICS and st.session_state.compatibility_mode:
-            # Build person_a data (甲方)
-            pattern_a = st.session_state.pattern_info
-            person_a = {
-                "gender": st.session_state.gender,
-                "year_pillar": pattern_a.get("year_pillar", "??"),
-                "month_pillar": pattern_a.get("month_pillar", "??"),
-                "day_pillar": pattern_a.get("day_pillar", "??"),
-                "hour_pillar": pattern_a.get("hour_pillar", "??"),
-                "pattern_name": pattern_a.get("pattern_name", "普通格局"),
-                "strength": pattern_a.get("strength_result", {}).get("strength", "未知"),
-                "joy_elements": ", ".join(pattern_a.get("strength_result", {}).get("joy_elements", [])) or "未知",
-                "nayin": pattern_a.get("auxiliary", {}).get("nayin", {})
-            }
+            api_config = st.session_state.api_config
+        
+            # Rate limiting check for default API key
+            if st.session_state.using_default_api:
+                if st.session_state.default_api_usage_count >= DEFAULT_API_DAILY_LIMIT:
+                    st.error(f"⚠️ 默认 API 本次会话已达到 {DEFAULT_API_DAILY_LIMIT} 次使用限制。请在「AI 模型设置」中配置您自己的 API Key 后继续使用。")
+                    st.session_state.is_generating = False
+                    st.rerun()
+                # Check if default API key is configured
+                if not DEFAULT_API_KEY:
+                    st.error("⚠️ 服务器未配置默认 API Key。请在「AI 模型设置」中配置您自己的 API Key。")
+                    st.session_state.is_generating = False
+                    st.rerun()
+        
+            # ========== Special handling for Compatibility Mode topics ==========
+            if topic in COUPLE_TOPIC_SET and st.session_state.compatibility_mode:
+                # Person data for 甲方 / 乙方
+                person_a = couple_person_data(st.session_state.gender, st.session_state.pattern_info)
+                person_b = couple_person_data(
+                    st.session_state.stored_partner_gender, st.session_state.partner_pattern_info
+                )
             
-            # Build person_b data (乙方)
-            pattern_b = st.session_state.partner_pattern_info
-            person_b = {
-                "gender": st.session_state.stored_partner_gender,
-                "year_pillar": pattern_b.get("year_pillar", "??"),
-                "month_pillar": pattern_b.get("month_pillar", "??"),
-                "day_pillar": pattern_b.get("day_pillar", "??"),
-                "hour_pillar": pattern_b.get("hour_pillar", "??"),
-                "pattern_name": pattern_b.get("pattern_name", "普通格局"),
-                "strength": pattern_b.get("strength_result", {}).get("strength", "未知"),
-                "joy_elements": ", ".join(pattern_b.get("strength_result", {}).get("joy_elements", [])) or "未知",
-                "nayin": pattern_b.get("auxiliary", {}).get("nayin", {})
-            }
+                # Get compatibility result
+                comp_data = st.session_state.compatibility_result
             
-            # Get compatibility result
-            comp_data = st.session_state.compatibility_result
+                # Get focus instruction (stored when button was clicked)
+                focus_instruction = st.session_state.get('pending_focus_instruction', "")
+                st.session_state.pending_focus_instruction = ""  # Clear after use
             
-            # Get focus instruction (stored when button was clicked)
-            focus_instruction = getattr(st.session_state, 'pending_focus_instruction', "")
-            st.session_state.pending_focus_instruction = ""  # Clear after use
+                # Retrieve stored relation type
+                relation_type = st.session_state.get('stored_relation_type', "恋人/伴侣")
             
-            # Retrieve stored relation type
-            relation_type = getattr(st.session_state, 'stored_relation_type', "恋人/伴侣")
+                # Build special couple prompt with focus instruction and relation type
+                couple_prompt = cached_couple_prompt(person_a, person_b, comp_data, relation_type, focus_instruction)
             
-            # Build special couple prompt with focus instruction and relation type
-            couple_prompt = build_couple_prompt(
-                person_a, 
-                person_b, 
-                comp_data, 
-                relation_type=relation_type, 
-                focus_instruction=focus_instruction
-            )
+                # Use couple prompt instead of generic user_context
+                with st.spinner("正在解析二人的红线羁绊..."):
+                    response_placeholder = st.empty()
+                    last_render_len = 0
+                    last_render_time = time.monotonic()
+                    render_min_chars = 120
+                    render_min_interval = 0.15
+                    render_updates = 0
+                    first_render_time = None
+                    start_time = time.monotonic()
+                    # Deltas are collected in a list and joined only when a (throttled) render is due
+                    response_parts = []
+                    received_chars = 0
+                    try:
+                        for chunk in prefetch_stream(get_fortune_analysis(
+                            topic,
+                            couple_prompt,  # Use couple prompt instead of user_context
+                            custom_question=None,
+                            api_key=api_config['api_key'],
+                            base_url=api_config['base_url'],
+                            model=api_config['model'],
+                            is_first_response=st.session_state.is_first_response,
+                            conversation_history=conversation_history if not st.session_state.is_first_response else None
+                        )):
+                            response_parts.append(chunk)
+                            received_chars += len(chunk)
+                            now = time.monotonic()
+                            if (
+                                received_chars - last_render_len >= render_min_chars
+                                or now - last_render_time >= render_min_interval
+                            ):
+                                response_text = "".join(response_parts)
+                                response_placeholder.markdown(response_text)
+                                render_updates += 1
+                                if first_render_time is None:
+                                    first_render_time = now
+                                last_render_len = received_chars
+                                last_render_time = now
+                        response_text = "".join(response_parts)
+                        # Final flush of the tail that arrived after the last throttled render
+                        if last_render_len != received_chars:
+                            response_placeholder.markdown(response_text)
+                            render_updates += 1
+                        
+                    except Exception as e:
+                        response_text = f"分析时出错: {str(e)}"
+                        response_placeholder.error(response_text)
+                    finally:
+                        # Force reset loading state even if error occurs
+                        st.session_state.is_generating = False
+                        if PERF_LOG:
+                            total_ms = int((time.monotonic() - start_time) * 1000)
+                            first_render_ms = (
+                                int((first_render_time - start_time) * 1000)
+                                if first_render_time else "NA"
+                            )
+                            print(
+                                f"[PERF] couple_ui total_ms={total_ms} first_render_ms={first_render_ms} "
+                                f"renders={render_updates} chars={len(response_text)}",
+                                flush=True
+                            )
+            
+                # Store response and update state
+                append_response(topic_key, topic_display, response_text)
+                st.session_state.is_first_response = False
+            
+                if st.session_state.using_default_api:
+                    st.session_state.default_api_usage_count += 1
             
-            # Use couple prompt instead of generic user_context
-            with st.spinner("正在解析二人的红线羁绊..."):
+                # Auto-save session data if profile is loaded
+                if st.session_state.loaded_profile_id:
+                    save_session_in_background(st.session_state.loaded_profile_id)
+                st.rerun()
+        
+            with st.spinner(f"正在分析 {topic}..."):
                 response_placeholder = st.empty()
                 last_render_len = 0
                 last_render_time = time.monotonic()
@@ -3171,365 +3069,233 @@ else:
                 render_updates = 0
                 first_render_time = None
                 start_time = time.monotonic()
+                # Deltas are collected in a list and joined only when a (throttled) render is due
+                response_parts = []
+                received_chars = 0
+                # Finished paragraphs are cleaned once; each render re-cleans only the open tail
+                display_cleaner = IncrementalMarkdownCleaner()
                 try:
-                    for chunk in get_fortune_analysis(
+                    for chunk in prefetch_stream(get_fortune_analysis(
                         topic,
-                        couple_prompt,  # Use couple prompt instead of user_context
-                        custom_question=None,
+                        st.session_state.user_context,
+                        custom_question=custom_q,
                         api_key=api_config['api_key'],
                         base_url=api_config['base_url'],
                         model=api_config['model'],
                         is_first_response=st.session_state.is_first_response,
                         conversation_history=conversation_history if not st.session_state.is_first_response else None
-                    ):
-                        response_text += chunk
+                    )):
+                        response_parts.append(chunk)
+                        received_chars += len(chunk)
+                        display_cleaner.feed(chunk)
+                    
+                        # Check the head of the reply for a quota error (stops after QUOTA_SCAN_CHARS)
+                        if received_chars - len(chunk) < QUOTA_SCAN_CHARS and has_quota_error(
+                            "".join(response_parts)[:QUOTA_SCAN_CHARS]
+                        ):
+                            response_parts = ["⚠️ 默认 API 已达到使用限额。请在输入页面的「AI 模型设置」中配置您自己的 API Key 后重试。"]
+                            break
+                    
                         now = time.monotonic()
                         if (
-                            len(response_text) - last_render_len >= render_min_chars
+                            received_chars - last_render_len >= render_min_chars
                             or now - last_render_time >= render_min_interval
                         ):
-                            response_placeholder.markdown(response_text)
+                            # For first response, show full text; for subsequent, we'll strip intro later
+                            display_text = display_cleaner.render()
+                            response_placeholder.markdown(
+                                f'<div class="topic-header">{topic_display}</div><div class="fortune-text">{display_text}</div>',
+                                unsafe_allow_html=True
+                            )
                             render_updates += 1
                             if first_render_time is None:
                                 first_render_time = now
-                            last_render_len = len(response_text)
+                            last_render_len = received_chars
                             last_render_time = now
-                        
+                    response_text = "".join(response_parts)
                 except Exception as e:
-                    response_text = f"分析时出错: {str(e)}"
-                    response_placeholder.error(response_text)
+                    error_str = str(e).lower()
+                    if has_quota_error(error_str):
+                        response_text = "⚠️ 默认 API 已达到使用限额。请在输入页面的「AI 模型设置」中配置您自己的 API Key 后重试。"
+                    else:
+                        response_text = f"⚠️ 调用 LLM 时出错: {str(e)}"
+                    response_placeholder.markdown(
+                        f'<div class="topic-header">{topic_display}</div><div class="fortune-text">{clean_markdown_for_display(response_text)}</div>',
+                        unsafe_allow_html=True
+                    )
                 finally:
-                    # Force reset loading state even if error occurs
+                    # Force reset loading state
                     st.session_state.is_generating = False
-                    if PERF_LOG:
-                        total_ms = int((time.monotonic() - start_time) * 1000)
-                        first_render_ms = (
-                            int((first_render_time - start_time) * 1000)
-                            if first_render_time else "NA"
-                        )
-                        print(
-                            f"[PERF] couple_ui total_ms={total_ms} first_render_ms={first_render_ms} "
-                            f"renders={render_updates} chars={len(response_text)}",
-                            flush=True
-                        )
-            
-            # Store response and update state
-            st.session_state.responses.append((topic_key, topic_display, response_text))
-            st.session_state.is_first_response = False
-            
-            if st.session_state.using_default_api:
-                st.session_state.default_api_usage_count += 1
-            
-            # Auto-save session data if profile is loaded
-            if st.session_state.loaded_profile_id:
-                update_session_data(st.session_state.loaded_profile_id, serialize_session_state())
-            st.rerun()
+
+            if not response_text.strip():
+                response_text = "⚠️ 未收到模型回复。请检查 API Key、额度或网络连接后重试。"
         
-        with st.spinner(f"正在分析 {topic}..."):
-            response_placeholder = st.empty()
-            last_render_len = 0
-            last_render_time = time.monotonic()
-            render_min_chars = 120
-            render_min_interval = 0.15
-            render_updates = 0
-            first_render_time = None
-            start_time = time.monotonic()
-            try:
-                for chunk in get_fortune_analysis(
-                    topic,
-                    st.session_state.user_context,
-                    custom_question=custom_q,
-                    api_key=api_config['api_key'],
-                    base_url=api_config['base_url'],
-                    model=api_config['model'],
-                    is_first_response=st.session_state.is_first_response,
-                    conversation_history=conversation_history if not st.session_state.is_first_response else None
-                ):
-                    response_text += chunk
-                    
-                    # Check for quota error
-                    if "quota" in response_text.lower() or "limit" in response_text.lower() or "429" in response_text:
-                        response_text = "⚠️ 默认 API 已达到使用限额。请在输入页面的「AI 模型设置」中配置您自己的 API Key 后重试。"
-                        break
-                    
-                    now = time.monotonic()
-                    if (
-                        len(response_text) - last_render_len >= render_min_chars
-                        or now - last_render_time >= render_min_interval
-                    ):
-                        # For first response, show full text; for subsequent, we'll strip intro later
-                        display_text = clean_markdown_for_display(response_text)
-                        response_placeholder.markdown(
-                            f'<div class="topic-header">{topic_display}</div><div class="fortune-text">{display_text}</div>',
-                            unsafe_allow_html=True
-                        )
-                        render_updates += 1
-                        if first_render_time is None:
-                            first_render_time = now
-                        last_render_len = len(response_text)
-                        last_render_time = now
-            except Exception as e:
-                error_str = str(e).lower()
-                if "quota" in error_str or "limit" in error_str or "429" in error_str:
-                    response_text = "⚠️ 默认 API 已达到使用限额。请在输入页面的「AI 模型设置」中配置您自己的 API Key 后重试。"
-                else:
-                    response_text = f"⚠️ 调用 LLM 时出错: {str(e)}"
+            if last_render_len != len(response_text):
+                display_text = clean_markdown_for_display(response_text)
                 response_placeholder.markdown(
-                    f'<div class="topic-header">{topic_display}</div><div class="fortune-text">{clean_markdown_for_display(response_text)}</div>',
+                    f'<div class="topic-header">{topic_display}</div><div class="fortune-text">{display_text}</div>',
                     unsafe_allow_html=True
                 )
-            finally:
-                # Force reset loading state
-                st.session_state.is_generating = False
-
-        if not response_text.strip():
-            response_text = "⚠️ 未收到模型回复。请检查 API Key、额度或网络连接后重试。"
-        
-        if last_render_len != len(response_text):
-            display_text = clean_markdown_for_display(response_text)
-            response_placeholder.markdown(
-                f'<div class="topic-header">{topic_display}</div><div class="fortune-text">{display_text}</div>',
-                unsafe_allow_html=True
-            )
-            render_updates += 1
-            if first_render_time is None:
-                first_render_time = time.monotonic()
-        
-        if PERF_LOG:
-            total_ms = int((time.monotonic() - start_time) * 1000)
-            first_render_ms = (
-                int((first_render_time - start_time) * 1000)
-                if first_render_time else "NA"
-            )
-            print(
-                f"[PERF] analysis_ui total_ms={total_ms} first_render_ms={first_render_ms} "
-                f"renders={render_updates} chars={len(response_text)} topic={topic}",
-                flush=True
-            )
+                render_updates += 1
+                if first_render_time is None:
+                    first_render_time = time.monotonic()
+        
+            if PERF_LOG:
+                total_ms = int((time.monotonic() - start_time) * 1000)
+                first_render_ms = (
+                    int((first_render_time - start_time) * 1000)
+                    if first_render_time else "NA"
+                )
+                print(
+                    f"[PERF] analysis_ui total_ms={total_ms} first_render_ms={first_render_ms} "
+                    f"renders={render_updates} chars={len(response_text)} topic={topic}",
+                    flush=True
+                )
         
-        # Store response and update flags
-        st.session_state.responses.append((topic_key, topic_display, response_text))
-        st.session_state.is_first_response = False
+            # Store response and update flags
+            append_response(topic_key, topic_display, response_text)
+            st.session_state.is_first_response = False
         
-        # Increment usage counter if using default API
-        if st.session_state.using_default_api:
-            st.session_state.default_api_usage_count += 1
-        # Auto-save session data if profile is loaded
-        if st.session_state.loaded_profile_id:
-            update_session_data(st.session_state.loaded_profile_id, serialize_session_state())
-        # Scroll to the newly added response
-        st.session_state.scroll_to_topic = topic_key
-        st.rerun()
+            # Increment usage counter if using default API
+            if st.session_state.using_default_api:
+                st.session_state.default_api_usage_count += 1
+            # Auto-save session data if profile is loaded
+            if st.session_state.loaded_profile_id:
+                save_session_in_background(st.session_state.loaded_profile_id)
+            # Scroll to the newly added response
+            st.session_state.scroll_to_topic = topic_key
+            st.rerun()
     
-    # Display all previous responses
-    if st.session_state.responses:
-        st.markdown("---")
-        st.markdown("### 📜 分析记录")
-        
-        # Get scroll target before clearing it
-        scroll_target = st.session_state.scroll_to_topic
-        scroll_anchor_id = None
-        
-        for topic_key, topic_display, response in st.session_state.responses:
-            # Create anchor for scrolling - use topic_key directly
-            anchor_id = f"response_{topic_key}".replace(" ", "_")
-            
-            # Check if this is the scroll target
-            is_scroll_target = scroll_target and topic_key == scroll_target
-            
-            if is_scroll_target:
-                scroll_anchor_id = anchor_id
-                cleaned_response = clean_markdown_for_display(response)
-                st.markdown(
-                    f'<div id="{anchor_id}" class="topic-header" style="background: rgba(255, 215, 0, 0.2); padding: 10px; border-radius: 8px; scroll-margin-top: 100px;">{topic_display} 👈</div><div class="fortune-text">{cleaned_response}</div>',
-                    unsafe_allow_html=True
-                )
-            else:
-                cleaned_response = clean_markdown_for_display(response)
-                st.markdown(
-                    f'<div id="{anchor_id}" class="topic-header">{topic_display}</div><div class="fortune-text">{cleaned_response}</div>',
-                    unsafe_allow_html=True
-                )
+        # Display all previous responses
+        if st.session_state.responses:
+            st.markdown("---")
+            st.markdown("### 📜 分析记录")
+            if st.session_state.get("responses_trimmed"):
+                st.caption(f"已保留最近 {len(st.session_state.responses)} 条")
         
-        # Use components.html to execute JavaScript for scrolling
-        if scroll_anchor_id:
-            # Add timestamp to make each script unique and force execution
-            scroll_ts = getattr(st.session_state, 'scroll_timestamp', 0)
-            components.html(f'''
-                <script>
-                    // Timestamp: {scroll_ts} - ensures fresh execution on repeated clicks
-                    (function() {{
-                        const targetElement = window.parent.document.getElementById("{scroll_anchor_id}");
-                        if (targetElement) {{
-                            // Small delay to ensure DOM is ready
-                            setTimeout(function() {{
-                                targetElement.scrollIntoView({{behavior: "smooth", block: "start"}});
-                            }}, 100);
-                        }}
-                    }})();
-                </script>
-            ''', height=0)
-            # Clear scroll target after rendering
-            st.session_state.scroll_to_topic = None
-            st.session_state.scroll_timestamp = None
+            render_response_history()
         
-        # ========== PDF Download & Save Profile (Aligned) ==========
-        st.markdown("---")
-        st.markdown("### 📥 保存报告")
+            # ========== PDF Download & Save Profile (Aligned) ==========
+            st.markdown("---")
+            st.markdown("### 📥 保存报告")
         
-        # Generate PDF and create download link
-        try:
-            pdf_bytes = generate_report_pdf(
-                bazi_result=st.session_state.bazi_result,
-                time_info=st.session_state.time_info,
-                gender=getattr(st.session_state, 'gender', '未知'),
-                birthplace=getattr(st.session_state, 'birthplace', '未指定'),
-                responses=st.session_state.responses,
-                birth_datetime=getattr(st.session_state, 'birth_datetime', None),
-            )
-            
-            pdf_filename = f"fortune_report_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
-            import base64
-            b64_pdf = base64.b64encode(pdf_bytes).decode()
-            pdf_download_html = f'''
-            <a href="data:application/pdf;base64,{b64_pdf}"
-               download="{pdf_filename}"
-               style="
-                   display: inline-flex;
-                   align-items: center;
-                   justify-content: center;
-                   padding: 10px 20px;
-                   background: linear-gradient(145deg, #4A90D9, #357ABD);
-                   color: white;
-                   text-decoration: none;
-                   border-radius: 8px;
-                   font-size: 16px;
-                   font-weight: 500;
-                   box-shadow: 0 4px 15px rgba(74, 144, 217, 0.3);
-                   transition: all 0.3s ease;
-                   width: 100%;
-                   border: none;
-               ">
-                📄 下载 PDF 报告
-            </a>
-            '''
+            # Generate PDF and create download link
+            try:
+                # PDF -> base64 -> link HTML is memoized on the report contents (only a new response rebuilds it)
+                pdf_download_html = cached_report_download_html(
+                    st.session_state.bazi_result,
+                    st.session_state.time_info,
+                    st.session_state.get('gender', '未知'),
+                    st.session_state.get('birthplace', '未指定'),
+                    tuple(st.session_state.responses),
+                    st.session_state.get('birth_datetime'),
+                )
             
-            # Layout buttons side-by-side using Streamlit columns
-            col_save, col_download, col_images = st.columns([1, 1, 1], vertical_alignment="bottom")
+                # Layout buttons side-by-side using Streamlit columns
+                col_save, col_download, col_images = st.columns([1, 1, 1], vertical_alignment="bottom")
             
-            with col_save:
-                # Button to trigger save dialog
-                if st.button("💾 保存档案", key="btn_save_result_bottom", use_container_width=True):
-                    # Capture current form values if they exist, or use defaults from data
-                    st.session_state["_save_gender"] = st.session_state.get("gender", "男")
+                with col_save:
+                    # Button to trigger save dialog
+                    if st.button("💾 保存档案", key="btn_save_result_bottom", use_container_width=True):
+                        # Capture current form values if they exist, or use defaults from data
+                        st.session_state["_save_gender"] = st.session_state.get("gender", "男")
                     
-                    # Try to parse year/month/day from birth_datetime string
-                    b_dt = st.session_state.get("birth_datetime", "")
-                    try:
-                        match = re.search(r'(\d+)年(\d+)月(\d+)日', b_dt)
+                        # Parse year/month/day from the birth_datetime string (None after some restores)
+                        match = BIRTH_DATE_RE.search(st.session_state.get("birth_datetime") or "")
                         if match:
                             st.session_state["_save_year"] = int(match.group(1))
                             st.session_state["_save_month"] = int(match.group(2))
                             st.session_state["_save_day"] = int(match.group(3))
-                    except:
-                        pass
                         
-                    st.session_state["_save_hour"] = st.session_state.get("time_info", "").split()[0] if st.session_state.get("time_info") else "12:00"
-                    st.session_state["_save_city"] = st.session_state.get("birthplace", None)
-                    st.session_state["_save_is_lunar"] = st.session_state.get("calendar_mode") == "lunar"
+                        time_info = st.session_state.get("time_info")
+                        st.session_state["_save_hour"] = time_info.split(maxsplit=1)[0] if time_info else "12:00"
+                        st.session_state["_save_city"] = st.session_state.get("birthplace", None)
+                        st.session_state["_save_is_lunar"] = st.session_state.get("calendar_mode") == "lunar"
                     
-                    save_profile_dialog()
+                        save_profile_dialog()
             
-            with col_download:
-                st.markdown(pdf_download_html, unsafe_allow_html=True)
-
-            with col_images:
-                if st.button("🖼️ 生成图片集", key="btn_generate_images", use_container_width=True):
-                    try:
-                        image_files = generate_grouped_report_images(
-                            bazi_result=st.session_state.bazi_result,
-                            time_info=st.session_state.time_info,
-                            gender=getattr(st.session_state, 'gender', '未知'),
-                            birthplace=getattr(st.session_state, 'birthplace', '未指定'),
-                            responses=st.session_state.responses,
-                            birth_datetime=getattr(st.session_state, 'birth_datetime', None),
-                            pattern_info=getattr(st.session_state, 'pattern_info', None),
-                            fortune_cycles=getattr(st.session_state, 'fortune_cycles', None),
-                        )
-                        zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                            for filename, data in image_files:
-                                zip_file.writestr(filename, data)
-                        st.session_state.image_zip = zip_buffer.getvalue()
-                    except Exception as e:
-                        st.error(f"生成图片集失败: {str(e)}")
-
-                if st.session_state.image_zip:
-                    img_zip_name = f"fortune_report_images_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
-                    b64_zip = base64.b64encode(st.session_state.image_zip).decode()
-                    img_download_html = f'''
-                    <a href="data:application/zip;base64,{b64_zip}"
-                       download="{img_zip_name}"
-                       style="
-                           display: inline-flex;
-                           align-items: center;
-                           justify-content: center;
-                           padding: 10px 20px;
-                           background: linear-gradient(145deg, #4A90D9, #357ABD);
-                           color: white;
-                           text-decoration: none;
-                           border-radius: 8px;
-                           font-size: 16px;
-                           font-weight: 500;
-                           box-shadow: 0 4px 15px rgba(74, 144, 217, 0.3);
-                           transition: all 0.3s ease;
-                           width: 100%;
-                           border: none;
-                       ">
-                        ⬇️ 下载图片集
-                    </a>
-                    '''
-                    st.markdown(img_download_html, unsafe_allow_html=True)
+                with col_download:
+                    st.markdown(pdf_download_html, unsafe_allow_html=True)
+
+                with col_images:
+                    if st.button("🖼️ 生成图片集", key="btn_generate_images", use_container_width=True):
+                        try:
+                            from pdf_generator import generate_grouped_report_images
+                            image_files = generate_grouped_report_images(
+                                bazi_result=st.session_state.bazi_result,
+                                time_info=st.session_state.time_info,
+                                gender=st.session_state.get('gender', '未知'),
+                                birthplace=st.session_state.get('birthplace', '未指定'),
+                                responses=st.session_state.responses,
+                                birth_datetime=st.session_state.get('birth_datetime'),
+                                pattern_info=st.session_state.get('pattern_info'),
+                                fortune_cycles=st.session_state.get('fortune_cycles'),
+                            )
+                            zip_buffer = io.BytesIO()
+                            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                                for filename, data in image_files:
+                                    zip_file.writestr(filename, data)
+                            # Encode the zip into its download link once, when it is generated
+                            img_zip_name = f"fortune_report_images_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
+                            st.session_state.image_zip_link_html = download_link_html(
+                                "application/zip", zip_buffer.getvalue(), img_zip_name, "⬇️ 下载图片集"
+                            )
+                        except Exception as e:
+                            st.error(f"生成图片集失败: {str(e)}")
+
+                    if st.session_state.image_zip_link_html:
+                        st.markdown(st.session_state.image_zip_link_html, unsafe_allow_html=True)
             
-        except Exception as e:
-            st.error(f"生成 PDF 时出错: {str(e)}")
+            except Exception as e:
+                st.error(f"生成 PDF 时出错: {str(e)}")
+
+    render_results_panel()
+
 
-# Save data to localStorage whenever we have responses
+# Save data to localStorage whenever the saved fields change
 if st.session_state.bazi_calculated and st.session_state.responses:
-    # Prepare data to save
-    save_data = {
-        "bazi_calculated": st.session_state.bazi_calculated,
-        "bazi_result": st.session_state.bazi_result,
-        "time_info": st.session_state.time_info,
-        "user_context": st.session_state.user_context,
-        "clicked_topics": list(st.session_state.clicked_topics),
-        "responses": [list(r) for r in st.session_state.responses],
-        "birthplace": getattr(st.session_state, 'birthplace', '未指定'),
-        "gender": getattr(st.session_state, 'gender', '男'),
-        "is_first_response": st.session_state.is_first_response,
-        "custom_question_count": st.session_state.custom_question_count
-    }
-    json_data = json.dumps(save_data, ensure_ascii=False)
-    # Escape for JavaScript
-    escaped_json = json_data.replace('\\', '\\\\').replace("'", "\\'").replace('\n', '\\n')
-    
-    components.html(f'''
-        <script>
-            localStorage.setItem('fortune_teller_data', '{escaped_json}');
-        </script>
-    ''', height=0)
+    # Cheap change check before serializing: the strings in session state keep their cached hashes
+    save_key = hash((
+        st.session_state.bazi_result,
+        st.session_state.time_info,
+        st.session_state.user_context,
+        frozenset(st.session_state.clicked_topics),
+        tuple(st.session_state.responses),
+        st.session_state.get('birthplace', '未指定'),
+        st.session_state.get('gender', '男'),
+        st.session_state.is_first_response,
+        st.session_state.custom_question_count,
+    ))
+    if save_key != st.session_state.get("_local_storage_hash"):
+        save_data = {
+            "bazi_calculated": st.session_state.bazi_calculated,
+            "bazi_result": st.session_state.bazi_result,
+            "time_info": st.session_state.time_info,
+            "user_context": st.session_state.user_context,
+            "clicked_topics": list(st.session_state.clicked_topics),
+            "responses": [list(r) for r in st.session_state.responses],
+            "birthplace": st.session_state.get('birthplace', '未指定'),
+            "gender": st.session_state.get('gender', '男'),
+            "is_first_response": st.session_state.is_first_response,
+            "custom_question_count": st.session_state.custom_question_count
+        }
+        # Compressed base64url payload: ~10x smaller than URL-encoded JSON and URL-safe as-is
+        packed_data = pack_snapshot(save_data)
+        # Write at idle time so the storage call never delays paint
+        components.html(f'''
+            <script>
+                // timeout: the iframe only exists on this run, so the write must not wait indefinitely
+                (window.requestIdleCallback || function (cb) {{ setTimeout(cb, 1); }})(function () {{
+                    localStorage.setItem('fortune_teller_data', '{packed_data}');
+                }}, {{timeout: 1000}});
+            </script>
+        ''', height=0)
+        st.session_state._local_storage_hash = save_key
 
-# On initial page load (no bazi calculated and not loaded from storage), check localStorage
-if not st.session_state.bazi_calculated and not st.session_state.data_loaded_from_storage:
-    components.html('''
-        <script>
-            const savedData = localStorage.getItem('fortune_teller_data');
-            if (savedData) {
-                // Redirect with data as query parameter
-                const encodedData = encodeURIComponent(savedData);
-                const currentUrl = window.parent.location.href.split('?')[0];
-                window.parent.location.href = currentUrl + '?fortune_data=' + encodedData;
-            }
-        </script>
-    ''', height=0)
-    st.session_state.data_loaded_from_storage = True
+
+if FT_PROFILE:
+    _script_profiler.disable()
+    st.session_state._script_profiler = None
+    _profile_report = io.StringIO()
+    pstats.Stats(_script_profiler, stream=_profile_report).sort_stats("tottime").print_stats(25)
+    print(f"[FT_PROFILE] script run\n{_profile_report.getvalue()}")
@@ -1,30 +1,61 @@
 """
 八字工具类 - 合盘分析等
 """
+from functools import lru_cache
+
 import svgwrite
 
+# Optional: numpy for batch (N×M) compatibility scoring; falls back to pure Python
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+HEAVENLY_STEMS = "甲乙丙丁戊己庚辛壬癸"
+EARTHLY_BRANCHES = "子丑寅卯辰巳午未申酉戌亥"
+STEM_ID = {stem: i for i, stem in enumerate(HEAVENLY_STEMS)}
+BRANCH_ID = {branch: i for i, branch in enumerate(EARTHLY_BRANCHES)}
+
+# 天干五合
+STEM_COMBOS = (("甲", "己"), ("乙", "庚"), ("丙", "辛"), ("丁", "壬"), ("戊", "癸"))
+# 地支六合
+BRANCH_COMBOS = (("子", "丑"), ("寅", "亥"), ("卯", "戌"), ("辰", "酉"), ("巳", "申"), ("午", "未"))
+# 地支六冲
+BRANCH_CLASHES = (("子", "午"), ("丑", "未"), ("寅", "申"), ("卯", "酉"), ("辰", "戌"), ("巳", "亥"))
+
+
+def _pair_mask(pairs, ids):
+    """把无序对列表编码成位掩码：第 (a<<4)|b 位表示 (a, b) 成立（双向）"""
+    mask = 0
+    for a, b in pairs:
+        ia, ib = ids[a], ids[b]
+        mask |= (1 << ((ia << 4) | ib)) | (1 << ((ib << 4) | ia))
+    return mask
+
+
+def _pair_bit(ids, a, b):
+    """(a, b) 在掩码中的位号；未知字符返回 None"""
+    ia = ids.get(a)
+    ib = ids.get(b)
+    if ia is None or ib is None:
+        return None
+    return (ia << 4) | ib
+
+
+# 导入时构建一次
+STEM_COMBO_MASK = _pair_mask(STEM_COMBOS, STEM_ID)
+BRANCH_COMBO_MASK = _pair_mask(BRANCH_COMBOS, BRANCH_ID)
+BRANCH_CLASH_MASK = _pair_mask(BRANCH_CLASHES, BRANCH_ID)
+
 
 class BaziCompatibilityCalculator:
     """
     八字合盘计算器 - 分析两人之间的"化学反应"
+    无状态：查表数据均为模块常量，可直接使用模块级 analyze_compatibility()
     """
-    
-    def __init__(self):
-        # 天干五合
-        self.stem_combos = {
-            frozenset(["甲", "己"]), frozenset(["乙", "庚"]), frozenset(["丙", "辛"]),
-            frozenset(["丁", "壬"]), frozenset(["戊", "癸"])
-        }
-        # 地支六合
-        self.branch_combos = {
-            frozenset(["子", "丑"]), frozenset(["寅", "亥"]), frozenset(["卯", "戌"]),
-            frozenset(["辰", "酉"]), frozenset(["巳", "申"]), frozenset(["午", "未"])
-        }
-        # 地支六冲
-        self.branch_clashes = {
-            frozenset(["子", "午"]), frozenset(["丑", "未"]), frozenset(["寅", "申"]),
-            frozenset(["卯", "酉"]), frozenset(["辰", "戌"]), frozenset(["巳", "亥"])
-        }
 
     def analyze_compatibility(self, person_a, person_b):
         """
@@ -41,19 +72,22 @@ class BaziCompatibilityCalculator:
         # 日干关系
         dm_a = person_a['day_pillar'][0]
         dm_b = person_b['day_pillar'][0]
-        if frozenset([dm_a, dm_b]) in self.stem_combos:
+        stem_bit = _pair_bit(STEM_ID, dm_a, dm_b)
+        if stem_bit is not None and (STEM_COMBO_MASK >> stem_bit) & 1:
             report.append(f"❤️ **日干相合 ({dm_a}-{dm_b})**：灵魂吸引力极强，性格互补。")
             score_bonus += 30
             
         # 日支关系
         db_a = person_a['day_pillar'][1]
         db_b = person_b['day_pillar'][1]
-        if frozenset([db_a, db_b]) in self.branch_combos:
-            report.append(f"🤝 **日支六合 ({db_a}-{db_b})**：相处舒服，生活步调一致。")
-            score_bonus += 20
-        elif frozenset([db_a, db_b]) in self.branch_clashes:
-            report.append(f"⚡ **日支相冲 ({db_a}-{db_b})**：容易有价值观冲突，需磨合。")
-            score_bonus -= 10
+        branch_bit = _pair_bit(BRANCH_ID, db_a, db_b)
+        if branch_bit is not None:
+            if (BRANCH_COMBO_MASK >> branch_bit) & 1:
+                report.append(f"🤝 **日支六合 ({db_a}-{db_b})**：相处舒服，生活步调一致。")
+                score_bonus += 20
+            elif (BRANCH_CLASH_MASK >> branch_bit) & 1:
+                report.append(f"⚡ **日支相冲 ({db_a}-{db_b})**：容易有价值观冲突，需磨合。")
+                score_bonus -= 10
 
         # 2. 五行互补 (简单的数量互补逻辑)
         # 假设 person_a 缺火，而 person_b 火多，这就是互补
@@ -71,62 +105,101 @@ class BaziCompatibilityCalculator:
         }
 
 
-def build_couple_prompt(person_a, person_b, comp_data, relation_type="恋人/伴侣", focus_instruction=""):
+_DEFAULT_CALC = BaziCompatibilityCalculator()
+analyze_compatibility = _DEFAULT_CALC.analyze_compatibility
+
+
+def _pair_score_table(scored_pairs, ids, size):
     """
-    构建双人合盘的最终 Prompt
-    
-    :param person_a: 甲方数据 (包含四柱、格局、强弱、喜用神)
-    :param person_b: 乙方数据 (包含四柱、格局、强弱、喜用神)
-    :param comp_data: Python算出的合盘硬指标 (包含 'details' 列表, 'base_score' 等)
-    :param relation_type: 关系类型 (恋人/伴侣, 事业合伙人, 知己好友, 尚未确定)
-    :param focus_instruction: 用户的核心诉求，如有则重点回答
+    把各规则的加减分合并成一张 (size+1)×(size+1) int16 分数表；
+    最后一行/列留给未知字符（恒为 0）
     """
-    
-    # 1. 检测性别组合
-    is_same_sex = (person_a.get('gender', '未知') == person_b.get('gender', '未知'))
-    
-    # 2. 定制化 Role 指令
-    role_instruction = ""
-    
-    if is_same_sex and relation_type == "恋人/伴侣":
-        # 同性恋人：去性别化，强调角色互动
-        role_instruction = """
-    **⚠️ 特殊指令（同性伴侣分析）**：
-    1.  **严禁使用**"丈夫"、"妻子"、"克妻"、"旺夫"等传统异性恋术语。
-    2.  请使用"甲方/乙方"、"伴侣"、"对方"或"另一半"来称呼。
-    3.  分析重点在于**阴阳能量的互补**（如一方阳刚一方阴柔，或双方都很强势），而非生理性别。
-        """
-    elif relation_type == "事业合伙人":
-        # 事业伙伴：完全不谈感情，只谈钱和协作
-        role_instruction = """
-    **⚠️ 特殊指令（事业合伙分析）**：
-    1.  这是商业合伙关系，**严禁提及**婚恋、桃花、夫妻宫等情感术语。
-    2.  请将"日支合"解读为"协作默契"，将"日支冲"解读为"经营理念冲突"。
-    3.  重点分析：两人合财吗？能否互补短板？谁适合主导（CEO），谁适合执行（COO）？
-        """
-    elif relation_type == "知己好友":
-        # 朋友：谈性格共鸣
-        role_instruction = """
-    **⚠️ 特殊指令（友情分析）**：
-    1.  这是纯友谊关系。请分析两人是否是"灵魂知己"或"酒肉朋友"。
-    2.  重点看性格是否投缘，能否互相提供情绪价值。
-        """
-    elif relation_type == "尚未确定":
-        # 尚未确定关系：全面分析各种可能性
-        role_instruction = """
-    **⚠️ 特殊指令（关系探索分析）**：
-    1.  两人关系尚未明确，请从多角度分析他们的契合度。
-    2.  请分别评估：作为恋人、作为事业伙伴、作为朋友的匹配程度。
-    3.  给出建议：根据两人八字特点，哪种关系更适合他们？
-        """
-    else:
-        # 默认异性恋人
-        role_instruction = "这是传统的异性伴侣分析，请按常规命理逻辑进行。"
-    
-    # 将 Python 算出的列表转换为 Markdown 文本
-    hard_evidence = "\n".join([f"- {item}" for item in comp_data['details']])
-    
-    prompt = f"""
+    table = np.zeros((size + 1, size + 1), dtype=np.int16)
+    for pairs, points in scored_pairs:
+        for a, b in pairs:
+            table[ids[a], ids[b]] = table[ids[b], ids[a]] = points
+    return table
+
+
+if NUMPY_AVAILABLE:
+    # 日干：五合 +30；日支：六合 +20 / 六冲 -10（两者互斥，与逐对计算的 if/elif 等价）
+    STEM_SCORE_TABLE = _pair_score_table([(STEM_COMBOS, 30)], STEM_ID, len(HEAVENLY_STEMS))
+    BRANCH_SCORE_TABLE = _pair_score_table(
+        [(BRANCH_COMBOS, 20), (BRANCH_CLASHES, -10)], BRANCH_ID, len(EARTHLY_BRANCHES)
+    )
+
+# 配对数达到该值才走 numba 并行内核（小批量时线程调度开销不划算）
+NUMBA_MIN_PAIRS = 10_000
+
+
+@lru_cache(maxsize=None)
+def _numba_score_kernel():
+    """
+    首次遇到大批量时才导入 numba 并定义并行内核 (避免每次冷启动都加载 numba/llvmlite)
+    numba 不可用时返回 None
+    """
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    @njit(parallel=True, cache=True)
+    def score_kernel(sa, ba, sb, bb, stem_table, branch_table):
+        """单遍融合计算 N×M 分数，不产生中间数组；外层 prange 多线程、无 GIL"""
+        out = np.empty((sa.shape[0], sb.shape[0]), dtype=np.int16)
+        for i in prange(sa.shape[0]):
+            stem_row = stem_table[sa[i]]
+            branch_row = branch_table[ba[i]]
+            for j in range(sb.shape[0]):
+                out[i, j] = 60 + stem_row[sb[j]] + branch_row[bb[j]]
+        return out
+
+    return score_kernel
+
+
+def analyze_compatibility_batch(stems_a, branches_a, stems_b, branches_b):
+    """
+    批量合盘打分：甲方 N 人 × 乙方 M 人的日柱两两配对
+
+    :param stems_a: 甲方日干序列 (长度 N)
+    :param branches_a: 甲方日支序列 (长度 N)
+    :param stems_b: 乙方日干序列 (长度 M)
+    :param branches_b: 乙方日支序列 (长度 M)
+    :return: N×M 分数矩阵 (numpy 可用时为 ndarray，否则为嵌套 list)，
+             与 analyze_compatibility(...)["base_score"] 一致；
+             需要文字详情时再对选中的配对调用 analyze_compatibility
+    """
+    if not NUMPY_AVAILABLE:
+        return [
+            [
+                _DEFAULT_CALC.analyze_compatibility(
+                    {"day_pillar": (sa, ba)}, {"day_pillar": (sb, bb)}
+                )["base_score"]
+                for sb, bb in zip(stems_b, branches_b)
+            ]
+            for sa, ba in zip(stems_a, branches_a)
+        ]
+
+    unknown_stem = len(HEAVENLY_STEMS)
+    unknown_branch = len(EARTHLY_BRANCHES)
+    sa = np.asarray([STEM_ID.get(x, unknown_stem) for x in stems_a], dtype=np.int8)
+    sb = np.asarray([STEM_ID.get(x, unknown_stem) for x in stems_b], dtype=np.int8)
+    ba = np.asarray([BRANCH_ID.get(x, unknown_branch) for x in branches_a], dtype=np.int8)
+    bb = np.asarray([BRANCH_ID.get(x, unknown_branch) for x in branches_b], dtype=np.int8)
+
+    if len(sa) * len(sb) >= NUMBA_MIN_PAIRS:
+        score_kernel = _numba_score_kernel()
+        if score_kernel is not None:
+            return score_kernel(sa, ba, sb, bb, STEM_SCORE_TABLE, BRANCH_SCORE_TABLE)
+
+    scores = STEM_SCORE_TABLE[sa[:, None], sb[None, :]]
+    scores += BRANCH_SCORE_TABLE[ba[:, None], bb[None, :]]
+    scores += 60
+    return scores
+
+
+# 双人合盘 Prompt 模板 (导入时解析一次，调用时 format_map 填充)
+COUPLE_PROMPT_TEMPLATE = """
     # Role & Persona
     你是一位精通《三命通会》与现代心理学的**资深情感命理师**。
     你现在的任务是为两位用户进行【双人合盘深度分析】。
@@ -135,25 +208,25 @@ def build_couple_prompt(person_a, person_b, comp_data, relation_type="恋人/伴
     ### 📂 档案资料 (System Verified Data)
     
     **【甲方 (User A)】**
-    - **性别**：{person_a.get('gender', '未知')}
-    - **八字**：{person_a['year_pillar']}  {person_a['month_pillar']}  {person_a['day_pillar']}  {person_a['hour_pillar']}
-    - **核心格局**：{person_a.get('pattern_name', '普通格局')}
-    - **五行能量**：{person_a.get('strength', '未知')} (喜：{person_a.get('joy_elements', '未知')})
-    - **纳音意象**：年-{person_a.get('nayin', {}).get('year', '未知')}, 日-{person_a.get('nayin', {}).get('day', '未知')}
+    - **性别**：{gender_a}
+    - **八字**：{year_pillar_a}  {month_pillar_a}  {day_pillar_a}  {hour_pillar_a}
+    - **核心格局**：{pattern_a}
+    - **五行能量**：{strength_a} (喜：{joy_a})
+    - **纳音意象**：年-{nayin_year_a}, 日-{nayin_day_a}
     - **本命画像**：(请基于其日主和格局，用一句话描述甲方的性格底色，如"固执但有责任感的磐石")
     
     **【乙方 (User B)】**
-    - **性别**：{person_b.get('gender', '未知')}
-    - **八字**：{person_b['year_pillar']}  {person_b['month_pillar']}  {person_b['day_pillar']}  {person_b['hour_pillar']}
-    - **核心格局**：{person_b.get('pattern_name', '普通格局')}
-    - **五行能量**：{person_b.get('strength', '未知')} (喜：{person_b.get('joy_elements', '未知')})
-    - **纳音意象**：年-{person_b.get('nayin', {}).get('year', '未知')}, 日-{person_b.get('nayin', {}).get('day', '未知')}
+    - **性别**：{gender_b}
+    - **八字**：{year_pillar_b}  {month_pillar_b}  {day_pillar_b}  {hour_pillar_b}
+    - **核心格局**：{pattern_b}
+    - **五行能量**：{strength_b} (喜：{joy_b})
+    - **纳音意象**：年-{nayin_year_b}, 日-{nayin_day_b}
     - **本命画像**：(请基于其日主和格局，用一句话描述乙方的性格底色)
 
     ---
     ### 🎯 关系定义 (Relationship Context)
     - **关系类型**：{relation_type}
-    - **性别组合**：{person_a.get('gender', '未知')} + {person_b.get('gender', '未知')}
+    - **性别组合**：{gender_a} + {gender_b}
     {role_instruction}
 
     ---
@@ -165,8 +238,8 @@ def build_couple_prompt(person_a, person_b, comp_data, relation_type="恋人/伴
 
     ---
     ### 🎯 用户核心诉求 (User Focus)
-    **用户现在的疑问点是**：{focus_instruction if focus_instruction else "无特别指定，请全面分析"}
-    **指令**：{'请在分析报告中，**用 50% 以上的篇幅** 专门回答这个问题。其他维度可简略带过。' if focus_instruction else '请按照标准结构进行全面分析。'}
+    **用户现在的疑问点是**：{focus_text}
+    **指令**：{focus_directive}
 
     ---
     ### 📝 分析指令 (Instructions)
@@ -198,8 +271,85 @@ def build_couple_prompt(person_a, person_b, comp_data, relation_type="恋人/伴
     2.  遇到刑冲，请用"磨合"、"修炼"等词汇代替"克死"。
     3.  分析必须基于上述提供的八字数据，不可胡编乱造。
     """
+_FOCUS_DIRECTIVE = '请在分析报告中，**用 50% 以上的篇幅** 专门回答这个问题。其他维度可简略带过。'
+_DEFAULT_DIRECTIVE = '请按照标准结构进行全面分析。'
+
+
+# 合盘关系定制指令，按 (性别组合, 关系类型) 查表；同性组合只对恋人/伴侣有专门指令
+COUPLE_ROLE_INSTRUCTIONS = {
+    # 同性恋人：去性别化，强调角色互动
+    ("same", "恋人/伴侣"): """
+    **⚠️ 特殊指令（同性伴侣分析）**：
+    1.  **严禁使用**"丈夫"、"妻子"、"克妻"、"旺夫"等传统异性恋术语。
+    2.  请使用"甲方/乙方"、"伴侣"、"对方"或"另一半"来称呼。
+    3.  分析重点在于**阴阳能量的互补**（如一方阳刚一方阴柔，或双方都很强势），而非生理性别。
+        """,
+    # 事业伙伴：完全不谈感情，只谈钱和协作
+    ("any", "事业合伙人"): """
+    **⚠️ 特殊指令（事业合伙分析）**：
+    1.  这是商业合伙关系，**严禁提及**婚恋、桃花、夫妻宫等情感术语。
+    2.  请将"日支合"解读为"协作默契"，将"日支冲"解读为"经营理念冲突"。
+    3.  重点分析：两人合财吗？能否互补短板？谁适合主导（CEO），谁适合执行（COO）？
+        """,
+    # 朋友：谈性格共鸣
+    ("any", "知己好友"): """
+    **⚠️ 特殊指令（友情分析）**：
+    1.  这是纯友谊关系。请分析两人是否是"灵魂知己"或"酒肉朋友"。
+    2.  重点看性格是否投缘，能否互相提供情绪价值。
+        """,
+    # 尚未确定关系：全面分析各种可能性
+    ("any", "尚未确定"): """
+    **⚠️ 特殊指令（关系探索分析）**：
+    1.  两人关系尚未明确，请从多角度分析他们的契合度。
+    2.  请分别评估：作为恋人、作为事业伙伴、作为朋友的匹配程度。
+    3.  给出建议：根据两人八字特点，哪种关系更适合他们？
+        """,
+}
+# 默认异性恋人
+DEFAULT_ROLE_INSTRUCTION = "这是传统的异性伴侣分析，请按常规命理逻辑进行。"
+
+
+def build_couple_prompt(person_a, person_b, comp_data, relation_type="恋人/伴侣", focus_instruction=""):
+    """
+    构建双人合盘的最终 Prompt
     
-    return prompt
+    :param person_a: 甲方数据 (包含四柱、格局、强弱、喜用神)
+    :param person_b: 乙方数据 (包含四柱、格局、强弱、喜用神)
+    :param comp_data: Python算出的合盘硬指标 (包含 'details' 列表, 'base_score' 等)
+    :param relation_type: 关系类型 (恋人/伴侣, 事业合伙人, 知己好友, 尚未确定)
+    :param focus_instruction: 用户的核心诉求，如有则重点回答
+    """
+    
+    # 1. 检测性别组合
+    is_same_sex = (person_a.get('gender', '未知') == person_b.get('gender', '未知'))
+    
+    # 2. 定制化 Role 指令
+    role_key = ("same" if is_same_sex and relation_type == "恋人/伴侣" else "any", relation_type)
+    role_instruction = COUPLE_ROLE_INSTRUCTIONS.get(role_key, DEFAULT_ROLE_INSTRUCTION)
+    
+    fields = {
+        "relation_type": relation_type,
+        "role_instruction": role_instruction,
+        # 将 Python 算出的列表转换为 Markdown 文本
+        "hard_evidence": "\n".join([f"- {item}" for item in comp_data['details']]),
+        "focus_text": focus_instruction or "无特别指定，请全面分析",
+        "focus_directive": _FOCUS_DIRECTIVE if focus_instruction else _DEFAULT_DIRECTIVE,
+    }
+    for suffix, person in (("a", person_a), ("b", person_b)):
+        nayin = person.get('nayin', {})
+        fields.update({
+            f"gender_{suffix}": person.get('gender', '未知'),
+            f"year_pillar_{suffix}": person['year_pillar'],
+            f"month_pillar_{suffix}": person['month_pillar'],
+            f"day_pillar_{suffix}": person['day_pillar'],
+            f"hour_pillar_{suffix}": person['hour_pillar'],
+            f"pattern_{suffix}": person.get('pattern_name', '普通格局'),
+            f"strength_{suffix}": person.get('strength', '未知'),
+            f"joy_{suffix}": person.get('joy_elements', '未知'),
+            f"nayin_year_{suffix}": nayin.get('year', '未知'),
+            f"nayin_day_{suffix}": nayin.get('day', '未知'),
+        })
+    return COUPLE_PROMPT_TEMPLATE.format_map(fields)
 
 
 def draw_hexagram_svg(binary_code):
@@ -222,91 +372,102 @@ def draw_hexagram_svg(binary_code):
     return dwg.tostring()
 
 
-def build_oracle_prompt(user_question, hex_data, bazi_data):
-    """
-    构建【命卜合参】的最终 Prompt
-    
-    :param user_question: 用户的问题 (str)
-    :param hex_data: 周易起卦结果 (dict: original_hex, future_hex, changing_lines, details)
-    :param bazi_data: 八字排盘结果 (dict: day_pillar, pattern_name, strength, joy_elements)
-    """
-    
-    # 1. 提炼八字核心画像 (Character Profile)
-    # 我们不需要把四柱的所有细节都丢进去，只需要"性格"和"能量"
-    bazi_profile = f"""
-    - **日主 (本我)**：{bazi_data['day_pillar'][0]} (能量状态：{bazi_data.get('strength', '未知')})
-    - **核心格局 (性格底色)**：{bazi_data.get('pattern_name', '普通格局')}
-    - **喜用神 (能量需求)**：{bazi_data.get('joy_elements', '未知')}
-    """
+# 【命卜合参】固定指令：放在 system 消息中，作为所有卜卦请求共享的稳定前缀 (便于服务端前缀缓存)
+ORACLE_SYSTEM_PROMPT = """
+# Role & Persona
+你是一位精通《周易》六爻与《子平八字》的国学大师，擅长将"命理哲学"与"现实决策"结合。
 
-    # 2. 提炼卦象信息 (Divination Data)
-    hex_info = f"""
-    - **本卦 (现状)**：{hex_data['original_hex']}
-    - **变卦 (趋势)**：{hex_data['future_hex']}
-    - **动爻 (变数)**：{', '.join(map(str, hex_data.get('changing_lines', [])))} 
-    - **爻辞细节**：{'; '.join(hex_data.get('details', []))}
-    """
+用户消息会提供【数据输入】：案主档案 (Context - 仅作背景参考) 与占卜事项 (Focus - 核心决策依据)。
+案主档案是用户的"出厂设置"与性格底色，用于决定"应对策略"；占卜事项是用户当下的具体困惑，用于决定"吉凶成败"。
 
-    # 3. 构建 Prompt
-    prompt = f"""
-    # Role & Persona
-    你是一位精通《周易》六爻与《子平八字》的国学大师，擅长将"命理哲学"与"现实决策"结合。
-    
-    ---
-    ### 📂 数据输入 (Data Input)
+---
+### 🧠 核心思考协议 (Priority Protocol) - 重要！
+请严格遵守以下**权重原则**进行分析，切勿混淆：
 
-    **1. 案主档案 (Context - 仅作背景参考)**
-    *这是用户的"出厂设置"与性格底色，用于决定"应对策略"。*
-    {bazi_profile}
+**1. 决断权在卦 (Hexagram rules the Outcome)**
+* **成败吉凶，以卦象为准！**
+* 即使八字显示用户运气不好，如果卦象是大吉（如《乾为天》），请断为吉。
+* *逻辑*：八字是气候，卦象是当下的天气。气候差不代表今天不下雨。
 
-    **2. 占卜事项 (Focus - 核心决策依据)**
-    *这是用户当下的具体困惑，用于决定"吉凶成败"。*
-    * **用户提问**："{user_question}"
-    {hex_info}
+**2. 策略权在命 (Bazi rules the Strategy)**
+* **怎么做，以八字为准！**
+* 结合案主的【格局】与【强弱】给出建议。
+* *场景A*：若卦吉，但案主**身弱/七杀格**（抗压差） -> 建议："虽然机会很好，但不要单打独斗，需找人合作（印比帮身）"。
+* *场景B*：若卦凶，且案主**身强/伤官格**（心气高） -> 建议："目前时机未到，你才华虽高但容易冲动，现在最需要的是忍耐和蛰伏"。
 
-    ---
-    ### 🧠 核心思考协议 (Priority Protocol) - 重要！
-    请严格遵守以下**权重原则**进行分析，切勿混淆：
+---
+### 📝 输出结构 (Output Format)
+请以 Markdown 格式输出。**严格限制总字数在 600-800 字以内**，言简意赅，不要铺陈废话。
 
-    **1. 决断权在卦 (Hexagram rules the Outcome)**
-    * **成败吉凶，以卦象为准！**
-    * 即使八字显示用户运气不好，如果卦象是大吉（如《乾为天》），请断为吉。
-    * *逻辑*：八字是气候，卦象是当下的天气。气候差不代表今天不下雨。
+#### 1. 🔮 大师直断
+* 用一句话直接回答用户的问题（吉/凶/平/待定）。不要模棱两刻。只使用中文标题。（控制在 50 字以内）
 
-    **2. 策略权在命 (Bazi rules the Strategy)**
-    * **怎么做，以八字为准！**
-    * 结合案主的【格局】与【强弱】给出建议。
-    * *场景A*：若卦吉，但案主**身弱/七杀格**（抗压差） -> 建议："虽然机会很好，但不要单打独斗，需找人合作（印比帮身）"。
-    * *场景B*：若卦凶，且案主**身强/伤官格**（心气高） -> 建议："目前时机未到，你才华虽高但容易冲动，现在最需要的是忍耐和蛰伏"。
+#### 2. 📜 卦象天机
+* **断语**：解释【本卦】和【变卦】的含义（结合用户的问题，不要掉书袋）。
+* **玄机**：重点解读【动爻】。动爻是事情的突破口，它暗示了什么？
+* （此段控制在 200 字以内）
 
-    ---
-    ### 📝 输出结构 (Output Format)
-    请以 Markdown 格式输出。**严格限制总字数在 600-800 字以内**，言简意赅，不要铺陈废话。
+#### 3. 💡 命理锦囊
+* **话术要求**：必须结合用户的【八字格局】来谈。
+* *模板*："结合你的命盘来看，你是 [格局名] 的人，性格 [性格关键词]。面对这个卦象显示的局势，最佳策略是……"
+* **行动建议**：给出 1-2 条具体的行动指南。
+* （此段控制在 200 字以内）
 
-    #### 1. 🔮 大师直断
-    * 用一句话直接回答用户的问题（吉/凶/平/待定）。不要模棱两刻。只使用中文标题。（控制在 50 字以内）
+---
+**安全合规指令**：
+保持理性、客观、温暖。遇到凶卦，请侧重于"如何避险"或"等待时机"，给予希望，严禁制造恐慌。
 
-    #### 2. 📜 卦象天机
-    * **断语**：解释【本卦】和【变卦】的含义（结合用户的问题，不要掉书袋）。
-    * **玄机**：重点解读【动爻】。动爻是事情的突破口，它暗示了什么？
-    * （此段控制在 200 字以内）
+**语言要求**：全文（包括标题）严禁出现任何英文或拼音。
 
-    #### 3. 💡 命理锦囊
-    * **话术要求**：必须结合用户的【八字格局】来谈。
-    * *模板*："结合你的命盘来看，你是 [格局名] 的人，性格 [性格关键词]。面对这个卦象显示的局势，最佳策略是……"
-    * **行动建议**：给出 1-2 条具体的行动指南。
-    * （此段控制在 200 字以内）
+**长度红线**：总回复不超过 800 字。超过即为失败。
+"""
 
-    ---
-    **安全合规指令**：
-    保持理性、客观、温暖。遇到凶卦，请侧重于"如何避险"或"等待时机"，给予希望，严禁制造恐慌。
-    
-    **语言要求**：全文（包括标题）严禁出现任何英文或拼音。
-    
-    **长度红线**：总回复不超过 800 字。超过即为失败。
+
+# 【命卜合参】用户消息模板：案主档案 (八字画像) + 占卜事项 (卦象与提问)
+ORACLE_USER_TEMPLATE = """
+### 📂 数据输入 (Data Input)
+
+**1. 案主档案 (Context - 仅作背景参考)**
+*这是用户的"出厂设置"与性格底色，用于决定"应对策略"。*
+
+- **日主 (本我)**：{day_master} (能量状态：{strength})
+- **核心格局 (性格底色)**：{pattern_name}
+- **喜用神 (能量需求)**：{joy_elements}
+
+
+**2. 占卜事项 (Focus - 核心决策依据)**
+*这是用户当下的具体困惑，用于决定"吉凶成败"。*
+
+- **本卦 (现状)**：{original_hex}
+- **变卦 (趋势)**：{future_hex}
+- **动爻 (变数)**：{changing_lines} 
+- **爻辞细节**：{details}
+
+* **用户提问**："{user_question}"
+"""
+
+
+def build_oracle_prompt(user_question, hex_data, bazi_data):
     """
+    构建【命卜合参】的用户消息 (仅包含每次变化的数据部分)
+    固定的角色、思考协议与输出结构见 ORACLE_SYSTEM_PROMPT，应作为 system 消息发送。
     
-    return prompt
+    :param user_question: 用户的问题 (str)
+    :param hex_data: 周易起卦结果 (dict: original_hex, future_hex, changing_lines, details)
+    :param bazi_data: 八字排盘结果 (dict: day_pillar, pattern_name, strength, joy_elements)
+    """
+    # 八字只提炼"性格"和"能量"，不必把四柱的所有细节都丢进去
+    return ORACLE_USER_TEMPLATE.format_map({
+        "day_master": bazi_data['day_pillar'][0],
+        "strength": bazi_data.get('strength', '未知'),
+        "pattern_name": bazi_data.get('pattern_name', '普通格局'),
+        "joy_elements": bazi_data.get('joy_elements', '未知'),
+        "original_hex": hex_data['original_hex'],
+        "future_hex": hex_data['future_hex'],
+        "changing_lines": ', '.join(map(str, hex_data.get('changing_lines', []))),
+        "details": '; '.join(hex_data.get('details', [])),
+        "user_question": user_question,
+    })
 
 
 # ============================================================
@@ -339,6 +500,23 @@ BRANCH_WEIGHT_MAP = {
     "亥": [("壬", 70), ("甲", 30)]
 }
 
+# 五行顺序 (能量向量的下标顺序)
+WUXING_ORDER = ("木", "火", "土", "金", "水")
+
+
+def _wuxing_vector(contributions):
+    """把 [(天干, 分数), ...] 汇总为按 WUXING_ORDER 排列的五元素分数向量"""
+    vector = [0, 0, 0, 0, 0]
+    for stem, weight in contributions:
+        if stem in STEM_WUXING_MAP:
+            vector[WUXING_ORDER.index(STEM_WUXING_MAP[stem])] += weight
+    return tuple(vector)
+
+
+# 预计算: 每个天干 / 地支对五行的贡献向量 (天干 100 点, 地支按藏干权重)
+STEM_ENERGY_VECTORS = {stem: _wuxing_vector([(stem, 100)]) for stem in STEM_WUXING_MAP}
+BRANCH_ENERGY_VECTORS = {branch: _wuxing_vector(hidden) for branch, hidden in BRANCH_WEIGHT_MAP.items()}
+
 
 class BaziEnergyCalculator:
     """
@@ -361,38 +539,24 @@ class BaziEnergyCalculator:
         :return: dict 包含每个五行的分数和百分比
                  {'木': {'score': 250, 'pct': 0.25}, ...}
         """
-        # 初始化五行分数
-        scores = {"木": 0, "火": 0, "土": 0, "金": 0, "水": 0}
+        # 按 WUXING_ORDER 累加每柱天干、地支的预计算贡献向量
+        scores = [0, 0, 0, 0, 0]
         
         for pillar in pillars:
             if len(pillar) != 2:
                 continue
             
-            stem, branch = pillar[0], pillar[1]
-            
-            # 1. 天干贡献 100 点
-            if stem in self.stem_map:
-                wuxing = self.stem_map[stem]
-                scores[wuxing] += 100
-            
-            # 2. 地支藏干按权重贡献
-            if branch in self.branch_map:
-                for hidden_stem, weight in self.branch_map[branch]:
-                    if hidden_stem in self.stem_map:
-                        wuxing = self.stem_map[hidden_stem]
-                        scores[wuxing] += weight
+            for vector in (STEM_ENERGY_VECTORS.get(pillar[0]), BRANCH_ENERGY_VECTORS.get(pillar[1])):
+                if vector:
+                    scores = [a + b for a, b in zip(scores, vector)]
         
         # 计算总分和百分比
-        total = sum(scores.values())
-        if total == 0:
-            total = 1  # 避免除零
+        total = sum(scores) or 1  # 避免除零
         
-        result = {}
-        for element, score in scores.items():
-            result[element] = {
-                "score": score,
-                "pct": round(score / total, 4)
-            }
+        result = {
+            element: {"score": score, "pct": round(score / total, 4)}
+            for element, score in zip(WUXING_ORDER, scores)
+        }
         
         return result
     
@@ -427,3 +427,8 @@ def get_shichen_mid_hour(shichen: str) -> int:
     if shichen == "子时 (23:00-01:00)":
         return 0  # 返回0点作为子时中点
     return hours[0] + 1  # 返回时辰中间的小时
+
+
+# 时辰下拉选项与中间小时（导入时计算一次）
+SHICHEN_OPTIONS = tuple(SHICHEN_HOURS)
+SHICHEN_MID_HOURS = {shichen: get_shichen_mid_hour(shichen) for shichen in SHICHEN_OPTIONS}
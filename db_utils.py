@@ -12,17 +12,14 @@ from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 
-_supabase_client: Optional[Client] = None
-_supabase_init_attempted = False
 
-
-def get_supabase_client() -> Optional[Client]:
-    """Initialize and return a singleton Supabase client."""
-    global _supabase_client, _supabase_init_attempted
-    if _supabase_init_attempted:
-        return _supabase_client
-
-    _supabase_init_attempted = True
+@st.cache_resource(show_spinner=False)
+def _create_supabase_client() -> Optional[Client]:
+    """
+    Create the Supabase client once per process.
+    The client (and its pooled HTTP connections) is shared by all sessions and reruns;
+    cache_resource also serializes the first call so concurrent sessions don't race.
+    """
     url: str = os.environ.get("SUPABASE_URL")
     key: str = (
         os.environ.get("SUPABASE_KEY")
@@ -33,16 +30,18 @@ def get_supabase_client() -> Optional[Client]:
     if not url or not key:
         # Fail fast if credentials are missing, but allow import for safe checks
         print("WARNING: Supabase credentials not found in environment variables.")
-        _supabase_client = None
         return None
 
     try:
-        _supabase_client = create_client(url, key)
+        return create_client(url, key)
     except Exception as e:
         print(f"ERROR: Failed to initialize Supabase client: {e}")
-        _supabase_client = None
+        return None
+
 
-    return _supabase_client
+def get_supabase_client() -> Optional[Client]:
+    """Return the shared Supabase client (None if unavailable)."""
+    return _create_supabase_client()
 
 
 # China Standard Time offset (UTC+8)
@@ -55,18 +54,32 @@ def get_cst_today() -> str:
     return cst_now.strftime("%Y-%m-%d")
 
 
-def init_db() -> None:
+def init_db() -> bool:
     """
     Initialize the database connection.
     For Supabase, table creation is handled via SQL Editor/Dashboard.
-    This function verifies the connection exists.
+    This function verifies the connection exists; the client itself is created
+    once per process, so calling it on every rerun is cheap.
     """
     client = get_supabase_client()
     if not client:
         st.error("无法连接到云端数据库：缺少 Supabase 配置。")
-        return
+        return False
+    return True
 
 
+# Short-lived read cache for single-profile lookups; cleared on every profile write
+PROFILE_CACHE_TTL_SECONDS = 30
+
+
+def _invalidate_profile_cache() -> None:
+    """Drop cached profile reads after a write so callers never see stale rows."""
+    profile_exists.clear()
+    get_profile_by_id.clear()
+    _get_last_divination_date.clear()
+
+
+@st.cache_data(ttl=PROFILE_CACHE_TTL_SECONDS, show_spinner=False)
 def profile_exists(profile_id: str) -> bool:
     """
     Check if a profile ID already exists in the database.
@@ -92,10 +105,12 @@ def save_profile(
     birth_day: int,
     birth_hour: str,
     city: Optional[str] = None,
-    is_lunar: bool = False
+    is_lunar: bool = False,
+    session_data: Optional[str] = None
 ) -> bool:
     """
     Save a new profile to Supabase with STRICT VERIFICATION.
+    If session_data is given it is written in the same upsert (no follow-up update).
     
     Logic:
     1. Upsert data.
@@ -118,10 +133,13 @@ def save_profile(
         "is_lunar": 1 if is_lunar else 0,
         "created_at": datetime.utcnow().isoformat()
     }
+    if session_data is not None:
+        data["session_data"] = session_data
     
     try:
         # 1. Upsert
         response = client.table("profiles").upsert(data).execute()
+        _invalidate_profile_cache()
         
         # 2. Check for "Soft" Error (Empty Data usually means RLS blocked it)
         # Note: supabase-py v2 might return data as list of dicts
@@ -171,6 +189,7 @@ def get_all_profiles() -> List[Dict[str, Any]]:
         return []
 
 
+@st.cache_data(ttl=PROFILE_CACHE_TTL_SECONDS, show_spinner=False)
 def get_profile_by_id(profile_id: str) -> Optional[Dict[str, Any]]:
     """
     Retrieve a single profile by ID.
@@ -211,6 +230,7 @@ def update_session_data(profile_id: str, session_data: str) -> bool:
         
     try:
         response = client.table("profiles").update({"session_data": session_data}).eq("profile_id", profile_id).execute()
+        _invalidate_profile_cache()
         return len(response.data) > 0
     except Exception as e:
         print(f"Error updating session data: {e}")
@@ -227,6 +247,7 @@ def delete_profile(profile_id: str) -> bool:
         
     try:
         response = client.table("profiles").delete().eq("profile_id", profile_id).execute()
+        _invalidate_profile_cache()
         # In supabase-py, delete might return the deleted rows if authorized
         return len(response.data) > 0
     except Exception as e:
@@ -234,37 +255,45 @@ def delete_profile(profile_id: str) -> bool:
         return False
 
 
-def check_daily_quota(profile_id: str) -> bool:
+@st.cache_data(ttl=PROFILE_CACHE_TTL_SECONDS, show_spinner=False)
+def _get_last_divination_date(profile_id: str) -> Optional[str]:
     """
-    Check if a profile has available daily divination quota.
+    Fetch last_divination_date for a profile.
+    Returns "" when the profile has never divined and None when it does not exist.
+    Query errors propagate so st.cache_data does not cache them; only real
+    results are kept for the TTL.
     """
     client = get_supabase_client()
     if not client:
-        return False
-        
+        raise RuntimeError("Supabase client unavailable")
+
+    response = client.table("profiles").select("last_divination_date").eq("profile_id", profile_id).execute()
+    if not response.data:
+        return None
+    return response.data[0].get("last_divination_date") or ""
+
+
+def check_daily_quota(profile_id: str) -> bool:
+    """
+    Check if a profile has available daily divination quota.
+    The date lookup is cached; comparing against today happens per call so the
+    quota still resets at CST midnight. A failed lookup counts as no quota
+    for this call only.
+    """
     try:
-        response = client.table("profiles").select("last_divination_date").eq("profile_id", profile_id).execute()
-        if not response.data:
-            return False
-            
-        last_date = response.data[0].get("last_divination_date")
-        today = get_cst_today()
-        
-        if not last_date:
-            return True
-        
-        if last_date < today:
-            return True
-            
-        return False
+        last_date = _get_last_divination_date(profile_id)
     except Exception as e:
         print(f"Error checking quota: {e}")
         return False
+    if last_date is None:
+        return False
+    return not last_date or last_date < get_cst_today()
 
 
-def consume_daily_quota(profile_id: str) -> bool:
+def consume_daily_quota(profile_id: str, session_data: Optional[str] = None) -> bool:
     """
     Consume the daily divination quota.
+    If session_data is given it is saved in the same update (one round-trip).
     """
     client = get_supabase_client()
     if not client:
@@ -272,7 +301,11 @@ def consume_daily_quota(profile_id: str) -> bool:
         
     try:
         today = get_cst_today()
-        response = client.table("profiles").update({"last_divination_date": today}).eq("profile_id", profile_id).execute()
+        fields = {"last_divination_date": today}
+        if session_data is not None:
+            fields["session_data"] = session_data
+        response = client.table("profiles").update(fields).eq("profile_id", profile_id).execute()
+        _invalidate_profile_cache()
         return len(response.data) > 0
     except Exception as e:
         print(f"Error consuming quota: {e}")
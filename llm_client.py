@@ -1,13 +1,184 @@
 """
-Cached OpenAI-compatible client factory for reuse across requests.
+Cached OpenAI-compatible client factory for reuse across requests,
+an exact-match response cache, and a small helper for coalescing streamed output.
 """
 from __future__ import annotations
 
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
 from functools import lru_cache
+from typing import Any, Callable, Iterable, Iterator, Optional
+import httpx
 from openai import OpenAI
 
+# Optional: h2 enables HTTP/2 multiplexing in httpx (may not be installed on all deployments)
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Keep connections to the provider warm between reruns/requests
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300)
+
+# Exact-match LLM response cache (process-wide, shared by all sessions)
+RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+RESPONSE_CACHE_MAX_ENTRIES = 500
+
+_response_cache: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
 
 @lru_cache(maxsize=8)
 def get_llm_client(api_key: str, base_url: str) -> OpenAI:
-    """Return a cached OpenAI client for a given key/base URL pair."""
-    return OpenAI(api_key=api_key, base_url=base_url)
+    """
+    Return a cached OpenAI client for a given key/base URL pair.
+    The module is imported once per process, so the client and its keep-alive
+    connection pool survive Streamlit reruns (no new TLS handshake per call).
+    """
+    http_client = httpx.Client(http2=HTTP2_AVAILABLE, limits=HTTP_POOL_LIMITS)
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+
+def response_cache_key(model: str, messages: list, **params: Any) -> str:
+    """SHA-256 over the model, messages and generation params of a chat request."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(key: str) -> Optional[str]:
+    """Return a cached response for key, or None if missing/expired."""
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            return None
+        stored_at, text = entry
+        if time.monotonic() - stored_at > RESPONSE_CACHE_TTL_SECONDS:
+            del _response_cache[key]
+            return None
+        _response_cache.move_to_end(key)
+        return text
+
+
+def store_response(key: str, text: str) -> None:
+    """Cache a complete response, evicting the least recently used entries."""
+    if not text:
+        return
+    with _response_cache_lock:
+        _response_cache[key] = (time.monotonic(), text)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+
+
+def cached_stream(key: str, produce: Callable[[], Iterable[str]]) -> Iterator[str]:
+    """
+    Stream a response through the exact-match cache.
+
+    On a hit the stored text is yielded in one piece; on a miss produce() is
+    streamed through and the joined text is cached once it completes.
+    Exceptions propagate and nothing is cached for failed or abandoned streams.
+    """
+    cached = get_cached_response(key)
+    if cached is not None:
+        yield cached
+        return
+    parts: list[str] = []
+    for piece in produce():
+        parts.append(piece)
+        yield piece
+    store_response(key, "".join(parts))
+
+
+_STREAM_END = object()
+
+
+def prefetch_stream(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Pull chunks on a background thread so the network stream keeps being read
+    while the caller renders.
+
+    Everything queued since the previous step is yielded as one joined piece, so a
+    slow renderer catches up in a single update instead of one update per delta.
+    Producer exceptions are re-raised in the caller; closing the iterator early
+    stops the producer at its next chunk.
+    """
+    pending: "queue.Queue[Any]" = queue.Queue()
+    stop = threading.Event()
+
+    def _pump() -> None:
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                pending.put(chunk)
+        except BaseException as exc:  # handed to the consumer thread
+            pending.put(exc)
+        finally:
+            pending.put(_STREAM_END)
+
+    threading.Thread(target=_pump, name="llm-stream-prefetch", daemon=True).start()
+    try:
+        while True:
+            items = [pending.get()]
+            while True:
+                try:
+                    items.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            text_parts: list[str] = []
+            for item in items:
+                if item is _STREAM_END:
+                    if text_parts:
+                        yield "".join(text_parts)
+                    return
+                if isinstance(item, BaseException):
+                    if text_parts:
+                        yield "".join(text_parts)
+                    raise item
+                text_parts.append(item)
+            yield "".join(text_parts)
+    finally:
+        stop.set()
+
+
+def coalesce_stream(
+    chunks: Iterable[str],
+    min_chars: int = 64,
+    max_delay: float = 0.15,
+) -> Iterator[str]:
+    """
+    Merge small streamed deltas into larger pieces before rendering.
+
+    The first delta is passed through immediately (keeps time-to-first-token);
+    after that, buffered text is flushed once it reaches min_chars or has
+    waited max_delay seconds. Remaining text is flushed at the end.
+    """
+    buffer: list[str] = []
+    buffered_chars = 0
+    first = True
+    last_flush = time.monotonic()
+    for chunk in chunks:
+        if first:
+            first = False
+            last_flush = time.monotonic()
+            yield chunk
+            continue
+        buffer.append(chunk)
+        buffered_chars += len(chunk)
+        now = time.monotonic()
+        if buffered_chars >= min_chars or now - last_flush >= max_delay:
+            yield "".join(buffer)
+            buffer.clear()
+            buffered_chars = 0
+            last_flush = now
+    if buffer:
+        yield "".join(buffer)
@@ -9,7 +9,7 @@ import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from lunar_python import Solar
-from llm_client import get_llm_client
+from llm_client import get_llm_client, response_cache_key, get_cached_response, store_response, cached_stream
 import svgwrite
 
 # Optional: Tavily for search (may not be installed on all deployments)
@@ -2147,6 +2147,15 @@ def calculate_bazi(year: int, month: int, day: int, hour: int, minute: int = 0,
         "hidden_stems": hidden_stems_info,
         "strength": strength_info,
         "auxiliary": auxiliary_info,
+        # Per-pillar parallel views (year, month, day, hour) for chart rendering
+        "pillars": ((y_stem, y_branch), (m_stem, m_branch), (d_stem, d_branch), (h_stem, h_branch)),
+        "ten_gods_vec": (ten_gods["年干"], ten_gods["月干"], "日主", ten_gods["时干"]),
+        "hidden_vec": (
+            tuple(hidden_stems_info["年支藏干"]),
+            tuple(hidden_stems_info["月支藏干"]),
+            tuple(hidden_stems_info["日支藏干"]),
+            tuple(hidden_stems_info["时支藏干"]),
+        ),
     }
     
     return bazi_str, time_info, pattern_info
@@ -2477,6 +2486,47 @@ def build_thousand_faces_prompt(bazi_context: str, age: int, gender: str) -> str
     return prompt
 
 
+def build_analysis_system_prompt(is_first_response: bool) -> tuple:
+    """
+    Build the analysis system prompt (shared by single-topic and batch calls).
+
+    Returns:
+        (system_prompt, this_year, next_year) with the years as strings.
+    """
+    # Build system prompt based on whether this is the first response
+    if is_first_response:
+        response_rules = """
+
+# Response Rules (回复规则)
+1. 回复开头可以有一段简短自然的引导语（如针对用户命格的开场白），但不要用"好的，这位女士/先生，很高兴为您进行八字命理分析。根据您提供的八字信息，我们来详细解读您的命局"这样的固定模板。
+2. 请直接给出分析结果，不要包含与命理无关的废话。
+3. 回复时只给出概率最大的相关结果，不要过于模棱两可或穷举所有可能。
+4. **【重要】严禁使用括号解释来源**：请将专业术语（如五行百分比、纳音、神煞、冲合）自然融入文中，**严禁**使用括号进行解释或标注来源。
+   - ❌ 错误示例："你是炉中火(纳音)，火气很旺(45%)，要注意伤官见官(口舌)。"
+   - ✅ 正确示例："你的底色如同炉中烈火，能量充沛，但这也意味着你性格直率，容易在言语上得罪人。"""
+    else:
+        response_rules = """
+
+# Response Rules (回复规则)
+1. 这不是第一次分析，请不要有任何引导语或开场白，直接进入正文内容。
+2. 请直接给出分析结果，不要包含与命理无关的废话。
+3. 回复时只给出概率最大的相关结果，不要过于模棱两可或穷举所有可能。
+4. 注意与之前分析的连贯性，可以适当引用之前的结论，但避免重复。
+5. **【重要】严禁使用括号解释来源**：请将专业术语（如五行百分比、纳音、神煞、冲合）自然融入文中，**严禁**使用括号进行解释或标注来源，不要展示推理过程。"""
+    
+    # Calculate current and next year for dynamic prompts
+    current_yr = datetime.now().year
+    this_yr = str(current_yr)
+    next_yr = str(current_yr + 1)
+    
+    # Format system prompt and user message with dynamic years
+    system_prompt = (SYSTEM_INSTRUCTION + response_rules).format(
+        this_year=this_yr, 
+        next_year=next_yr
+    )
+    return system_prompt, this_yr, next_yr
+
+
 def get_fortune_analysis(
     topic: str,
     user_context: str,
@@ -2538,37 +2588,7 @@ def get_fortune_analysis(
                 + "\n\n**请注意**：不要复述已分析主题，只针对当前主题输出内容。\n"
             )
     
-    # Build system prompt based on whether this is the first response
-    if is_first_response:
-        response_rules = """
-
-# Response Rules (回复规则)
-1. 回复开头可以有一段简短自然的引导语（如针对用户命格的开场白），但不要用"好的，这位女士/先生，很高兴为您进行八字命理分析。根据您提供的八字信息，我们来详细解读您的命局"这样的固定模板。
-2. 请直接给出分析结果，不要包含与命理无关的废话。
-3. 回复时只给出概率最大的相关结果，不要过于模棱两可或穷举所有可能。
-4. **【重要】严禁使用括号解释来源**：请将专业术语（如五行百分比、纳音、神煞、冲合）自然融入文中，**严禁**使用括号进行解释或标注来源。
-   - ❌ 错误示例："你是炉中火(纳音)，火气很旺(45%)，要注意伤官见官(口舌)。"
-   - ✅ 正确示例："你的底色如同炉中烈火，能量充沛，但这也意味着你性格直率，容易在言语上得罪人。"""
-    else:
-        response_rules = """
-
-# Response Rules (回复规则)
-1. 这不是第一次分析，请不要有任何引导语或开场白，直接进入正文内容。
-2. 请直接给出分析结果，不要包含与命理无关的废话。
-3. 回复时只给出概率最大的相关结果，不要过于模棱两可或穷举所有可能。
-4. 注意与之前分析的连贯性，可以适当引用之前的结论，但避免重复。
-5. **【重要】严禁使用括号解释来源**：请将专业术语（如五行百分比、纳音、神煞、冲合）自然融入文中，**严禁**使用括号进行解释或标注来源，不要展示推理过程。"""
-    
-    # Calculate current and next year for dynamic prompts
-    current_yr = datetime.now().year
-    this_yr = str(current_yr)
-    next_yr = str(current_yr + 1)
-    
-    # Format system prompt and user message with dynamic years
-    system_prompt = (SYSTEM_INSTRUCTION + response_rules).format(
-        this_year=this_yr, 
-        next_year=next_yr
-    )
+    system_prompt, this_yr, next_yr = build_analysis_system_prompt(is_first_response)
     
     # Build user message based on topic
     if topic == "大师解惑" and custom_question:
@@ -2640,112 +2660,226 @@ def get_fortune_analysis(
             "temperature": temperature,
         }
         
-        # Gemini models - standard streaming (OpenAI-compatible endpoint doesn't support google_search grounding)
-        if model and model.startswith("gemini"):
-            api_params["stream"] = True
-            response = client.chat.completions.create(**api_params)
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    if first_chunk_time is None:
-                        first_chunk_time = time.monotonic()
-                    yield chunk.choices[0].delta.content
-            log_perf(
-                f"[PERF] gemini stream model={model} first_chunk_ms="
-                f"{int((first_chunk_time - start_time) * 1000) if first_chunk_time else 'NA'} "
-                f"total_ms={int((time.monotonic() - start_time) * 1000)}"
-            )
+        def _completion_chunks():
+            """Call the provider and yield content deltas (raises on API errors)."""
+            nonlocal first_chunk_time
+            # Gemini models - standard streaming (OpenAI-compatible endpoint doesn't support google_search grounding)
+            if model and model.startswith("gemini"):
+                api_params["stream"] = True
+                response = client.chat.completions.create(**api_params)
+                for chunk in response:
+                    if chunk.choices[0].delta.content:
+                        if first_chunk_time is None:
+                            first_chunk_time = time.monotonic()
+                        yield chunk.choices[0].delta.content
+                log_perf(
+                    f"[PERF] gemini stream model={model} first_chunk_ms="
+                    f"{int((first_chunk_time - start_time) * 1000) if first_chunk_time else 'NA'} "
+                    f"total_ms={int((time.monotonic() - start_time) * 1000)}"
+                )
         
-        elif enable_tools:
-            # For non-Gemini models with tools enabled - first call without streaming
-            api_params["tools"] = SEARCH_TOOLS
-            api_params["tool_choice"] = "auto"
+            elif enable_tools:
+                # For non-Gemini models with tools enabled - first call without streaming
+                api_params["tools"] = SEARCH_TOOLS
+                api_params["tool_choice"] = "auto"
             
-            first_call_start = time.monotonic()
-            response = client.chat.completions.create(**api_params)
-            first_call_end = time.monotonic()
-            message = response.choices[0].message
-            search_total_ms = 0
+                first_call_start = time.monotonic()
+                response = client.chat.completions.create(**api_params)
+                first_call_end = time.monotonic()
+                message = response.choices[0].message
+                search_total_ms = 0
             
-            # Check if the model wants to use tools
-            if message.tool_calls:
-                # Process tool calls
-                tool_results = []
-                for tool_call in message.tool_calls:
-                    if tool_call.function.name == "search_bazi_info":
-                        args = json.loads(tool_call.function.arguments)
-                        search_start = time.monotonic()
-                        search_result = search_bazi_info(
-                            query=args.get("query", ""),
-                            search_type=args.get("search_type", "bazi_classic")
-                        )
-                        search_total_ms += int((time.monotonic() - search_start) * 1000)
-                        tool_results.append({
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "content": search_result
-                        })
-                        # Yield a hint that search was performed
-                        yield f"🔍 正在搜索: {args.get('query', '')}...\n\n"
+                # Check if the model wants to use tools
+                if message.tool_calls:
+                    # Process tool calls
+                    tool_results = []
+                    for tool_call in message.tool_calls:
+                        if tool_call.function.name == "search_bazi_info":
+                            args = json.loads(tool_call.function.arguments)
+                            search_start = time.monotonic()
+                            search_result = search_bazi_info(
+                                query=args.get("query", ""),
+                                search_type=args.get("search_type", "bazi_classic")
+                            )
+                            search_total_ms += int((time.monotonic() - search_start) * 1000)
+                            tool_results.append({
+                                "tool_call_id": tool_call.id,
+                                "role": "tool",
+                                "content": search_result
+                            })
+                            # Yield a hint that search was performed
+                            yield f"🔍 正在搜索: {args.get('query', '')}...\n\n"
                 
-                # Make second call with tool results (streaming)
-                messages = api_params["messages"] + [
-                    {"role": "assistant", "tool_calls": [
-                        {"id": tc.id, "type": "function", "function": {"name": tc.function.name, "arguments": tc.function.arguments}}
-                        for tc in message.tool_calls
-                    ]}
-                ] + tool_results
+                    # Make second call with tool results (streaming)
+                    messages = api_params["messages"] + [
+                        {"role": "assistant", "tool_calls": [
+                            {"id": tc.id, "type": "function", "function": {"name": tc.function.name, "arguments": tc.function.arguments}}
+                            for tc in message.tool_calls
+                        ]}
+                    ] + tool_results
                 
-                final_response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    stream=True,
-                    temperature=temperature
-                )
+                    final_response = client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        temperature=temperature
+                    )
                 
-                for chunk in final_response:
+                    for chunk in final_response:
+                        if chunk.choices[0].delta.content:
+                            if first_chunk_time is None:
+                                first_chunk_time = time.monotonic()
+                            yield chunk.choices[0].delta.content
+                    log_perf(
+                        f"[PERF] tools stream model={model} tool_calls={len(message.tool_calls)} "
+                        f"first_call_ms={int((first_call_end - first_call_start) * 1000)} "
+                        f"search_ms={search_total_ms} first_chunk_ms="
+                        f"{int((first_chunk_time - start_time) * 1000) if first_chunk_time else 'NA'} "
+                        f"total_ms={int((time.monotonic() - start_time) * 1000)}"
+                    )
+                else:
+                    # No tool calls, just yield the content
+                    if message.content:
+                        if first_chunk_time is None:
+                            first_chunk_time = time.monotonic()
+                        yield message.content
+                    log_perf(
+                        f"[PERF] tools no-call model={model} "
+                        f"first_call_ms={int((first_call_end - first_call_start) * 1000)} "
+                        f"total_ms={int((time.monotonic() - start_time) * 1000)}"
+                    )
+        
+            else:
+                # Standard streaming for other cases
+                api_params["stream"] = True
+                response = client.chat.completions.create(**api_params)
+                for chunk in response:
                     if chunk.choices[0].delta.content:
                         if first_chunk_time is None:
                             first_chunk_time = time.monotonic()
                         yield chunk.choices[0].delta.content
                 log_perf(
-                    f"[PERF] tools stream model={model} tool_calls={len(message.tool_calls)} "
-                    f"first_call_ms={int((first_call_end - first_call_start) * 1000)} "
-                    f"search_ms={search_total_ms} first_chunk_ms="
+                    f"[PERF] stream model={model} first_chunk_ms="
                     f"{int((first_chunk_time - start_time) * 1000) if first_chunk_time else 'NA'} "
                     f"total_ms={int((time.monotonic() - start_time) * 1000)}"
                 )
-            else:
-                # No tool calls, just yield the content
-                if message.content:
-                    if first_chunk_time is None:
-                        first_chunk_time = time.monotonic()
-                    yield message.content
-                log_perf(
-                    f"[PERF] tools no-call model={model} "
-                    f"first_call_ms={int((first_call_end - first_call_start) * 1000)} "
-                    f"total_ms={int((time.monotonic() - start_time) * 1000)}"
-                )
-        
-        else:
-            # Standard streaming for other cases
-            api_params["stream"] = True
-            response = client.chat.completions.create(**api_params)
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    if first_chunk_time is None:
-                        first_chunk_time = time.monotonic()
-                    yield chunk.choices[0].delta.content
-            log_perf(
-                f"[PERF] stream model={model} first_chunk_ms="
-                f"{int((first_chunk_time - start_time) * 1000) if first_chunk_time else 'NA'} "
-                f"total_ms={int((time.monotonic() - start_time) * 1000)}"
-            )
+
+        # Identical requests (same model, prompts and mode) are answered from the response cache
+        cache_key = response_cache_key(
+            model, api_params["messages"], temperature=temperature, tools=bool(enable_tools)
+        )
+        if PERF_LOG and get_cached_response(cache_key) is not None:
+            log_perf(f"[PERF] cache hit model={model}")
+        yield from cached_stream(cache_key, _completion_chunks)
                     
     except Exception as e:
         log_perf(f"[PERF] error model={model} total_ms={int((time.monotonic() - start_time) * 1000)} err={e}")
         yield f"⚠️ 调用 LLM 时出错: {str(e)}"
 
 
+BATCH_TOPICS_INSTRUCTION = """
+---
+
+请在**一次回复**中依次完成以下全部主题的分析，每个主题遵循其对应要求：
+
+{topic_sections}
+
+⚠️ **输出格式**：只输出一个 JSON 对象，键为主题名称（{topic_names}），值为该主题的 Markdown 分析正文。不要输出 JSON 以外的任何内容。
+"""
+
+
+def get_batch_fortune_analysis(
+    topics: list,
+    user_context: str,
+    api_key: str = None,
+    base_url: str = None,
+    model: str = None,
+    is_first_response: bool = True,
+    conversation_history: list = None
+) -> dict:
+    """
+    Analyze several fixed topics with a single (non-streaming) LLM request.
+
+    The shared system prompt and user context are sent once instead of once per topic;
+    the model returns a JSON object mapping topic -> markdown.
+
+    Returns:
+        Dict of topic -> response text for each topic the model answered.
+
+    Raises:
+        RuntimeError: If the API key is missing, the call fails or the reply is not valid JSON.
+    """
+    api_key = api_key or os.getenv("DEEPSEEK_API_KEY")
+    base_url = base_url or os.getenv("OPENAI_BASE_URL", "https://api.deepseek.com")
+    model = model or "deepseek-chat"
+
+    if not api_key or api_key == "replace_me":
+        raise RuntimeError("API Key 未设置或无效。请在界面中输入 API Key 或在 .env 文件中设置。")
+
+    client = get_llm_client(api_key, base_url)
+    system_prompt, this_yr, next_yr = build_analysis_system_prompt(is_first_response)
+
+    history_summary = ""
+    if conversation_history:
+        prev_topics = [prev_topic for prev_topic, _ in conversation_history]
+        history_summary = (
+            "\n\n---\n\n【已分析主题】\n"
+            + "、".join(prev_topics)
+            + "\n\n**请注意**：不要复述已分析主题，只针对当前主题输出内容。\n"
+        )
+
+    topic_sections = "\n\n".join(
+        f"## 【{topic}】\n{ANALYSIS_PROMPTS.get(topic, '请进行综合命理分析。')}"
+        for topic in topics
+    )
+    user_message = (user_context + history_summary + BATCH_TOPICS_INSTRUCTION.format(
+        topic_sections=topic_sections,
+        topic_names="、".join(topics),
+    )).format(this_year=this_yr, next_year=next_yr)
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+    temperature = get_optimal_temperature(model)
+    cache_key = response_cache_key(model, messages, temperature=temperature, response_format="json_object")
+
+    start_time = time.monotonic()
+    try:
+        content = get_cached_response(cache_key)
+        if content is None:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                response_format={"type": "json_object"},
+            )
+            content = response.choices[0].message.content or ""
+    except Exception as e:
+        raise RuntimeError(f"调用 LLM 时出错: {e}") from e
+    finally:
+        if PERF_LOG:
+            print(
+                f"[PERF] batch model={model} topics={len(topics)} "
+                f"total_ms={int((time.monotonic() - start_time) * 1000)}",
+                flush=True
+            )
+
+    try:
+        sections = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise RuntimeError("模型返回的内容不是有效的 JSON") from e
+    if not isinstance(sections, dict):
+        raise RuntimeError("模型返回的内容不是 JSON 对象")
+    store_response(cache_key, content)
+
+    return {
+        topic: str(sections[topic]).strip()
+        for topic in topics
+        if sections.get(topic)
+    }
+
+
 # Keep old function for backward compatibility
 def get_fortune_interpretation(bazi_text: str, api_key: str = None, base_url: str = None, model: str = None):
     """Legacy function - redirects to get_fortune_analysis with default topic."""
@@ -25,7 +25,7 @@ from logic import (
     SYSTEM_INSTRUCTION,
     get_optimal_temperature
 )
-from bazi_utils import BaziCompatibilityCalculator, build_couple_prompt
+from bazi_utils import analyze_compatibility, build_couple_prompt
 
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 
@@ -337,8 +337,7 @@ async def get_compatibility(request: CompatibilityRequest):
         }
         
         # Run compatibility analysis
-        calculator = BaziCompatibilityCalculator()
-        result = calculator.analyze_compatibility(person_a, person_b)
+        result = analyze_compatibility(person_a, person_b)
         
         return CompatibilityResponse(
             base_score=result["base_score"],
@@ -0,0 +1,50 @@
+"""
+JSON encode/decode helpers for persisted session snapshots.
+Uses orjson when available and falls back to the stdlib json module.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import zlib
+from typing import Any
+
+# Optional: orjson is a C-accelerated encoder (may not be installed on all deployments)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+
+def dumps_json(obj: Any) -> str:
+    """Serialize obj to a UTF-8 JSON string (non-ASCII kept as-is)."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads_json(data: str | bytes) -> Any:
+    """Parse a JSON string or bytes payload."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def pack_snapshot(snapshot: Any) -> str:
+    """Encode a snapshot as zlib-compressed, base64url JSON (URL-safe, no quoting needed)."""
+    raw = dumps_json(snapshot).encode("utf-8")
+    return base64.urlsafe_b64encode(zlib.compress(raw, 6)).decode("ascii")
+
+
+def unpack_snapshot(payload: str) -> Any:
+    """
+    Inverse of pack_snapshot.
+    Plain JSON payloads written by older versions are still accepted.
+    """
+    payload = payload.strip()
+    if payload.startswith("{"):
+        return loads_json(payload)
+    raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+    return loads_json(zlib.decompress(raw))
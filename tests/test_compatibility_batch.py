@@ -0,0 +1,59 @@
+import sys
+import os
+
+import pytest
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import bazi_utils
+from bazi_utils import analyze_compatibility, analyze_compatibility_batch
+
+# Every day pillar, plus an unknown character on each side
+STEMS = bazi_utils.HEAVENLY_STEMS + "?"
+BRANCHES = bazi_utils.EARTHLY_BRANCHES + "?"
+DAY_STEMS = [stem for stem in STEMS for _ in BRANCHES]
+DAY_BRANCHES = [branch for _ in STEMS for branch in BRANCHES]
+
+
+def _assert_matches_scalar(scores):
+    for i, (stem_a, branch_a) in enumerate(zip(DAY_STEMS, DAY_BRANCHES)):
+        for j, (stem_b, branch_b) in enumerate(zip(DAY_STEMS, DAY_BRANCHES)):
+            expected = analyze_compatibility(
+                {"day_pillar": stem_a + branch_a}, {"day_pillar": stem_b + branch_b}
+            )["base_score"]
+            assert scores[i][j] == expected, (stem_a + branch_a, stem_b + branch_b)
+
+
+def test_batch_numpy_matches_scalar():
+    pytest.importorskip("numpy")
+    scores = analyze_compatibility_batch(DAY_STEMS, DAY_BRANCHES, DAY_STEMS, DAY_BRANCHES)
+    assert scores.shape == (len(DAY_STEMS), len(DAY_STEMS))
+    _assert_matches_scalar(scores)
+
+
+def test_batch_numba_matches_scalar():
+    pytest.importorskip("numba")
+    old_min_pairs = bazi_utils.NUMBA_MIN_PAIRS
+    bazi_utils.NUMBA_MIN_PAIRS = 1
+    try:
+        scores = analyze_compatibility_batch(DAY_STEMS, DAY_BRANCHES, DAY_STEMS, DAY_BRANCHES)
+    finally:
+        bazi_utils.NUMBA_MIN_PAIRS = old_min_pairs
+    _assert_matches_scalar(scores)
+
+
+def test_batch_pure_python_fallback_matches_scalar():
+    old_available = bazi_utils.NUMPY_AVAILABLE
+    bazi_utils.NUMPY_AVAILABLE = False
+    try:
+        scores = analyze_compatibility_batch(DAY_STEMS, DAY_BRANCHES, DAY_STEMS, DAY_BRANCHES)
+    finally:
+        bazi_utils.NUMPY_AVAILABLE = old_available
+    assert isinstance(scores, list)
+    _assert_matches_scalar(scores)
+
+
+if __name__ == "__main__":
+    test_batch_pure_python_fallback_matches_scalar()
+    print("SUCCESS: batch scores match analyze_compatibility.")
@@ -0,0 +1,80 @@
+import sys
+import os
+import random
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from text_utils import IncrementalMarkdownCleaner, clean_markdown_for_display
+
+# Fragments that exercise every display regex and the paragraph-split guard
+TOKENS = [
+    "\n", "\n\n", "\n\n\n", " ", "\t", "#", "##", "### ", "#### 标题", "- ", "* ", "• ", "1. ", "12.",
+    "**", "*", "__", "_", "(", ")", " (Career)", "abc", "命格", "word_word", "a*b", "x", "9",
+]
+
+SAMPLE_REPLY = """### 1. 🏛️ 命局总评 (Overview)
+
+你的八字是**七杀格**，日主_身强_。
+
+- **性格**：果断、*有魄力*
+- **建议**：多接触__木火__
+
+#### 2. 💼 事业 (Career)
+
+1. 适合管理岗位
+2. 避免冲动
+
+普通段落，结尾没有换行"""
+
+
+def _random_chunks(text, rng):
+    chunks = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 8)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def _assert_streams_like_full_cleaner(chunks):
+    cleaner = IncrementalMarkdownCleaner()
+    received = ""
+    for chunk in chunks:
+        cleaner.feed(chunk)
+        received += chunk
+        assert cleaner.render() == clean_markdown_for_display(received), repr(received)
+
+
+def test_regression_bare_marker_before_blank_lines():
+    text = "##\n\n\nabc•##\n"
+    _assert_streams_like_full_cleaner(list(text))
+    _assert_streams_like_full_cleaner([text])
+
+
+def test_sample_reply_any_chunking():
+    rng = random.Random(0)
+    _assert_streams_like_full_cleaner([SAMPLE_REPLY])
+    _assert_streams_like_full_cleaner(list(SAMPLE_REPLY))
+    for _ in range(200):
+        _assert_streams_like_full_cleaner(_random_chunks(SAMPLE_REPLY, rng))
+
+
+def test_random_markdown_any_chunking():
+    rng = random.Random(42)
+    for _ in range(2000):
+        text = "".join(rng.choice(TOKENS) for _ in range(rng.randint(1, 30)))
+        _assert_streams_like_full_cleaner(_random_chunks(text, rng))
+
+
+def test_empty_deltas_are_ignored():
+    _assert_streams_like_full_cleaner(["", "# 标题", "", "\n\n正文", ""])
+
+
+if __name__ == "__main__":
+    test_regression_bare_marker_before_blank_lines()
+    test_sample_reply_any_chunking()
+    test_random_markdown_any_chunking()
+    test_empty_deltas_are_ignored()
+    print("SUCCESS: incremental cleaner matches clean_markdown_for_display.")
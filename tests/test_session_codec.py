@@ -0,0 +1,80 @@
+import sys
+import os
+import json
+
+import pytest
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import session_codec
+from session_codec import pack_snapshot, unpack_snapshot
+
+SNAPSHOT = {
+    "_stable": {
+        "bazi_result": "甲子 乙丑 丙寅 丁卯",
+        "pattern_info": {"pattern_name": "七杀格", "joy_elements": ["木", "火"]},
+        "bazi_svg": None,
+    },
+    "_delta": {
+        "clicked_topics": ["整体命格"],
+        "responses": [["整体命格", "📌 整体命格", "**命格** \"引号\" & <b>标签</b>\n第二行"]],
+        "is_first_response": False,
+        "custom_question_count": 2,
+    },
+}
+
+
+def _without_orjson():
+    old_available = session_codec.ORJSON_AVAILABLE
+    session_codec.ORJSON_AVAILABLE = False
+    return old_available
+
+
+def test_packed_round_trip():
+    payload = pack_snapshot(SNAPSHOT)
+    assert not payload.startswith("{")
+    # base64url: safe inside URLs / JS string literals without escaping
+    assert set(payload) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+    assert unpack_snapshot(payload) == SNAPSHOT
+
+
+def test_packed_round_trip_without_padding_and_whitespace():
+    payload = pack_snapshot(SNAPSHOT).rstrip("=")
+    assert unpack_snapshot("  " + payload + "\n") == SNAPSHOT
+
+
+def test_legacy_plain_json_payload():
+    legacy = json.dumps(SNAPSHOT, ensure_ascii=False)
+    assert unpack_snapshot(legacy) == SNAPSHOT
+    assert unpack_snapshot(json.dumps(SNAPSHOT)) == SNAPSHOT
+
+
+def test_stdlib_fallback_round_trip():
+    old_available = _without_orjson()
+    try:
+        payload = pack_snapshot(SNAPSHOT)
+        assert unpack_snapshot(payload) == SNAPSHOT
+        assert unpack_snapshot(json.dumps(SNAPSHOT)) == SNAPSHOT
+        assert session_codec.loads_json(session_codec.dumps_json(SNAPSHOT)) == SNAPSHOT
+    finally:
+        session_codec.ORJSON_AVAILABLE = old_available
+
+
+def test_orjson_and_stdlib_payloads_are_interchangeable():
+    pytest.importorskip("orjson")
+    orjson_payload = pack_snapshot(SNAPSHOT)
+    old_available = _without_orjson()
+    try:
+        stdlib_payload = pack_snapshot(SNAPSHOT)
+        assert unpack_snapshot(orjson_payload) == SNAPSHOT
+    finally:
+        session_codec.ORJSON_AVAILABLE = old_available
+    assert unpack_snapshot(stdlib_payload) == SNAPSHOT
+
+
+if __name__ == "__main__":
+    test_packed_round_trip()
+    test_legacy_plain_json_payload()
+    test_stdlib_fallback_round_trip()
+    print("SUCCESS: session snapshots round-trip.")
@@ -17,6 +17,11 @@ _MD_HEADER_TRANSLATION_RE = re.compile(r'^(#+\s+.*?)\s*\([^)]*\)', re.MULTILINE)
 _MD_DOUBLE_NEWLINE_RE = re.compile(r'\n\n')
 _MD_SINGLE_NEWLINE_RE = re.compile(r'\n')
 
+# Paragraph break followed by plain text: no display regex can match across it
+_MD_SAFE_SPLIT_RE = re.compile(r'\n\n(?=[^\s\-*•#\d])')
+# A line made only of a header/list marker lets \s* / \s+ run on into the following lines
+_MD_BARE_MARKER_LINE_RE = re.compile(r'[ \t]*(?:#{1,6}|[-*•]|\d+\.)[ \t]*')
+
 _HTML_TAG_RE = re.compile(r'<[^>]+>')
 _MD_PDF_HEADER_RE = re.compile(r'^#{1,6}\s*(.+?)$', re.MULTILINE)
 _MD_PDF_BOLD_ASTERISK_RE = re.compile(r'\*\*(.+?)\*\*')
@@ -69,6 +74,42 @@ def clean_markdown_for_display(text: str) -> str:
     return text
 
 
+class IncrementalMarkdownCleaner:
+    """
+    clean_markdown_for_display for a growing stream.
+
+    Text up to the last paragraph break that no display regex can match across
+    is cleaned once and kept; only the open tail after it is re-cleaned on render,
+    so streaming a reply costs O(N) instead of re-cleaning the whole buffer per update.
+    """
+
+    def __init__(self) -> None:
+        self._done_html: list[str] = []
+        self._tail = ""
+
+    def feed(self, delta: str) -> None:
+        """Append a streamed delta and finalize any completed paragraphs."""
+        if not delta:
+            return
+        # Re-scan a few chars back so a break split across deltas is still found
+        scan_from = max(0, len(self._tail) - 2)
+        self._tail += delta
+        split_at = -1
+        for match in _MD_SAFE_SPLIT_RE.finditer(self._tail, scan_from):
+            # The last non-blank line before the break must not be a bare marker
+            line_end = len(self._tail[:match.start()].rstrip())
+            line_start = self._tail.rfind("\n", 0, line_end) + 1
+            if not _MD_BARE_MARKER_LINE_RE.fullmatch(self._tail, line_start, line_end):
+                split_at = match.end()
+        if split_at > 0:
+            self._done_html.append(clean_markdown_for_display(self._tail[:split_at]))
+            self._tail = self._tail[split_at:]
+
+    def render(self) -> str:
+        """Cleaned HTML for everything fed so far."""
+        return "".join(self._done_html) + clean_markdown_for_display(self._tail)
+
+
 def clean_text_for_pdf(text: str) -> str:
     """
     Clean markdown formatting from text for PDF display.
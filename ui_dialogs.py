@@ -0,0 +1,68 @@
+"""
+Streamlit dialogs used by app.py.
+Defined in an imported module so the @st.dialog wrappers are built once per
+process instead of being re-decorated on every rerun of the app script.
+"""
+import streamlit as st
+
+from db_utils import profile_exists, save_profile
+
+# Suffixes of the _save_* session keys the dialog reads (defaults live in _make_session_defaults)
+SAVE_DIALOG_FIELDS = ("gender", "year", "month", "day", "hour", "city", "is_lunar")
+
+
+@st.dialog("保存档案")
+def save_profile_dialog() -> None:
+    """Dialog to save current form values as a profile with user-defined ID."""
+    st.markdown("为当前输入的信息设置一个唯一ID，以便日后快速加载。")
+    
+    new_profile_id = st.text_input(
+        "档案ID",
+        placeholder="输入字母/数字组合，如: Boss123",
+        max_chars=50
+    )
+    
+    col_confirm, col_cancel = st.columns(2)
+    with col_confirm:
+        if st.button("✓ 确认保存", use_container_width=True, type="primary"):
+            if not new_profile_id.strip():
+                st.error("请输入档案ID")
+            elif profile_exists(new_profile_id.strip()):
+                st.error("❌ ID已存在，请换一个")
+            else:
+                # Form values captured into _save_* before the dialog opened; read them once
+                profile_id = new_profile_id.strip()
+                values = {key: st.session_state[f"_save_{key}"] for key in SAVE_DIALOG_FIELDS}
+                save_success = save_profile(
+                    profile_id=profile_id,
+                    gender=values["gender"],
+                    birth_year=values["year"],
+                    birth_month=values["month"],
+                    birth_day=values["day"],
+                    birth_hour=values["hour"],
+                    city=values["city"],
+                    is_lunar=values["is_lunar"]
+                )
+                if save_success:
+                    # Update session state immediately to sync with daily divination
+                    st.session_state.loaded_profile_id = profile_id
+                    st.session_state.loaded_profile = {
+                        "id": profile_id,
+                        "gender": values["gender"],
+                        "birth_year": values["year"],
+                        "birth_month": values["month"],
+                        "birth_day": values["day"],
+                        "birth_hour": values["hour"],
+                        "city": values["city"]
+                    }
+                    
+                    # A toast survives the rerun, so the dialog can close immediately
+                    st.toast(f"✓ 档案 '{new_profile_id.strip()}' 已保存!")
+                    st.balloons()
+                    st.rerun()  # Close dialog by rerunning
+                else:
+                    st.error("保存失败")
+    
+    with col_cancel:
+        if st.button("✕ 取消", use_container_width=True):
+            st.rerun()
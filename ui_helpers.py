@@ -0,0 +1,146 @@
+"""
+Pure UI helpers for the Streamlit app: selectbox option/label tables,
+date/time parsing, the birth-info FormState and small HTML snippets.
+Streamlit re-executes app.py on every rerun, so module constants and lru_caches
+defined there are rebuilt each time; living in an imported module they persist
+for the whole process.
+"""
+from __future__ import annotations
+
+import calendar
+from dataclasses import dataclass, field
+from datetime import date
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# Lunar day labels for days 1-30, built once (index 0 = day 1)
+_DAY_DIGITS = ("一", "二", "三", "四", "五", "六", "七", "八", "九", "十")
+LUNAR_DAY_NAMES = tuple(
+    f"初{x}" if x <= 10 else (f"十{_DAY_DIGITS[x - 11]}" if x <= 20 else (f"廿{_DAY_DIGITS[x - 21]}" if x < 30 else "三十"))
+    for x in range(1, 31)
+)
+
+
+def format_lunar_day(day: int) -> str:
+    """format_func for the lunar day selectboxes."""
+    return LUNAR_DAY_NAMES[day - 1]
+
+
+# Solar date / clock labels, built once so format_func is a plain lookup
+FIRST_SELECTABLE_YEAR = 1900
+YEAR_LABELS = tuple(f"{y}年" for y in range(FIRST_SELECTABLE_YEAR, date.today().year + 1))
+MONTH_LABELS = tuple(f"{m}月" for m in range(1, 13))
+DAY_LABELS = tuple(f"{d}日" for d in range(1, 32))
+TWO_DIGIT_LABELS = tuple(f"{n:02d}" for n in range(60))
+
+
+def format_year(year: int) -> str:
+    """format_func for the solar year selectbox (labels beyond the import year are formatted on demand)."""
+    offset = year - FIRST_SELECTABLE_YEAR
+    return YEAR_LABELS[offset] if offset < len(YEAR_LABELS) else f"{year}年"
+
+
+def format_month(month: int) -> str:
+    """format_func for the solar month selectbox."""
+    return MONTH_LABELS[month - 1]
+
+
+def format_day(day: int) -> str:
+    """format_func for the solar day selectbox."""
+    return DAY_LABELS[day - 1]
+
+
+def format_two_digits(value: int) -> str:
+    """format_func for hour/minute selectboxes."""
+    return TWO_DIGIT_LABELS[value]
+
+
+@lru_cache(maxsize=2048)
+def days_in_month(year: int, month: int) -> int:
+    """Number of days in a solar month."""
+    return calendar.monthrange(year, month)[1]
+
+
+@lru_cache(maxsize=4)
+def day_options(num_days: int) -> tuple:
+    """Day-of-month options 1..num_days (only 28-31 ever occur)."""
+    return tuple(range(1, num_days + 1))
+
+
+@lru_cache(maxsize=2)
+def year_options(current_year: int) -> tuple:
+    """Selectable birth years, newest first (current_year down to FIRST_SELECTABLE_YEAR)."""
+    return tuple(range(current_year, FIRST_SELECTABLE_YEAR - 1, -1))
+
+
+def year_index(year: int, current_year: int) -> int:
+    """Position of year in year_options(current_year); 0 (newest) when out of range."""
+    return current_year - year if FIRST_SELECTABLE_YEAR <= year <= current_year else 0
+
+
+def safe_date(year, month, day, default: date = date(1990, 1, 1)) -> date:
+    """date(year, month, day) when the parts form a valid date, otherwise default."""
+    if (
+        all(type(part) is int for part in (year, month, day))
+        and 1 <= year <= 9999
+        and 1 <= month <= 12
+        and 1 <= day <= days_in_month(year, month)
+    ):
+        return date(year, month, day)
+    return default
+
+
+@dataclass
+class FormState:
+    """
+    Main birth-info form inputs, kept together in st.session_state.form.
+    Widgets keep their own flat *_widget keys (Streamlit requires them);
+    this object holds the values they are seeded from and write back to.
+    """
+    gender: str = "男"
+    birth_date: date = field(default_factory=lambda: date(1990, 1, 1))
+    birth_hour: int = 12
+    birth_minute: int = 0
+    lunar_year: int = 1990
+    lunar_month: str = "1月"
+    lunar_day: int = 1
+
+
+def parse_hh_mm(text: str) -> Optional[Tuple[int, int]]:
+    """Parse "HH:MM" into (hour, minute); None if the text is not two plain numbers."""
+    hour, _, minute = text.partition(":")
+    hour, minute = hour.strip(), minute.strip()
+    if hour.isdecimal() and minute.isdecimal():
+        return int(hour), int(minute)
+    return None
+
+
+@lru_cache(maxsize=64)
+def profile_card_html(profile_id: str, gender: str, year: int, month: int, day: int) -> str:
+    """Sidebar card for the loaded profile (cached per profile)."""
+    return f"""
+        <div style="background: rgba(255, 215, 0, 0.1); border-radius: 8px; padding: 10px; margin-top: 10px;">
+            <small style="color: #ffd700;">📋 当前: <b>{profile_id}</b></small><br>
+            <small style="color: #ccc;">{gender} | {year}年{month}月{day}日</small>
+        </div>
+        """
+
+
+@lru_cache(maxsize=64)
+def loaded_profile_notice_html(profile_id: str, gender: str, year: int, month: int, day: int) -> str:
+    """Main-page notice shown after loading a profile (cached per profile)."""
+    return f"""
+    <div style="background: rgba(76, 175, 80, 0.1); border: 1px solid rgba(76, 175, 80, 0.3); 
+                border-radius: 10px; padding: 12px; margin-bottom: 15px;">
+        <span style="color: #4CAF50;">✓ 已加载档案:</span>
+        <strong style="color: #ffd700;">{profile_id}</strong>
+        <span style="color: #ccc;"> ({gender} | {year}年{month}月{day}日)</span>
+    </div>
+    """
+
+
+@lru_cache(maxsize=32)
+def chart_container_html(svg: str, css_class: str = "bazi-chart-container", style: str = "") -> str:
+    """Wrap a chart SVG in its centering container (cached, so reruns reuse the wrapped string)."""
+    style_attr = f' style="{style}"' if style else ""
+    return f'<div class="{css_class}"{style_attr}>{svg}</div>'